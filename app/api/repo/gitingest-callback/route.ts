@@ -1,14 +1,51 @@
 import { NextRequest, NextResponse } from 'next/server';
+import zlib from 'node:zlib';
 import { convexClient } from '@/lib/convex/server';
 import { api } from '@/convex/_generated/api';
 import { GitIngestWebhookPayload } from '@/lib/gitingest/client';
+import { applyReportDelta } from '@/lib/gitingest/delta';
 import { fetchRepositoryMetadata } from '@/lib/github/metadata';
 
 export const dynamic = 'force-dynamic';
 
+class UnsupportedEncodingError extends Error {}
+
+/**
+ * Read the callback body, decompressing it when the service sends
+ * Content-Encoding: gzip or zstd (WEBHOOK_COMPRESSION)
+ */
+async function readPayload(request: NextRequest): Promise<GitIngestWebhookPayload> {
+  const encoding = request.headers.get('content-encoding')?.toLowerCase();
+  if (!encoding || encoding === 'identity') {
+    return request.json();
+  }
+
+  const body = Buffer.from(await request.arrayBuffer());
+  // zstd is only built into Node.js 22.15 and later
+  const zstdDecompressSync = (zlib as { zstdDecompressSync?: (buf: Buffer) => Buffer })
+    .zstdDecompressSync;
+  let decoded: Buffer;
+  if (encoding === 'gzip') {
+    decoded = zlib.gunzipSync(body);
+  } else if (encoding === 'zstd' && zstdDecompressSync) {
+    decoded = zstdDecompressSync(body);
+  } else {
+    throw new UnsupportedEncodingError(`Unsupported Content-Encoding: ${encoding}`);
+  }
+  return JSON.parse(decoded.toString('utf8'));
+}
+
 export async function POST(request: NextRequest) {
   try {
-    const payload: GitIngestWebhookPayload = await request.json();
+    let payload: GitIngestWebhookPayload;
+    try {
+      payload = await readPayload(request);
+    } catch (error: unknown) {
+      if (error instanceof UnsupportedEncodingError) {
+        return NextResponse.json({ error: error.message }, { status: 415 });
+      }
+      throw error;
+    }
 
     // Validate payload
     if (!payload.jobId || !payload.repoUrl || !payload.status) {
@@ -35,12 +72,25 @@ export async function POST(request: NextRequest) {
       );
     }
 
+    // Delta payloads only carry the changes since the last report we stored
+    let report = payload.report;
+    if (payload.status === 'completed' && !report && payload.reportDelta) {
+      report = applyReportDelta(repo.gitingestReport, payload.reportDelta) ?? undefined;
+      if (!report) {
+        // Tells the service to resend the full report
+        return NextResponse.json(
+          { error: 'Report delta does not match the stored report' },
+          { status: 409 }
+        );
+      }
+    }
+
     // Update repository with report results
-    if (payload.status === 'completed' && payload.report) {
+    if (payload.status === 'completed' && report) {
       await convexClient.mutation(api.repos.updateGitIngestReport, {
         repoId: repo._id,
         status: 'completed',
-        report: payload.report,
+        report,
       });
     } else if (payload.status === 'failed') {
       await convexClient.mutation(api.repos.updateGitIngestReport, {
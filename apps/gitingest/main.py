@@ -3,22 +3,50 @@ GitIngest Service - FastAPI application for generating LLM-friendly repository r
 """
 import os
 import uuid
+import json
 import asyncio
 import logging
 import tempfile
 import shutil
-from typing import Optional
+import multiprocessing
+from abc import ABC, abstractmethod
+from collections import OrderedDict, deque
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Callable, Optional
 from datetime import datetime
 from pathlib import Path
 import re
+import time
+import hashlib
+import threading
+import sqlite3
+import zlib
+import gzip
+import random
 
-from fastapi import FastAPI, Header, HTTPException, BackgroundTasks, Depends
+from fastapi import FastAPI, Header, HTTPException, Depends, Query, Request
+from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel, HttpUrl
 import httpx
-from git import Repo, GitCommandError
-from pygments.lexers import get_lexer_for_filename, guess_lexer_for_filename
-from pygments.util import ClassNotFound
+from git import GitCommandError
+
+from pathfilter import GITATTRIBUTES_FILE, GITIGNORE_FILE, PathFilter, is_ignored_dir
+from walker import (
+    LANGUAGE_GUESS_SAMPLES,
+    classify_tree_shard,
+    guess_sample_languages,
+    merge_walk_results,
+    path_sort_key,
+    plan_walk_shards,
+    walk_shard,
+)
+
+try:
+    import zstandard
+except ImportError:  # Optional, only needed for WEBHOOK_COMPRESSION=zstd
+    zstandard = None
 
 # Configure logging
 logging.basicConfig(
@@ -27,7 +55,21 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-app = FastAPI(title="GitIngest Service", version="1.0.0")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Start and stop shared resources with the application"""
+    webhook_queue.start()
+    scheduler.start()
+    yield
+    await scheduler.stop()
+    await webhook_queue.stop()
+    shutdown_analysis_executor()
+    webhook_queue.close()
+    job_store.close()
+
+
+app = FastAPI(title="GitIngest Service", version="1.0.0", lifespan=lifespan)
 
 # CORS middleware for local development
 app.add_middleware(
@@ -45,9 +87,334 @@ if not API_KEY:
 
 GH_TOKEN = os.getenv("GH_TOKEN")  # Optional GitHub token for private repos
 MAX_TIMEOUT = int(os.getenv("MAX_TIMEOUT", "300"))  # 5 minutes default
+INGEST_WORKERS = max(1, int(os.getenv("INGEST_WORKERS", "2")))
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", "50"))
+INGEST_DEFAULT_DURATION = 30  # Seconds, until real job durations are known
+
+# Job store configuration
+JOB_STORE_BACKEND = os.getenv("JOB_STORE_BACKEND", "sqlite").lower()  # "sqlite" or "memory"
+JOB_STORE_PATH = Path(os.getenv("JOB_STORE_PATH", os.path.join(tempfile.gettempdir(), "gitingest", "jobs.sqlite3")))
+JOB_TTL = int(os.getenv("JOB_TTL", "86400"))  # 24 hours default
+JOB_STORE_MAX_REPORT_BYTES = int(os.getenv("JOB_STORE_MAX_REPORT_BYTES", str(256 * 1024 ** 2)))  # 256 MB compressed
+
+TERMINAL_JOB_STATUSES = ("completed", "failed")
+
+
+def _compress_report(report: dict) -> bytes:
+    return zlib.compress(json.dumps(report).encode(), 6)
+
+
+def _decompress_report(data: bytes) -> dict:
+    return json.loads(zlib.decompress(data))
+
+
+class JobStore(ABC):
+    """
+    Interface for ingest job storage.
+
+    Jobs are plain dicts. Reports are stored compressed and separately from
+    the rest of the job, so they can be skipped on reads and dropped under
+    the report byte cap (the job then carries "reportEvicted": true).
+    Finished jobs are removed once they are older than the TTL.
+    """
+
+    @abstractmethod
+    def create(self, job_id: str, job: dict) -> None:
+        ...
+
+    @abstractmethod
+    def get(self, job_id: str, include_report: bool = True) -> Optional[dict]:
+        ...
+
+    @abstractmethod
+    def update(self, job_id: str, **fields) -> None:
+        """Merge fields into a job; a "report" field is stored compressed"""
+
+    @abstractmethod
+    def delete(self, job_id: str) -> None:
+        ...
+
+    @abstractmethod
+    def unfinished(self) -> list[tuple[str, dict]]:
+        """Jobs that were queued or running, oldest first"""
+
+    @abstractmethod
+    def evict(self) -> None:
+        """Drop expired jobs and enforce the report byte cap"""
+
+    def close(self) -> None:
+        pass
+
+
+class MemoryJobStore(JobStore):
+    """In-process job store, lost on restart"""
+
+    def __init__(self, ttl_seconds: int, max_report_bytes: int):
+        self.ttl_seconds = ttl_seconds
+        self.max_report_bytes = max_report_bytes
+        # job id -> (job fields, compressed report, updated at), least recently updated first
+        self._jobs: OrderedDict[str, tuple[dict, Optional[bytes], float]] = OrderedDict()
+        self._report_bytes = 0
+        # Called from worker threads; re-entrant because update() and create() evict
+        self._lock = threading.RLock()
+
+    def create(self, job_id: str, job: dict) -> None:
+        with self._lock:
+            self._jobs[job_id] = (dict(job), None, time.time())
+            self.evict()
+
+    def get(self, job_id: str, include_report: bool = True) -> Optional[dict]:
+        with self._lock:
+            entry = self._jobs.get(job_id)
+            if entry is None:
+                return None
+            job, report, _ = entry
+            job = dict(job)
+        if include_report and report is not None:
+            job["report"] = _decompress_report(report)
+        return job
+
+    def update(self, job_id: str, **fields) -> None:
+        new_report = _compress_report(fields.pop("report")) if "report" in fields else None
+        with self._lock:
+            if job_id not in self._jobs:
+                return
+            job, report, _ = self._jobs.pop(job_id)
+            if new_report is not None:
+                if report is not None:
+                    self._report_bytes -= len(report)
+                report = new_report
+                self._report_bytes += len(report)
+            job.update(fields)
+            self._jobs[job_id] = (job, report, time.time())
+            self.evict()
+
+    def delete(self, job_id: str) -> None:
+        with self._lock:
+            entry = self._jobs.pop(job_id, None)
+            if entry and entry[1] is not None:
+                self._report_bytes -= len(entry[1])
+
+    def unfinished(self) -> list[tuple[str, dict]]:
+        with self._lock:
+            return [
+                (job_id, dict(job))
+                for job_id, (job, _, _) in self._jobs.items()
+                if job.get("status") not in TERMINAL_JOB_STATUSES
+            ]
+
+    def evict(self) -> None:
+        with self._lock:
+            cutoff = time.time() - self.ttl_seconds
+            for job_id, (job, _, updated_at) in list(self._jobs.items()):
+                if updated_at >= cutoff:
+                    break
+                if job.get("status") in TERMINAL_JOB_STATUSES:
+                    self.delete(job_id)
+            for job_id, (job, report, updated_at) in list(self._jobs.items()):
+                if self._report_bytes <= self.max_report_bytes:
+                    break
+                if report is not None:
+                    self._report_bytes -= len(report)
+                    job["reportEvicted"] = True
+                    self._jobs[job_id] = (job, None, updated_at)
+
+
+class SQLiteJobStore(JobStore):
+    """Job store backed by a local SQLite database, so jobs survive restarts"""
+
+    def __init__(self, path: Path, ttl_seconds: int, max_report_bytes: int):
+        self.ttl_seconds = ttl_seconds
+        self.max_report_bytes = max_report_bytes
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(path), check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                data TEXT NOT NULL,
+                report BLOB,
+                report_bytes INTEGER NOT NULL DEFAULT 0,
+                updated_at REAL NOT NULL
+            )
+        """)
+        self._db.execute("CREATE INDEX IF NOT EXISTS jobs_updated_at ON jobs (updated_at)")
+        self.evict()
+
+    def create(self, job_id: str, job: dict) -> None:
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO jobs (id, status, data, updated_at) VALUES (?, ?, ?, ?)",
+                (job_id, job.get("status", "queued"), json.dumps(job), time.time())
+            )
+
+    def get(self, job_id: str, include_report: bool = True) -> Optional[dict]:
+        columns = "data, report" if include_report else "data, NULL"
+        with self._lock:
+            row = self._db.execute(f"SELECT {columns} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = json.loads(row[0])
+        if row[1] is not None:
+            job["report"] = _decompress_report(row[1])
+        return job
+
+    def update(self, job_id: str, **fields) -> None:
+        report = _compress_report(fields.pop("report")) if "report" in fields else None
+        with self._lock:
+            row = self._db.execute("SELECT data FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                return
+            job = json.loads(row[0])
+            job.update(fields)
+            if report is not None:
+                self._db.execute(
+                    "UPDATE jobs SET status = ?, data = ?, report = ?, report_bytes = ?, updated_at = ? WHERE id = ?",
+                    (job.get("status", "queued"), json.dumps(job), report, len(report), time.time(), job_id)
+                )
+            else:
+                self._db.execute(
+                    "UPDATE jobs SET status = ?, data = ?, updated_at = ? WHERE id = ?",
+                    (job.get("status", "queued"), json.dumps(job), time.time(), job_id)
+                )
+        if report is not None or job.get("status") in TERMINAL_JOB_STATUSES:
+            self.evict()
+
+    def delete(self, job_id: str) -> None:
+        with self._lock:
+            self._db.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+
+    def unfinished(self) -> list[tuple[str, dict]]:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id, data FROM jobs WHERE status NOT IN (?, ?) ORDER BY updated_at",
+                TERMINAL_JOB_STATUSES
+            ).fetchall()
+        return [(job_id, json.loads(data)) for job_id, data in rows]
+
+    def evict(self) -> None:
+        with self._lock:
+            self._db.execute(
+                "DELETE FROM jobs WHERE updated_at < ? AND status IN (?, ?)",
+                (time.time() - self.ttl_seconds, *TERMINAL_JOB_STATUSES)
+            )
+            total = self._db.execute("SELECT COALESCE(SUM(report_bytes), 0) FROM jobs").fetchone()[0]
+            if total <= self.max_report_bytes:
+                return
+            rows = self._db.execute(
+                "SELECT id, data, report_bytes FROM jobs WHERE report IS NOT NULL ORDER BY updated_at"
+            ).fetchall()
+            for job_id, data, report_bytes in rows:
+                if total <= self.max_report_bytes:
+                    break
+                job = json.loads(data)
+                job["reportEvicted"] = True
+                self._db.execute(
+                    "UPDATE jobs SET data = ?, report = NULL, report_bytes = 0 WHERE id = ?",
+                    (json.dumps(job), job_id)
+                )
+                total -= report_bytes
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+def create_job_store() -> JobStore:
+    if JOB_STORE_BACKEND == "memory":
+        return MemoryJobStore(JOB_TTL, JOB_STORE_MAX_REPORT_BYTES)
+    return SQLiteJobStore(JOB_STORE_PATH, JOB_TTL, JOB_STORE_MAX_REPORT_BYTES)
+
+
+job_store = create_job_store()
+
+
+# Progress event configuration
+JOB_EVENT_HISTORY = 500  # Events kept per job for replay
+JOB_EVENT_RETENTION = int(os.getenv("JOB_EVENT_RETENTION", "600"))  # Seconds to keep events of finished jobs
+JOB_EVENT_HEARTBEAT = 15  # Seconds between SSE keep-alives
+
+TERMINAL_EVENT_PHASES = ("done", "failed")
+
+ProgressCallback = Callable[..., None]
+
+
+class JobEventBus:
+    """
+    In-memory log of progress events per job.
+
+    Each event is a dict with a per-job sequence number, a phase (queued,
+    cloning, walking, parsing, done, failed, ...) and phase-specific stats.
+    Subscribers replay the log from a sequence number and then follow new
+    events until a terminal phase. Events are only published from the
+    event loop, so no locking is needed.
+    """
+
+    def __init__(self, history_limit: int, retention_seconds: int):
+        self.history_limit = history_limit
+        self.retention_seconds = retention_seconds
+        self._events: dict[str, list[dict]] = {}
+        self._seq: dict[str, int] = {}
+        self._waiters: dict[str, asyncio.Event] = {}
+        # job id -> monotonic time the job finished
+        self._finished: OrderedDict[str, float] = OrderedDict()
+
+    def has(self, job_id: str) -> bool:
+        return job_id in self._events
+
+    def publish(self, job_id: str, phase: str, **stats) -> None:
+        self._expire()
+        seq = self._seq.get(job_id, 0) + 1
+        self._seq[job_id] = seq
+        events = self._events.setdefault(job_id, [])
+        events.append({"seq": seq, "phase": phase, "ts": int(time.time() * 1000), **stats})
+        if len(events) > self.history_limit:
+            del events[:len(events) - self.history_limit]
+        if phase in TERMINAL_EVENT_PHASES:
+            self._finished[job_id] = time.monotonic()
+        waiter = self._waiters.pop(job_id, None)
+        if waiter:
+            waiter.set()
+
+    def progress_callback(self, job_id: str) -> ProgressCallback:
+        return lambda phase, **stats: self.publish(job_id, phase, **stats)
+
+    async def follow(self, job_id: str, after: int = 0):
+        """
+        Yield events with a sequence number above `after`, then new events as
+        they are published. Yields None when no event arrived within the
+        heartbeat interval. Stops after a terminal event.
+        """
+        while True:
+            for event in list(self._events.get(job_id, [])):
+                if event["seq"] <= after:
+                    continue
+                yield event
+                after = event["seq"]
+                if event["phase"] in TERMINAL_EVENT_PHASES:
+                    return
+            if job_id not in self._events:
+                return
+            waiter = self._waiters.setdefault(job_id, asyncio.Event())
+            try:
+                await asyncio.wait_for(waiter.wait(), timeout=JOB_EVENT_HEARTBEAT)
+            except asyncio.TimeoutError:
+                yield None
+
+    def _expire(self) -> None:
+        cutoff = time.monotonic() - self.retention_seconds
+        while self._finished:
+            job_id, finished_at = next(iter(self._finished.items()))
+            if finished_at >= cutoff:
+                break
+            del self._finished[job_id]
+            self._events.pop(job_id, None)
+            self._seq.pop(job_id, None)
+
 
-# In-memory job storage (in production, use Redis or database)
-jobs: dict[str, dict] = {}
+event_bus = JobEventBus(JOB_EVENT_HISTORY, JOB_EVENT_RETENTION)
 
 
 class IngestRequest(BaseModel):
@@ -84,168 +451,113 @@ async def verify_api_key(authorization: Optional[str] = Header(None)) -> None:
         )
 
 
-async def analyze_repository(repo_path: Path) -> dict:
-    """Analyze repository structure and generate report"""
-    structure = {
-        "directories": [],
-        "fileCount": 0,
-        "languages": set(),
-        "entryPoints": []
-    }
-    
-    patterns = {
-        "framework": "unknown",
-        "architecture": "unknown",
-        "testing": [],
-        "buildTools": []
-    }
-    
+# Analysis executor configuration
+ANALYZE_WORKERS = max(1, int(os.getenv("ANALYZE_WORKERS", str(os.cpu_count() or 1))))
+ANALYZE_EXECUTOR = os.getenv("ANALYZE_EXECUTOR", "process").lower()  # "process" or "thread"
+ANALYZE_MODE = os.getenv("ANALYZE_MODE", "tree").lower()  # "tree" (object database) or "worktree"
+WALK_SHARDS_PER_WORKER = 4
+
+_analysis_executor: Optional[Executor] = None
+
+
+def get_analysis_executor() -> Executor:
+    """Return the shared executor used to walk repository shards"""
+    global _analysis_executor
+    if _analysis_executor is None:
+        if ANALYZE_EXECUTOR == "thread":
+            _analysis_executor = ThreadPoolExecutor(
+                max_workers=ANALYZE_WORKERS,
+                thread_name_prefix="gitingest-walk"
+            )
+        else:
+            # spawn avoids forking a process that is running an event loop and threads
+            _analysis_executor = ProcessPoolExecutor(
+                max_workers=ANALYZE_WORKERS,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        logger.info(f"Started {ANALYZE_EXECUTOR} analysis executor with {ANALYZE_WORKERS} workers")
+    return _analysis_executor
+
+
+def shutdown_analysis_executor() -> None:
+    """Shut down the shared analysis executor, if it was started"""
+    global _analysis_executor
+    if _analysis_executor is not None:
+        _analysis_executor.shutdown(wait=False, cancel_futures=True)
+        _analysis_executor = None
+
+
+def _parse_manifest(name: str, content: str, dependencies: dict) -> None:
+    """Extract dependency names from a package manifest"""
+    if name == "package.json":
+        pkg = json.loads(content)
+        if "dependencies" in pkg:
+            dependencies["runtime"].extend(list(pkg["dependencies"].keys())[:20])
+        if "devDependencies" in pkg:
+            dependencies["dev"].extend(list(pkg["devDependencies"].keys())[:20])
+    elif name == "requirements.txt":
+        deps = [line.strip().split('==')[0].split('>=')[0].split('<=')[0]
+                for line in content.splitlines() if line.strip() and not line.startswith('#')]
+        dependencies["runtime"].extend(deps[:20])
+    elif name == "Cargo.toml":
+        # Simple regex to extract dependencies
+        deps = re.findall(r'\[dependencies\]\s*\n((?:\w+\s*=.*\n?)+)', content)
+        if deps:
+            dep_names = re.findall(r'(\w+)\s*=', deps[0])
+            dependencies["runtime"].extend(dep_names[:20])
+
+
+def _collect_dependencies(manifests: dict[str, str]) -> dict:
+    """Collect dependencies from manifest contents, keyed by relative path"""
     dependencies = {
         "runtime": [],
         "dev": [],
-        "packageManager": "unknown"
     }
-    
-    # Common entry points
-    entry_point_patterns = [
-        "main.py", "app.py", "index.py", "server.py", "app.js", "index.js",
-        "main.ts", "index.ts", "main.go", "main.rs", "main.java", "App.java",
-        "index.html", "app.tsx", "App.tsx", "main.tsx"
+    for rel_path, content in manifests.items():
+        try:
+            _parse_manifest(os.path.basename(rel_path), content, dependencies)
+        except Exception:
+            pass
+    return dependencies
+
+
+def _read_files(repo_root: str, rel_paths: list[str], limit: Optional[int] = None) -> dict[str, str]:
+    """Read files from a checkout, optionally only their first `limit` characters"""
+    contents = {}
+    for rel_path in rel_paths:
+        try:
+            with open(os.path.join(repo_root, rel_path), 'r', encoding='utf-8', errors='ignore') as f:
+                contents[rel_path] = f.read(limit) if limit else f.read()
+        except OSError:
+            continue
+    return contents
+
+
+def _sample_paths(walk: dict) -> list[str]:
+    return [
+        rel_path
+        for rel_paths in walk["unresolved"].values()
+        for rel_path in rel_paths[:LANGUAGE_GUESS_SAMPLES]
     ]
-    
-    # Framework detection patterns
-    framework_patterns = {
-        "Next.js": ["next.config", "package.json"],
-        "React": ["package.json"],
-        "Vue": ["vue.config", "vite.config"],
-        "Django": ["manage.py", "settings.py"],
-        "Flask": ["app.py", "application.py"],
-        "FastAPI": ["main.py", "app.py"],
-        "Express": ["package.json", "server.js"],
-        "Spring Boot": ["pom.xml", "build.gradle"],
-        "Rails": ["Gemfile", "config.ru"],
+
+
+def _build_analysis(walk: dict, dependencies: dict) -> dict:
+    """Assemble the analysis result from merged walk results"""
+    # Convert sets to lists for JSON serialization
+    structure = {
+        "directories": sorted(set(walk["directories"])),
+        "fileCount": walk["fileCount"],
+        "languages": sorted(walk["languages"]),
+        "entryPoints": walk["entryPoints"]
     }
-    
-    # Build tool detection
-    build_tools = {
-        "npm": "package.json",
-        "yarn": "yarn.lock",
-        "pnpm": "pnpm-lock.yaml",
-        "pip": "requirements.txt",
-        "poetry": "pyproject.toml",
-        "cargo": "Cargo.toml",
-        "maven": "pom.xml",
-        "gradle": "build.gradle",
-        "go": "go.mod",
+
+    patterns = {
+        "framework": walk["framework"] or "unknown",
+        "architecture": "unknown",
+        "testing": walk["testing"],
+        "buildTools": walk["buildTools"]
     }
-    
-    # Walk through repository
-    import os
-    for root, dirs, files in os.walk(repo_path):
-        # Skip hidden directories and common ignore patterns
-        dirs[:] = [d for d in dirs if not d.startswith('.') and d not in ['node_modules', '__pycache__', 'venv', '.git']]
-        
-        rel_root = Path(root).relative_to(repo_path)
-        if str(rel_root) != '.':
-            structure["directories"].append(str(rel_root))
-        
-        for file in files:
-            if file.startswith('.'):
-                continue
-            
-            file_path = Path(root) / file
-            rel_path = file_path.relative_to(repo_path)
-            
-            structure["fileCount"] += 1
-            
-            # Detect language
-            try:
-                # Use get_lexer_for_filename which only needs the filename
-                lexer = get_lexer_for_filename(str(file_path))
-                lang = lexer.name
-                if lang not in ['Text only', 'Text']:
-                    structure["languages"].add(lang)
-            except (ClassNotFound, ValueError):
-                # If we can't detect from filename, try to guess from content
-                try:
-                    with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-                        content = f.read(1024)  # Read first 1KB
-                        if content.strip():
-                            lexer = guess_lexer_for_filename(str(file_path), content)
-                            lang = lexer.name
-                            if lang not in ['Text only', 'Text']:
-                                structure["languages"].add(lang)
-                except:
-                    pass
-            
-            # Check for entry points
-            if file in entry_point_patterns:
-                structure["entryPoints"].append(str(rel_path))
-            
-            # Check for framework indicators
-            for framework, indicators in framework_patterns.items():
-                if any(indicator in str(rel_path) for indicator in indicators):
-                    if patterns["framework"] == "unknown":
-                        patterns["framework"] = framework
-            
-            # Check for build tools
-            for tool, indicator in build_tools.items():
-                if file == indicator:
-                    if patterns["buildTools"] and tool not in patterns["buildTools"]:
-                        patterns["buildTools"].append(tool)
-                    elif not patterns["buildTools"]:
-                        patterns["buildTools"] = [tool]
-                    dependencies["packageManager"] = tool
-            
-            # Check for test files
-            if any(test_pattern in str(rel_path) for test_pattern in ['test_', '_test', '.test.', '.spec.', 'tests/']):
-                test_framework = "unknown"
-                if '.test.' in str(rel_path) or '.spec.' in str(rel_path):
-                    if 'jest' in str(rel_path) or 'package.json' in str(rel_path):
-                        test_framework = "Jest"
-                    elif 'pytest' in str(rel_path) or 'test_' in str(rel_path):
-                        test_framework = "pytest"
-                    elif 'unittest' in str(rel_path):
-                        test_framework = "unittest"
-                if test_framework not in patterns["testing"]:
-                    patterns["testing"].append(test_framework)
-            
-            # Parse package files for dependencies
-            if file == "package.json":
-                try:
-                    import json
-                    with open(file_path, 'r') as f:
-                        pkg = json.load(f)
-                        if "dependencies" in pkg:
-                            dependencies["runtime"].extend(list(pkg["dependencies"].keys())[:20])
-                        if "devDependencies" in pkg:
-                            dependencies["dev"].extend(list(pkg["devDependencies"].keys())[:20])
-                except:
-                    pass
-            elif file == "requirements.txt":
-                try:
-                    with open(file_path, 'r') as f:
-                        deps = [line.strip().split('==')[0].split('>=')[0].split('<=')[0] 
-                               for line in f if line.strip() and not line.startswith('#')]
-                        dependencies["runtime"].extend(deps[:20])
-                except:
-                    pass
-            elif file == "Cargo.toml":
-                try:
-                    with open(file_path, 'r') as f:
-                        content = f.read()
-                        # Simple regex to extract dependencies
-                        deps = re.findall(r'\[dependencies\]\s*\n((?:\w+\s*=.*\n?)+)', content)
-                        if deps:
-                            dep_names = re.findall(r'(\w+)\s*=', deps[0])
-                            dependencies["runtime"].extend(dep_names[:20])
-                except:
-                    pass
-    
-    # Convert sets to lists for JSON serialization
-    structure["languages"] = sorted(list(structure["languages"]))
-    structure["directories"] = sorted(structure["directories"])
-    
+
     # Architecture detection
     if any("src/" in d or "lib/" in d for d in structure["directories"]):
         patterns["architecture"] = "layered"
@@ -255,39 +567,567 @@ async def analyze_repository(repo_path: Path) -> dict:
         patterns["architecture"] = "MVC"
     else:
         patterns["architecture"] = "flat"
-    
+
     return {
         "structure": structure,
         "patterns": patterns,
-        "dependencies": dependencies
+        "dependencies": {
+            "runtime": dependencies["runtime"],
+            "dev": dependencies["dev"],
+            "packageManager": walk["packageManager"] or "unknown"
+        }
+    }
+
+
+async def _run_shards(fn: Callable[..., dict], shard_args: list[tuple], progress: Optional[ProgressCallback] = None) -> list[dict]:
+    """Run shards in the analysis executor, reporting progress as each one finishes"""
+    loop = asyncio.get_running_loop()
+    executor = get_analysis_executor()
+    futures = [loop.run_in_executor(executor, fn, *args) for args in shard_args]
+
+    if progress:
+        walked = {"shards": 0, "files": 0}
+
+        def on_shard_done(future: asyncio.Future) -> None:
+            if future.cancelled() or future.exception():
+                return
+            walked["shards"] += 1
+            walked["files"] += future.result()["fileCount"]
+            progress("walking", filesWalked=walked["files"], shardsDone=walked["shards"], shards=len(futures))
+
+        progress("walking", filesWalked=0, shardsDone=0, shards=len(futures))
+        for future in futures:
+            future.add_done_callback(on_shard_done)
+
+    return await asyncio.gather(*futures)
+
+
+async def analyze_repository(repo_path: Path, progress: Optional[ProgressCallback] = None) -> dict:
+    """
+    Analyze repository structure and generate report.
+
+    The walk never runs on the event loop: the tree is split into shards
+    that are walked in parallel by the analysis executor, and the partial
+    results are merged once every shard has finished.
+    """
+    repo_root = str(repo_path)
+
+    shards = await asyncio.to_thread(
+        plan_walk_shards, repo_root, ANALYZE_WORKERS * WALK_SHARDS_PER_WORKER
+    )
+    logger.info(f"Walking repository in {len(shards)} shards")
+
+    results = await _run_shards(
+        walk_shard, [(repo_root, shard_dir, recursive) for shard_dir, recursive in shards], progress
+    )
+    walk = merge_walk_results(results)
+
+    if progress:
+        progress("parsing", manifests=len(walk["manifests"]))
+    samples = await asyncio.to_thread(_read_files, repo_root, _sample_paths(walk), 1024)  # First 1KB
+    walk["languages"].update(guess_sample_languages(samples))
+
+    manifests = await asyncio.to_thread(_read_files, repo_root, walk["manifests"])
+    return _build_analysis(walk, _collect_dependencies(manifests))
+
+
+# Report cache configuration
+REPORT_CACHE_DIR = Path(os.getenv("REPORT_CACHE_DIR", os.path.join(tempfile.gettempdir(), "gitingest", "reports")))
+REPORT_CACHE_MAX_ENTRIES = int(os.getenv("REPORT_CACHE_MAX_ENTRIES", "500"))  # 0 disables the cache
+REPORT_CACHE_TTL = int(os.getenv("REPORT_CACHE_TTL", "86400"))  # 24 hours default
+LS_REMOTE_TIMEOUT = int(os.getenv("LS_REMOTE_TIMEOUT", "30"))
+
+
+class ReportCache:
+    """
+    On-disk report cache keyed by (repository URL, commit SHA).
+
+    The branch name is part of the key too, because it appears in the
+    report's summary and LLM context.
+
+    Each report is stored as a JSON file. Recency is tracked through the
+    file's mtime, so LRU order survives restarts; entries older than the
+    TTL are treated as misses and removed.
+    """
+
+    def __init__(self, directory: Path, max_entries: int, ttl_seconds: int):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        # key -> last access time, least recently used first
+        self._index: OrderedDict[str, float] = OrderedDict()
+
+        if self.enabled:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            entries = []
+            for path in self.directory.glob("*.json"):
+                try:
+                    entries.append((path.stat().st_mtime, path.stem))
+                except OSError:
+                    continue
+            for mtime, key in sorted(entries):
+                self._index[key] = mtime
+            self._evict()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    @staticmethod
+    def _key(repo_url: str, branch: str, commit_sha: str) -> str:
+        normalized = repo_url.rstrip("/").removesuffix(".git")
+        return hashlib.sha256(f"{normalized}\n{branch}\n{commit_sha}".encode()).hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.directory / f"{key}.json"
+
+    def _remove(self, key: str) -> None:
+        self._index.pop(key, None)
+        try:
+            self._path(key).unlink()
+        except FileNotFoundError:
+            pass
+
+    def _evict(self) -> None:
+        cutoff = time.time() - self.ttl_seconds
+        for key, accessed_at in list(self._index.items()):
+            if accessed_at >= cutoff:
+                break
+            self._remove(key)
+            self.evictions += 1
+        while len(self._index) > self.max_entries:
+            key = next(iter(self._index))
+            self._remove(key)
+            self.evictions += 1
+
+    def get(self, repo_url: str, branch: str, commit_sha: str) -> Optional[dict]:
+        """Return the cached report, or None on a miss"""
+        if not self.enabled:
+            return None
+        key = self._key(repo_url, branch, commit_sha)
+        with self._lock:
+            accessed_at = self._index.get(key)
+            if accessed_at is None or accessed_at < time.time() - self.ttl_seconds:
+                if accessed_at is not None:
+                    self._remove(key)
+                    self.evictions += 1
+                self.misses += 1
+                return None
+            try:
+                with open(self._path(key), "r") as f:
+                    report = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Dropping unreadable report cache entry {key}: {e}")
+                self._remove(key)
+                self.misses += 1
+                return None
+            now = time.time()
+            os.utime(self._path(key), (now, now))
+            self._index[key] = now
+            self._index.move_to_end(key)
+            self.hits += 1
+            return report
+
+    def put(self, repo_url: str, branch: str, commit_sha: str, report: dict) -> None:
+        """Store a report, evicting expired and least recently used entries"""
+        if not self.enabled:
+            return
+        key = self._key(repo_url, branch, commit_sha)
+        path = self._path(key)
+        # Write to a temp file first so readers never see a partial report
+        tmp_path = path.with_suffix(f".{uuid.uuid4().hex}.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(report, f)
+        with self._lock:
+            os.replace(tmp_path, path)
+            self._index[key] = time.time()
+            self._index.move_to_end(key)
+            self._evict()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._index),
+                "maxEntries": self.max_entries,
+                "ttlSeconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+report_cache = ReportCache(REPORT_CACHE_DIR, REPORT_CACHE_MAX_ENTRIES, REPORT_CACHE_TTL)
+
+
+def authenticated_url(repo_url: str) -> str:
+    """Add the GitHub token to a repository URL, if one is configured"""
+    if GH_TOKEN and "github.com" in repo_url:
+        # Use token for authentication if available
+        return repo_url.replace("https://", f"https://{GH_TOKEN}@")
+    return repo_url
+
+
+async def run_git_bytes(*args: str, input: Optional[bytes] = None, timeout: Optional[float] = None) -> bytes:
+    """Run a git command without blocking the event loop and return its raw stdout"""
+    process = await asyncio.create_subprocess_exec(
+        "git", *args,
+        stdin=asyncio.subprocess.PIPE if input is not None else asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        env={**os.environ, "GIT_TERMINAL_PROMPT": "0"},
+    )
+    # Never leak the token through error messages
+    command = [arg.replace(GH_TOKEN, "*****") if GH_TOKEN else arg for arg in ("git", *args)]
+    try:
+        stdout, stderr = await asyncio.wait_for(process.communicate(input), timeout=timeout)
+    except asyncio.TimeoutError:
+        process.kill()
+        await process.wait()
+        raise GitCommandError(command, "timeout", f"timed out after {timeout} seconds")
+
+    if process.returncode != 0:
+        raise GitCommandError(command, process.returncode, stderr.decode(errors="replace"))
+    return stdout
+
+
+async def run_git(*args: str, timeout: Optional[float] = None) -> str:
+    """Run a git command without blocking the event loop and return its stdout"""
+    return (await run_git_bytes(*args, timeout=timeout)).decode()
+
+
+async def resolve_commit_sha(repo_url: str, branch: str) -> Optional[str]:
+    """
+    Resolve the head commit of a branch with `git ls-remote`, without cloning.
+
+    Returns None if the branch cannot be resolved, in which case callers
+    should fall back to an uncached report.
+    """
+    try:
+        output = await run_git(
+            "ls-remote", authenticated_url(repo_url), f"refs/heads/{branch}",
+            timeout=LS_REMOTE_TIMEOUT,
+        )
+    except GitCommandError as e:
+        logger.warning(f"git ls-remote failed for {repo_url}: {e}")
+        return None
+
+    for line in output.splitlines():
+        sha, _, ref = line.partition("\t")
+        if ref == f"refs/heads/{branch}":
+            return sha
+    return None
+
+
+# Mirror pool configuration
+MIRROR_POOL_DIR = Path(os.getenv("MIRROR_POOL_DIR", os.path.join(tempfile.gettempdir(), "gitingest", "mirrors")))
+MIRROR_POOL_MAX_MIRRORS = int(os.getenv("MIRROR_POOL_MAX_MIRRORS", "20"))
+MIRROR_POOL_MAX_BYTES = int(os.getenv("MIRROR_POOL_MAX_BYTES", str(5 * 1024 ** 3)))  # 5 GB default
+
+
+def _dir_size(path: Path) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                continue
+    return total
+
+
+class MirrorPool:
+    """
+    Pool of local bare repositories, one per remote repository.
+
+    The first request for a repository initializes a bare mirror; later
+    requests only run an incremental shallow `git fetch` of the requested
+    branch. Concurrent requests for the same repository and branch share a
+    single fetch, fetches of the same mirror are serialized, and the least
+    recently used mirrors that are not in use are evicted once the pool is
+    over its mirror count or size cap.
+    """
+
+    def __init__(self, directory: Path, max_mirrors: int, max_bytes: int):
+        self.directory = directory
+        self.max_mirrors = max_mirrors
+        self.max_bytes = max_bytes
+        # key -> mirror size in bytes, least recently used first
+        self._mirrors: OrderedDict[str, int] = OrderedDict()
+        self._locks: dict[str, asyncio.Lock] = {}
+        self._fetches: dict[tuple[str, str], asyncio.Task] = {}
+        self._in_use: dict[str, int] = {}
+        # Mirrors found on disk at startup, sized before the first eviction
+        self._unsized: set[str] = set()
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        existing = []
+        for path in self.directory.iterdir():
+            if (path / "HEAD").exists():
+                existing.append((path.stat().st_mtime, path.name))
+        for _, key in sorted(existing):
+            self._mirrors[key] = 0
+            self._unsized.add(key)
+
+    @staticmethod
+    def _key(repo_url: str) -> str:
+        normalized = repo_url.rstrip("/").removesuffix(".git")
+        return hashlib.sha256(normalized.encode()).hexdigest()[:32]
+
+    def _lock_for(self, key: str) -> asyncio.Lock:
+        if key not in self._locks:
+            self._locks[key] = asyncio.Lock()
+        return self._locks[key]
+
+    @asynccontextmanager
+    async def checkout(self, repo_url: str, branch: str):
+        """
+        Fetch a branch into its mirror and yield (mirror_path, commit_sha).
+
+        The mirror is pinned while the context is open, so it cannot be
+        evicted while it is being analyzed.
+        """
+        key = self._key(repo_url)
+        self._in_use[key] = self._in_use.get(key, 0) + 1
+        try:
+            commit_sha = await self.fetch(repo_url, branch)
+            yield self.directory / key, commit_sha
+        finally:
+            self._in_use[key] -= 1
+            if not self._in_use[key]:
+                del self._in_use[key]
+            await self._evict()
+
+    async def fetch(self, repo_url: str, branch: str) -> str:
+        """Update the mirror for a branch and return the branch's commit SHA"""
+        key = self._key(repo_url)
+        task = self._fetches.get((key, branch))
+        if task is None:
+            task = asyncio.ensure_future(self._fetch(key, repo_url, branch))
+            self._fetches[(key, branch)] = task
+            task.add_done_callback(lambda _: self._fetches.pop((key, branch), None))
+        else:
+            logger.info(f"Joining in-flight fetch of {repo_url} (branch: {branch})")
+        # Shield the shared fetch so one cancelled caller does not cancel it for the others
+        return await asyncio.shield(task)
+
+    async def _fetch(self, key: str, repo_url: str, branch: str) -> str:
+        path = self.directory / key
+        async with self._lock_for(key):
+            created = not (path / "HEAD").exists()
+            if created:
+                logger.info(f"Creating mirror for {repo_url}")
+                await run_git("init", "--bare", "--quiet", str(path))
+            else:
+                logger.info(f"Updating mirror for {repo_url}")
+
+            try:
+                await run_git(
+                    "--git-dir", str(path), "fetch", "--quiet", "--no-tags", "--depth=1",
+                    authenticated_url(repo_url), f"+refs/heads/{branch}:refs/heads/{branch}",
+                    timeout=MAX_TIMEOUT,
+                )
+            except GitCommandError:
+                if created:
+                    await asyncio.to_thread(shutil.rmtree, path, True)
+                raise
+
+            commit_sha = (await run_git("--git-dir", str(path), "rev-parse", f"refs/heads/{branch}")).strip()
+            os.utime(path)
+            self._mirrors[key] = await asyncio.to_thread(_dir_size, path)
+            self._mirrors.move_to_end(key)
+            self._unsized.discard(key)
+            return commit_sha
+
+    async def _size_existing(self) -> None:
+        keys, self._unsized = self._unsized, set()
+        sizes = await asyncio.to_thread(lambda: {key: _dir_size(self.directory / key) for key in keys})
+        for key, size in sizes.items():
+            # A fetch that finished meanwhile already recorded the current size
+            if self._mirrors.get(key) == 0:
+                self._mirrors[key] = size
+
+    async def _evict(self) -> None:
+        if self._unsized:
+            await self._size_existing()
+        while len(self._mirrors) > self.max_mirrors or sum(self._mirrors.values()) > self.max_bytes:
+            victim = next(
+                (key for key in self._mirrors if key not in self._in_use and not self._lock_for(key).locked()),
+                None
+            )
+            if victim is None:
+                return
+            # Hold the mirror's lock until its directory is gone, so a fetch of the same
+            # repository waits and then starts a fresh mirror instead of fetching into it
+            lock = self._lock_for(victim)
+            async with lock:
+                del self._mirrors[victim]
+                logger.info(f"Evicting cold mirror {victim}")
+                await asyncio.to_thread(shutil.rmtree, self.directory / victim, True)
+            if not any(key == victim for key, _ in self._fetches) and self._locks.get(victim) is lock:
+                del self._locks[victim]
+
+
+mirror_pool = MirrorPool(MIRROR_POOL_DIR, MIRROR_POOL_MAX_MIRRORS, MIRROR_POOL_MAX_BYTES)
+
+
+@asynccontextmanager
+async def checked_out_worktree(mirror_path: Path, commit_sha: str):
+    """Check a commit out of a mirror into a temporary worktree"""
+    temp_dir = tempfile.mkdtemp(prefix="gitingest_")
+    repo_path = Path(temp_dir) / "repo"
+    try:
+        await run_git("--git-dir", str(mirror_path), "worktree", "add", "--detach", "--quiet", str(repo_path), commit_sha)
+        yield repo_path
+    finally:
+        try:
+            await run_git("--git-dir", str(mirror_path), "worktree", "remove", "--force", str(repo_path))
+        except GitCommandError as e:
+            logger.warning(f"Failed to remove worktree {repo_path}: {e}")
+            await run_git("--git-dir", str(mirror_path), "worktree", "prune")
+        if os.path.exists(temp_dir):
+            try:
+                shutil.rmtree(temp_dir)
+                logger.info(f"Cleaned up temporary directory: {temp_dir}")
+            except Exception as e:
+                logger.warning(f"Failed to clean up temporary directory: {e}")
+
+
+# Largest blob read for content-based language guessing in tree mode
+TREE_SAMPLE_MAX_BYTES = 1024 * 1024
+
+
+def _parse_ls_tree(output: bytes) -> dict[str, tuple[str, int]]:
+    """Parse `git ls-tree -r -z -l` output into {path: (blob id, size)}"""
+    blobs = {}
+    for record in output.split(b"\0"):
+        if not record:
+            continue
+        meta, _, path = record.partition(b"\t")
+        mode, obj_type, oid, size = meta.split()
+        # Skip submodules (commit entries); symlinks are blobs, like os.walk's files
+        if obj_type != b"blob":
+            continue
+        blobs[path.decode("utf-8", errors="replace")] = (oid.decode(), int(size))
+    return blobs
+
+
+def _split_tree_shards(paths: list[str], shard_count: int) -> list[list[str]]:
+    """Split ordered paths into contiguous, evenly sized shards"""
+    shard_size = max(1, -(-len(paths) // max(1, shard_count)))
+    return [paths[i:i + shard_size] for i in range(0, len(paths), shard_size)]
+
+
+async def read_blobs(mirror_path: Path, oids: list[str]) -> dict[str, bytes]:
+    """Read blobs from a mirror with a single `git cat-file --batch`"""
+    unique = list(dict.fromkeys(oids))
+    if not unique:
+        return {}
+    output = await run_git_bytes(
+        "--git-dir", str(mirror_path), "cat-file", "--batch",
+        input="".join(f"{oid}\n" for oid in unique).encode(),
+        timeout=MAX_TIMEOUT,
+    )
+    blobs = {}
+    pos = 0
+    while pos < len(output):
+        header_end = output.index(b"\n", pos)
+        header = output[pos:header_end].split()
+        pos = header_end + 1
+        if len(header) < 3:
+            # "<oid> missing"
+            continue
+        size = int(header[2])
+        blobs[header[0].decode()] = output[pos:pos + size]
+        pos += size + 1  # Content is followed by a newline
+    return blobs
+
+
+async def analyze_repository_tree(mirror_path: Path, commit_sha: str, progress: Optional[ProgressCallback] = None) -> dict:
+    """
+    Analyze a commit straight from a mirror's object database.
+
+    The tree is listed with `git ls-tree -r` and only the manifests and the
+    language-guessing samples are read, with `git cat-file --batch`, so no
+    working tree is ever written to disk.
+    """
+    output = await run_git_bytes(
+        "--git-dir", str(mirror_path), "ls-tree", "-r", "-z", "-l", "--full-tree", commit_sha,
+        timeout=MAX_TIMEOUT,
+    )
+    blobs = await asyncio.to_thread(_parse_ls_tree, output)
+
+    # Read every .gitignore and .gitattributes up front so shards can be classified independently
+    rule_paths = [
+        p for p in blobs
+        if p.rpartition('/')[2] in (GITIGNORE_FILE, GITATTRIBUTES_FILE)
+        and not any(is_ignored_dir(part) for part in p.split('/')[:-1])
+    ]
+    rule_blobs = await read_blobs(mirror_path, [blobs[p][0] for p in rule_paths])
+    rule_files: dict[str, dict[str, str]] = {}
+    for p in rule_paths:
+        rel_dir, _, name = p.rpartition('/')
+        rule_files.setdefault(rel_dir, {})[name] = rule_blobs.get(blobs[p][0], b"").decode("utf-8", errors="ignore")
+    path_filter = PathFilter()
+    for rel_dir, files in rule_files.items():
+        path_filter.add_rules(rel_dir, files.get(GITIGNORE_FILE, ""), files.get(GITATTRIBUTES_FILE, ""))
+
+    # Same order as the filesystem walk: a directory's files before its subdirectories
+    paths = sorted(blobs, key=lambda p: (path_sort_key(p.rpartition('/')[0]), p.rpartition('/')[2]))
+    shards = _split_tree_shards(paths, ANALYZE_WORKERS * WALK_SHARDS_PER_WORKER)
+    logger.info(f"Classifying {len(blobs)} tree entries in {len(shards)} shards")
+
+    results = await _run_shards(classify_tree_shard, [(shard, path_filter) for shard in shards], progress)
+    walk = merge_walk_results(results)
+
+    if progress:
+        progress("parsing", manifests=len(walk["manifests"]))
+    sample_paths = [p for p in _sample_paths(walk) if blobs[p][1] <= TREE_SAMPLE_MAX_BYTES]
+    contents = await read_blobs(mirror_path, [blobs[p][0] for p in walk["manifests"] + sample_paths])
+
+    samples = {
+        p: contents[blobs[p][0]][:1024].decode("utf-8", errors="ignore")  # First 1KB
+        for p in sample_paths if blobs[p][0] in contents
+    }
+    walk["languages"].update(guess_sample_languages(samples))
+
+    manifests = {
+        p: contents[blobs[p][0]].decode("utf-8", errors="ignore")
+        for p in walk["manifests"] if blobs[p][0] in contents
     }
+    return _build_analysis(walk, _collect_dependencies(manifests))
 
 
-async def generate_report(repo_url: str, branch: str) -> dict:
+async def generate_report(repo_url: str, branch: str, progress: Optional[ProgressCallback] = None) -> dict:
     """
-    Generate repository report by cloning and analyzing the repository
+    Generate repository report by fetching and analyzing the repository
     """
-    temp_dir = None
     try:
         logger.info(f"Generating report for {repo_url} (branch: {branch})")
         
-        # Create temporary directory for cloning
-        temp_dir = tempfile.mkdtemp(prefix="gitingest_")
-        repo_path = Path(temp_dir) / "repo"
+        # Serve unchanged branches from the report cache without cloning
+        commit_sha = await resolve_commit_sha(repo_url, branch) if report_cache.enabled else None
+        if commit_sha:
+            cached_report = await asyncio.to_thread(report_cache.get, repo_url, branch, commit_sha)
+            if cached_report is not None:
+                logger.info(f"Report cache hit for {repo_url}@{commit_sha}")
+                if progress:
+                    progress("cached", commitSha=commit_sha)
+                return cached_report
         
-        # Clone repository
-        clone_url = repo_url
-        if GH_TOKEN:
-            # Use token for authentication if available
-            if "github.com" in repo_url:
-                clone_url = repo_url.replace("https://", f"https://{GH_TOKEN}@")
-        
-        logger.info(f"Cloning repository to {repo_path}")
-        repo = Repo.clone_from(clone_url, str(repo_path), branch=branch, depth=1)
-        
-        # Analyze repository
-        logger.info("Analyzing repository structure")
-        analysis = await analyze_repository(repo_path)
+        # Fetch into the mirror pool and analyze the fetched commit
+        if progress:
+            progress("cloning")
+        async with mirror_pool.checkout(repo_url, branch) as (mirror_path, commit_sha):
+            logger.info(f"Analyzing repository structure ({ANALYZE_MODE} mode)")
+            if ANALYZE_MODE == "worktree":
+                async with checked_out_worktree(mirror_path, commit_sha) as repo_path:
+                    analysis = await analyze_repository(repo_path, progress)
+            else:
+                analysis = await analyze_repository_tree(mirror_path, commit_sha, progress)
         
         # Generate summary
         summary_parts = [
@@ -353,11 +1193,17 @@ async def generate_report(repo_url: str, branch: str) -> dict:
                 "packageManager": analysis["dependencies"]["packageManager"]
             },
             "llmContext": llm_context,
+            "commitSha": commit_sha,
             "generatedAt": int(datetime.now().timestamp() * 1000)
         }
         
         logger.info(f"Report generated successfully: {analysis['structure']['fileCount']} files, {len(analysis['structure']['languages'])} languages")
         
+        try:
+            await asyncio.to_thread(report_cache.put, repo_url, branch, commit_sha, report)
+        except OSError as e:
+            logger.warning(f"Failed to cache report for {repo_url}@{commit_sha}: {e}")
+        
         return report
         
     except GitCommandError as e:
@@ -366,22 +1212,389 @@ async def generate_report(repo_url: str, branch: str) -> dict:
     except Exception as e:
         logger.error(f"Error generating report: {e}", exc_info=True)
         raise
-    finally:
-        # Clean up temporary directory
-        if temp_dir and os.path.exists(temp_dir):
+
+
+# Webhook delivery configuration
+WEBHOOK_QUEUE_PATH = Path(os.getenv("WEBHOOK_QUEUE_PATH", os.path.join(tempfile.gettempdir(), "gitingest", "webhooks.sqlite3")))
+WEBHOOK_TIMEOUT = float(os.getenv("WEBHOOK_TIMEOUT", "30"))
+WEBHOOK_HTTP2 = os.getenv("WEBHOOK_HTTP2", "true").lower() == "true"
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "20"))
+WEBHOOK_MAX_IN_FLIGHT = max(1, int(os.getenv("WEBHOOK_MAX_IN_FLIGHT", "8")))
+WEBHOOK_MAX_ATTEMPTS = int(os.getenv("WEBHOOK_MAX_ATTEMPTS", "8"))
+WEBHOOK_BACKOFF_BASE = 2.0  # Seconds before the first retry, doubled per attempt
+WEBHOOK_BACKOFF_MAX = int(os.getenv("WEBHOOK_BACKOFF_MAX", "600"))
+WEBHOOK_POLL_INTERVAL = 5.0  # Seconds between scans for due retries when idle
+WEBHOOK_COMPRESSION = os.getenv("WEBHOOK_COMPRESSION", "none").lower()  # "none", "gzip" or "zstd"
+WEBHOOK_COMPRESS_MIN_BYTES = 1024  # Smaller bodies are sent as is
+WEBHOOK_DELTA = os.getenv("WEBHOOK_DELTA", "false").lower() == "true"
+WEBHOOK_DELTA_MAX_BASES = int(os.getenv("WEBHOOK_DELTA_MAX_BASES", "500"))  # Last delivered reports kept as delta bases
+
+if WEBHOOK_COMPRESSION == "zstd" and zstandard is None:
+    logger.warning("WEBHOOK_COMPRESSION=zstd but the zstandard package is not installed, using gzip")
+    WEBHOOK_COMPRESSION = "gzip"
+
+
+def _list_delta(old: list, new: list) -> Optional[dict]:
+    """
+    Encode a change between two lists of unique strings as removed items
+    plus [index, item] insertions into the new list, or None when the kept
+    items changed order or the delta would not be smaller than the list.
+    """
+    if not all(isinstance(item, str) for item in old + new):
+        return None
+    old_items, new_items = set(old), set(new)
+    if len(old_items) != len(old) or len(new_items) != len(new):
+        return None
+    if [item for item in old if item in new_items] != [item for item in new if item in old_items]:
+        return None
+    removed = [item for item in old if item not in new_items]
+    added = [[index, item] for index, item in enumerate(new) if item not in old_items]
+    if len(removed) + len(added) >= len(new):
+        return None
+    return {"removed": removed, "added": added}
+
+
+def report_delta(base: dict, report: dict) -> dict:
+    """
+    Describe `report` as changes to `base`, the last report delivered to the
+    same callback. Keys are dotted paths: "set" holds changed values, "remove"
+    deleted keys and "lists" the edits to long string lists such as
+    structure.directories. "base" identifies the report the receiver must hold.
+    """
+    delta = {
+        "base": {"commitSha": base.get("commitSha"), "generatedAt": base.get("generatedAt")},
+        "set": {},
+        "remove": [],
+        "lists": {},
+    }
+
+    def walk(old: dict, new: dict, prefix: str) -> None:
+        delta["remove"].extend(prefix + key for key in sorted(old.keys() - new.keys()))
+        for key, value in new.items():
+            path = prefix + key
+            if key in old and old[key] == value:
+                continue
+            previous = old.get(key)
+            if isinstance(previous, dict) and isinstance(value, dict):
+                walk(previous, value, path + ".")
+                continue
+            edits = _list_delta(previous, value) if isinstance(previous, list) and isinstance(value, list) else None
+            if edits is not None:
+                delta["lists"][path] = edits
+            else:
+                delta["set"][path] = value
+
+    walk(base, report, "")
+    return delta
+
+
+def encode_webhook_body(payload: dict) -> tuple[bytes, dict[str, str]]:
+    """Serialize a callback payload, compressing it if WEBHOOK_COMPRESSION is set"""
+    body = json.dumps(payload, separators=(",", ":")).encode()
+    headers = {"Content-Type": "application/json"}
+    if WEBHOOK_COMPRESSION == "none" or len(body) < WEBHOOK_COMPRESS_MIN_BYTES:
+        return body, headers
+    if WEBHOOK_COMPRESSION == "zstd":
+        body = zstandard.ZstdCompressor(level=3).compress(body)
+    else:
+        body = gzip.compress(body, compresslevel=6)
+    headers["Content-Encoding"] = WEBHOOK_COMPRESSION
+    return body, headers
+
+
+class WebhookQueue:
+    """
+    Durable queue of webhook deliveries sent through one shared HTTP client.
+
+    Every callback is written to SQLite before the first attempt, so
+    deliveries survive restarts. Failed attempts are retried with jittered
+    exponential backoff; deliveries that run out of attempts (or get a
+    non-retryable 4xx) are kept as dead letters until replayed or expired
+    after JOB_TTL. At most `max_in_flight` callbacks are sent at once.
+    """
+
+    def __init__(self, path: Optional[Path], max_in_flight: int, max_attempts: int):
+        self.max_in_flight = max_in_flight
+        self.max_attempts = max_attempts
+        self.client: Optional[httpx.AsyncClient] = None
+        self.delivered = 0
+        self._lock = threading.Lock()
+        if path is None:
+            self._db = sqlite3.connect(":memory:", check_same_thread=False, isolation_level=None)
+        else:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(str(path), check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS deliveries (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                job_id TEXT NOT NULL,
+                callback_url TEXT NOT NULL,
+                payload BLOB NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at REAL NOT NULL,
+                last_error TEXT,
+                updated_at REAL NOT NULL
+            )
+        """)
+        self._db.execute("CREATE INDEX IF NOT EXISTS deliveries_due ON deliveries (status, next_attempt_at)")
+        # Last report delivered per (callback URL, repository, branch), the base for delta payloads
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS report_bases (
+                key TEXT PRIMARY KEY,
+                report BLOB NOT NULL,
+                updated_at REAL NOT NULL
+            )
+        """)
+        self._in_flight: dict[int, asyncio.Task] = {}
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._loop_task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        self.client = httpx.AsyncClient(
+            http2=WEBHOOK_HTTP2,
+            timeout=WEBHOOK_TIMEOUT,
+            # Follow redirects (e.g., 308 Permanent Redirect)
+            follow_redirects=True,
+            limits=httpx.Limits(
+                max_connections=WEBHOOK_MAX_CONNECTIONS,
+                max_keepalive_connections=WEBHOOK_MAX_CONNECTIONS
+            )
+        )
+        self._slots = asyncio.Semaphore(self.max_in_flight)
+        self._wakeup = asyncio.Event()
+        self._loop_task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        # Deliveries cut short here are still pending and resume on the next start
+        tasks = [self._loop_task, *self._in_flight.values()] if self._loop_task else []
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._loop_task = None
+        if self.client:
+            await self.client.aclose()
+            self.client = None
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+    def enqueue(self, job_id: str, callback_urls: list[str], payload: dict) -> None:
+        """Store a delivery of `payload` to each callback URL (blocking; run in a thread)"""
+        body = zlib.compress(json.dumps(payload).encode())
+        now = time.time()
+        with self._lock:
+            self._db.executemany(
+                "INSERT INTO deliveries (job_id, callback_url, payload, next_attempt_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+                [(job_id, url, body, now, now) for url in callback_urls]
+            )
+
+    def wake(self) -> None:
+        if self._wakeup:
+            self._wakeup.set()
+
+    def replay(self, job_id: Optional[str] = None) -> int:
+        """Move dead deliveries (optionally for one job) back into the queue"""
+        query = "UPDATE deliveries SET status = 'pending', attempts = 0, next_attempt_at = ?, updated_at = ? WHERE status = 'dead'"
+        now = time.time()
+        params: tuple = (now, now)
+        if job_id:
+            query += " AND job_id = ?"
+            params += (job_id,)
+        with self._lock:
+            replayed = self._db.execute(query, params).rowcount
+        self.wake()
+        return replayed
+
+    def stats(self) -> dict:
+        with self._lock:
+            counts = dict(self._db.execute("SELECT status, COUNT(*) FROM deliveries GROUP BY status").fetchall())
+        return {
+            "pending": counts.get("pending", 0),
+            "dead": counts.get("dead", 0),
+            "inFlight": len(self._in_flight),
+            "delivered": self.delivered,
+            "maxInFlight": self.max_in_flight,
+        }
+
+    def _due(self, limit: int, busy: list[int]) -> tuple[list[int], Optional[float]]:
+        """Ids of pending deliveries that are due, other than `busy`, and when the next one will be (blocking; run in a thread)"""
+        now = time.time()
+        exclude = f"AND id NOT IN ({','.join('?' * len(busy))})" if busy else ""
+        with self._lock:
+            self._db.execute(
+                "DELETE FROM deliveries WHERE status = 'dead' AND updated_at < ?",
+                (now - JOB_TTL,)
+            )
+            due = self._db.execute(
+                f"SELECT id FROM deliveries WHERE status = 'pending' AND next_attempt_at <= ? {exclude} ORDER BY next_attempt_at LIMIT ?",
+                (now, *busy, limit)
+            ).fetchall()
+            upcoming = self._db.execute(
+                "SELECT MIN(next_attempt_at) FROM deliveries WHERE status = 'pending' AND next_attempt_at > ?",
+                (now,)
+            ).fetchone()[0]
+        return [row[0] for row in due], upcoming
+
+    async def _run(self) -> None:
+        while True:
+            self._wakeup.clear()
+            free = self.max_in_flight - len(self._in_flight)
+            due, upcoming = await asyncio.to_thread(self._due, free, list(self._in_flight)) if free > 0 else ([], None)
+            for delivery_id in due:
+                task = asyncio.create_task(self._attempt(delivery_id))
+                self._in_flight[delivery_id] = task
+                task.add_done_callback(lambda _, delivery_id=delivery_id: self._finished(delivery_id))
+            wait = WEBHOOK_POLL_INTERVAL
+            if upcoming is not None:
+                wait = min(wait, max(0.0, upcoming - time.time()))
             try:
-                shutil.rmtree(temp_dir)
-                logger.info(f"Cleaned up temporary directory: {temp_dir}")
+                await asyncio.wait_for(self._wakeup.wait(), timeout=wait)
+            except asyncio.TimeoutError:
+                pass
+
+    def _finished(self, delivery_id: int) -> None:
+        self._in_flight.pop(delivery_id, None)
+        # A slot just freed up, so look for more due deliveries
+        self.wake()
+
+    def _prepare(self, delivery_id: int, use_delta: bool = True) -> Optional[dict]:
+        """Load a pending delivery and encode its body (blocking; run in a thread)"""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT job_id, callback_url, payload, attempts FROM deliveries WHERE id = ? AND status = 'pending'",
+                (delivery_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        job_id, callback_url, stored, attempts = row
+        raw = zlib.decompress(stored)
+        payload = json.loads(raw)
+        delivery = {"jobId": job_id, "callbackUrl": callback_url, "attempts": attempts, "baseKey": None, "delta": False}
+        report = payload.get("report")
+        if WEBHOOK_DELTA and report is not None:
+            delivery["baseKey"] = hashlib.sha256(
+                f"{callback_url}\n{payload['repoUrl']}\n{payload['branch']}".encode()
+            ).hexdigest()
+            delivery["report"] = report
+            base = self._base(delivery["baseKey"]) if use_delta else None
+            if base is not None:
+                delta = report_delta(base, report)
+                # Only worth it when the delta is smaller than the whole payload
+                if len(json.dumps(delta, separators=(",", ":"))) < len(raw):
+                    del payload["report"]
+                    payload["reportDelta"] = delta
+                    delivery["delta"] = True
+        delivery["body"], delivery["headers"] = encode_webhook_body(payload)
+        return delivery
+
+    def _base(self, key: str) -> Optional[dict]:
+        with self._lock:
+            row = self._db.execute("SELECT report FROM report_bases WHERE key = ?", (key,)).fetchone()
+        return json.loads(zlib.decompress(row[0])) if row else None
+
+    def _remember_base(self, key: str, report: Optional[dict]) -> None:
+        """Record the report a callback now holds, or forget it when None"""
+        with self._lock:
+            if report is None:
+                self._db.execute("DELETE FROM report_bases WHERE key = ?", (key,))
+                return
+            self._db.execute(
+                "INSERT OR REPLACE INTO report_bases (key, report, updated_at) VALUES (?, ?, ?)",
+                (key, zlib.compress(json.dumps(report).encode()), time.time())
+            )
+            self._db.execute(
+                "DELETE FROM report_bases WHERE key NOT IN (SELECT key FROM report_bases ORDER BY updated_at DESC LIMIT ?)",
+                (WEBHOOK_DELTA_MAX_BASES,)
+            )
+
+    async def _attempt(self, delivery_id: int) -> None:
+        delivery = await asyncio.to_thread(self._prepare, delivery_id)
+        if delivery is None:
+            return
+        job_id = delivery["jobId"]
+        attempts = delivery["attempts"] + 1
+        async with self._slots:
+            try:
+                try:
+                    await send_webhook_callback(self.client, delivery["callbackUrl"], delivery["body"], delivery["headers"])
+                except httpx.HTTPStatusError as e:
+                    if not (delivery["delta"] and e.response.status_code == 409):
+                        raise
+                    # The receiver no longer holds the delta base, send the whole report
+                    logger.info(f"Webhook delta for job {job_id} rejected, resending the full report")
+                    await asyncio.to_thread(self._remember_base, delivery["baseKey"], None)
+                    delivery = await asyncio.to_thread(self._prepare, delivery_id, False)
+                    if delivery is None:
+                        return
+                    await send_webhook_callback(self.client, delivery["callbackUrl"], delivery["body"], delivery["headers"])
             except Exception as e:
-                logger.warning(f"Failed to clean up temporary directory: {e}")
+                retryable = not (
+                    isinstance(e, httpx.HTTPStatusError)
+                    and 400 <= e.response.status_code < 500
+                    and e.response.status_code not in (408, 429)
+                )
+                await asyncio.to_thread(self._failed, delivery_id, job_id, attempts, str(e), retryable)
+                return
+        await asyncio.to_thread(self._delivered, delivery_id)
+        if delivery["baseKey"]:
+            await asyncio.to_thread(self._remember_base, delivery["baseKey"], delivery["report"])
+        self.delivered += 1
+        logger.info(f"Webhook callback for job {job_id} sent successfully (attempt {attempts})")
+
+    def _delivered(self, delivery_id: int) -> None:
+        with self._lock:
+            self._db.execute("DELETE FROM deliveries WHERE id = ?", (delivery_id,))
+
+    def _failed(self, delivery_id: int, job_id: str, attempts: int, error: str, retryable: bool) -> None:
+        """Schedule a retry or give up on a delivery (blocking; run in a thread)"""
+        now = time.time()
+        if retryable and attempts < self.max_attempts:
+            # Equal jitter: half the backoff is fixed, the other half random
+            backoff = min(WEBHOOK_BACKOFF_MAX, WEBHOOK_BACKOFF_BASE * 2 ** (attempts - 1))
+            delay = backoff / 2 + random.uniform(0, backoff / 2)
+            logger.warning(f"Webhook callback for job {job_id} failed (attempt {attempts}/{self.max_attempts}), retrying in {delay:.0f}s: {error}")
+            with self._lock:
+                self._db.execute(
+                    "UPDATE deliveries SET attempts = ?, next_attempt_at = ?, last_error = ?, updated_at = ? WHERE id = ?",
+                    (attempts, now + delay, error, now, delivery_id)
+                )
+            return
+        logger.error(f"Webhook callback for job {job_id} failed after {attempts} attempts: {error}")
+        with self._lock:
+            self._db.execute(
+                "UPDATE deliveries SET status = 'dead', attempts = ?, last_error = ?, updated_at = ? WHERE id = ?",
+                (attempts, error, now, delivery_id)
+            )
+        # Store for manual retrieval if needed
+        job_store.update(job_id, webhookFailed=True)
 
 
-async def send_webhook_callback(callback_url: str, job_id: str, repo_url: str, branch: str, status: str, report: Optional[dict] = None, error: Optional[str] = None):
-    """Send webhook callback to Next.js app"""
+webhook_queue = WebhookQueue(
+    WEBHOOK_QUEUE_PATH if JOB_STORE_BACKEND == "sqlite" else None,
+    WEBHOOK_MAX_IN_FLIGHT,
+    WEBHOOK_MAX_ATTEMPTS
+)
+
+
+async def send_webhook_callback(client: httpx.AsyncClient, callback_url: str, body: bytes, headers: dict[str, str]) -> None:
+    """Send one encoded webhook callback to the Next.js app, raising on failure"""
+    response = await client.post(callback_url, content=body, headers=headers)
+    response.raise_for_status()
+
+
+async def notify_job_callbacks(job_id: str, status: str, report: Optional[dict] = None, error: Optional[str] = None):
+    """Queue the job's result for every callback registered for it"""
+    job = await asyncio.to_thread(job_store.get, job_id, False)
+    if job is None or not job.get("callbackUrls"):
+        return
     payload = {
         "jobId": job_id,
-        "repoUrl": repo_url,
-        "branch": branch,
+        "repoUrl": job["repoUrl"],
+        "branch": job["branch"],
         "status": status,
     }
     
@@ -390,82 +1603,179 @@ async def send_webhook_callback(callback_url: str, job_id: str, repo_url: str, b
     if error:
         payload["error"] = error
     
-    max_retries = 3
-    for attempt in range(max_retries):
-        try:
-            # Follow redirects (e.g., 308 Permanent Redirect)
-            async with httpx.AsyncClient(timeout=30.0, follow_redirects=True) as client:
-                response = await client.post(callback_url, json=payload)
-                response.raise_for_status()
-                logger.info(f"Webhook callback sent successfully (attempt {attempt + 1})")
-                return
-        except Exception as e:
-            logger.warning(f"Webhook callback failed (attempt {attempt + 1}/{max_retries}): {e}")
-            if attempt < max_retries - 1:
-                # Exponential backoff
-                await asyncio.sleep(2 ** attempt)
-            else:
-                logger.error(f"Webhook callback failed after {max_retries} attempts")
-                # Store for manual retrieval if needed
-                jobs[job_id]["webhookFailed"] = True
+    # Serializing and compressing a large report is CPU work, keep it off the event loop
+    await asyncio.to_thread(webhook_queue.enqueue, job_id, job["callbackUrls"], payload)
+    webhook_queue.wake()
 
 
-async def process_ingest_job(job_id: str, repo_url: str, branch: str, callback_url: Optional[str]):
-    """Background task to process ingest job"""
-    jobs[job_id]["status"] = "processing"
+async def process_ingest_job(job_id: str, repo_url: str, branch: str):
+    """Process a job taken off the ingest queue"""
+    await asyncio.to_thread(job_store.update, job_id, status="processing", startedAt=datetime.now().isoformat())
+    started = time.monotonic()
     
     try:
         # Set timeout for report generation
         report = await asyncio.wait_for(
-            generate_report(repo_url, branch),
+            generate_report(repo_url, branch, progress=event_bus.progress_callback(job_id)),
             timeout=MAX_TIMEOUT
         )
         
-        jobs[job_id]["status"] = "completed"
-        jobs[job_id]["report"] = report
-        jobs[job_id]["completedAt"] = datetime.now().isoformat()
+        # Compressing a large report is CPU work, keep it off the event loop
+        await asyncio.to_thread(
+            job_store.update,
+            job_id,
+            status="completed",
+            report=report,
+            completedAt=datetime.now().isoformat()
+        )
+        event_bus.publish(
+            job_id,
+            "done",
+            fileCount=report["structure"]["fileCount"],
+            languages=len(report["structure"]["languages"]),
+            durationMs=int((time.monotonic() - started) * 1000)
+        )
         
-        # Send webhook callback if provided
-        if callback_url:
-            await send_webhook_callback(
-                callback_url,
-                job_id,
-                repo_url,
-                branch,
-                "completed",
-                report=report
-            )
+        # Send webhook callbacks if provided
+        await notify_job_callbacks(job_id, "completed", report=report)
         
     except asyncio.TimeoutError:
         error_msg = f"Report generation timed out after {MAX_TIMEOUT} seconds"
         logger.error(error_msg)
-        jobs[job_id]["status"] = "failed"
-        jobs[job_id]["error"] = error_msg
+        await asyncio.to_thread(job_store.update, job_id, status="failed", error=error_msg)
+        event_bus.publish(job_id, "failed", error=error_msg)
         
-        if callback_url:
-            await send_webhook_callback(
-                callback_url,
-                job_id,
-                repo_url,
-                branch,
-                "failed",
-                error=error_msg
-            )
+        await notify_job_callbacks(job_id, "failed", error=error_msg)
     except Exception as e:
         error_msg = str(e)
         logger.error(f"Report generation failed: {error_msg}", exc_info=True)
-        jobs[job_id]["status"] = "failed"
-        jobs[job_id]["error"] = error_msg
+        await asyncio.to_thread(job_store.update, job_id, status="failed", error=error_msg)
+        event_bus.publish(job_id, "failed", error=error_msg)
         
-        if callback_url:
-            await send_webhook_callback(
-                callback_url,
-                job_id,
-                repo_url,
-                branch,
-                "failed",
-                error=error_msg
-            )
+        await notify_job_callbacks(job_id, "failed", error=error_msg)
+
+
+class QueueFullError(Exception):
+    """Raised when the ingest queue cannot take another job"""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Ingest queue is full, retry after {retry_after} seconds")
+        self.retry_after = retry_after
+
+
+class IngestScheduler:
+    """
+    Bounded FIFO queue of ingest jobs drained by a fixed number of workers.
+
+    Jobs for a (repoUrl, branch) pair that is already queued or running are
+    merged into the existing job instead of being queued again. When the
+    queue is full, submit() raises QueueFullError with a Retry-After
+    estimate based on recent job durations.
+    """
+
+    def __init__(self, workers: int, max_queued: int):
+        self.workers = workers
+        self.max_queued = max_queued
+        self._queue: deque[str] = deque()
+        self._ready = asyncio.Condition()
+        # (repoUrl, branch) -> id of the job queued or running for it, and the reverse
+        self._active: dict[tuple[str, str], str] = {}
+        self._keys: dict[str, tuple[str, str]] = {}
+        self._running = 0
+        self._tasks: list[asyncio.Task] = []
+        # Moving average of job durations, used for wait estimates
+        self._avg_duration = float(INGEST_DEFAULT_DURATION)
+
+    def start(self) -> None:
+        # Pick up jobs that were queued or running when the service stopped
+        for job_id, job in job_store.unfinished():
+            key = (job["repoUrl"], job["branch"])
+            if len(self._queue) >= self.max_queued or key in self._active:
+                job_store.update(job_id, status="failed", error="Job dropped after a service restart")
+                event_bus.publish(job_id, "failed", error="Job dropped after a service restart")
+                continue
+            job_store.update(job_id, status="queued")
+            self._enqueue(job_id, key)
+        if self._queue:
+            logger.info(f"Requeued {len(self._queue)} unfinished ingest jobs")
+
+        self._tasks = [
+            asyncio.create_task(self._worker(i), name=f"ingest-worker-{i}")
+            for i in range(self.workers)
+        ]
+        logger.info(f"Started {self.workers} ingest workers (queue size {self.max_queued})")
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def estimate_wait(self, position: int) -> int:
+        """Estimated seconds until a job at this queue position finishes"""
+        rounds = -(-position // self.workers) + 1
+        return max(1, int(rounds * self._avg_duration))
+
+    def position(self, job_id: str) -> Optional[int]:
+        """1-based position of a queued job, or None if it is not queued"""
+        try:
+            return self._queue.index(job_id) + 1
+        except ValueError:
+            return None
+
+    async def in_flight(self, repo_url: str, branch: str) -> Optional[str]:
+        job_id = self._active.get((repo_url, branch))
+        if job_id:
+            job = await asyncio.to_thread(job_store.get, job_id, False)
+            if job and job.get("status") not in TERMINAL_JOB_STATUSES:
+                return job_id
+        return None
+
+    def _enqueue(self, job_id: str, key: tuple[str, str]) -> None:
+        self._active[key] = job_id
+        self._keys[job_id] = key
+        self._queue.append(job_id)
+        event_bus.publish(job_id, "queued", position=len(self._queue))
+
+    async def submit(self, job_id: str, repo_url: str, branch: str) -> None:
+        """Queue a job that has already been recorded in the job store"""
+        if len(self._queue) >= self.max_queued:
+            raise QueueFullError(self.estimate_wait(len(self._queue)))
+        async with self._ready:
+            self._enqueue(job_id, (repo_url, branch))
+            self._ready.notify()
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "running": self._running,
+            "queued": len(self._queue),
+            "maxQueued": self.max_queued,
+        }
+
+    async def _worker(self, index: int) -> None:
+        while True:
+            async with self._ready:
+                await self._ready.wait_for(lambda: bool(self._queue))
+                job_id = self._queue.popleft()
+            for position, queued_id in enumerate(self._queue, start=1):
+                event_bus.publish(queued_id, "queued", position=position)
+
+            key = self._keys.pop(job_id)
+            started = time.monotonic()
+            self._running += 1
+            try:
+                await process_ingest_job(job_id, *key)
+            except Exception as e:
+                logger.error(f"Ingest worker {index} failed on job {job_id}: {e}", exc_info=True)
+            finally:
+                self._running -= 1
+                if self._active.get(key) == job_id:
+                    del self._active[key]
+                self._avg_duration = 0.8 * self._avg_duration + 0.2 * (time.monotonic() - started)
+
+
+scheduler = IngestScheduler(INGEST_WORKERS, INGEST_QUEUE_SIZE)
 
 
 @app.get("/health")
@@ -474,20 +1784,34 @@ async def health_check():
     return {
         "status": "healthy",
         "service": "gitingest",
-        "version": "1.0.0"
+        "version": "1.0.0",
+        "queue": scheduler.stats(),
+        "webhooks": webhook_queue.stats()
     }
 
 
+@app.get("/cache/stats", dependencies=[Depends(verify_api_key)])
+async def get_cache_stats():
+    """Report cache hit/miss counters (for debugging/monitoring)"""
+    return report_cache.stats()
+
+
+@app.post("/webhooks/replay", dependencies=[Depends(verify_api_key)])
+async def replay_webhooks(jobId: Optional[str] = None):
+    """Retry webhook deliveries that ran out of attempts, for one job or all of them"""
+    replayed = await asyncio.to_thread(webhook_queue.replay, jobId)
+    return {"replayed": replayed}
+
+
 @app.post("/ingest", response_model=IngestResponse, dependencies=[Depends(verify_api_key)])
-async def ingest(
-    request: IngestRequest,
-    background_tasks: BackgroundTasks,
-):
+async def ingest(request: IngestRequest):
     """
     Generate LLM-friendly repository report
     
     Accepts repository URL and branch, returns job ID for async processing.
-    Results are delivered via webhook callback.
+    Results are delivered via webhook callback. Requests for a repository and
+    branch that are already queued or running join the existing job. Returns
+    429 with Retry-After when the queue is full.
     """
     
     # Validate repository URL
@@ -498,47 +1822,116 @@ async def ingest(
             detail="Only GitHub repositories are supported"
         )
     
+    callback_url = str(request.callbackUrl) if request.callbackUrl else None
+    
+    # Join an identical job that is already in flight
+    existing_job_id = await scheduler.in_flight(repo_url, request.branch)
+    if existing_job_id:
+        existing_job = await asyncio.to_thread(job_store.get, existing_job_id, False)
+        callback_urls = existing_job.get("callbackUrls", [])
+        if callback_url and callback_url not in callback_urls:
+            await asyncio.to_thread(job_store.update, existing_job_id, callbackUrls=callback_urls + [callback_url])
+        logger.info(f"Joined in-flight ingest job {existing_job_id} for {repo_url}")
+        return IngestResponse(
+            status="processing",
+            jobId=existing_job_id,
+            estimatedTime=scheduler.estimate_wait(scheduler.position(existing_job_id) or 0)
+        )
+    
     # Generate job ID
     job_id = str(uuid.uuid4())
     
     # Initialize job
-    jobs[job_id] = {
+    await asyncio.to_thread(job_store.create, job_id, {
         "status": "queued",
         "repoUrl": repo_url,
         "branch": request.branch,
+        "callbackUrls": [callback_url] if callback_url else [],
         "createdAt": datetime.now().isoformat(),
-    }
+    })
     
-    # Start background task
-    background_tasks.add_task(
-        process_ingest_job,
-        job_id,
-        repo_url,
-        request.branch,
-        str(request.callbackUrl) if request.callbackUrl else None
-    )
+    try:
+        await scheduler.submit(job_id, repo_url, request.branch)
+    except QueueFullError as e:
+        await asyncio.to_thread(job_store.delete, job_id)
+        logger.warning(f"Rejected ingest for {repo_url}: {e}")
+        raise HTTPException(
+            status_code=429,
+            detail="Ingest queue is full",
+            headers={"Retry-After": str(e.retry_after)}
+        )
     
-    logger.info(f"Started ingest job {job_id} for {repo_url}")
+    position = scheduler.position(job_id)
+    logger.info(f"Queued ingest job {job_id} for {repo_url} (position {position})")
     
     return IngestResponse(
         status="processing",
         jobId=job_id,
-        estimatedTime=30
+        estimatedTime=scheduler.estimate_wait(position or 0)
     )
 
 
 @app.get("/job/{job_id}", dependencies=[Depends(verify_api_key)])
 async def get_job_status(job_id: str):
-    """Get job status (for debugging/monitoring)"""
-    if job_id not in jobs:
+    """Get job status and queue position (for debugging/monitoring)"""
+    job = await asyncio.to_thread(job_store.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    
+    position = scheduler.position(job_id)
+    if position is not None:
+        job["queuePosition"] = position
+    return job
+
+
+@app.get("/job/{job_id}/events", dependencies=[Depends(verify_api_key)])
+async def stream_job_events(
+    job_id: str,
+    request: Request,
+    format: str = Query("sse", pattern="^(sse|ndjson)$"),
+    last_event_id: Optional[str] = Header(None),
+):
+    """
+    Stream job progress events as Server-Sent Events (default) or NDJSON.
+    
+    Past events are replayed first (after Last-Event-ID, if given), then new
+    events are streamed until the job is done or failed.
+    """
+    job = await asyncio.to_thread(job_store.get, job_id, False)
+    if job is None:
         raise HTTPException(status_code=404, detail="Job not found")
     
-    return jobs[job_id]
+    if not event_bus.has(job_id):
+        # Events are not persisted, so report the stored status instead
+        if job["status"] == "completed":
+            event_bus.publish(job_id, "done")
+        elif job["status"] == "failed":
+            event_bus.publish(job_id, "failed", error=job.get("error"))
+        else:
+            event_bus.publish(job_id, job["status"], position=scheduler.position(job_id))
+    
+    after = int(last_event_id) if last_event_id and last_event_id.isdigit() else 0
+    
+    async def events():
+        async for event in event_bus.follow(job_id, after):
+            if await request.is_disconnected():
+                return
+            if format == "ndjson":
+                if event is not None:
+                    yield json.dumps(event) + "\n"
+            elif event is None:
+                yield ": keep-alive\n\n"
+            else:
+                yield f"id: {event['seq']}\nevent: {event['phase']}\ndata: {json.dumps(event)}\n\n"
+    
+    return StreamingResponse(
+        events(),
+        media_type="application/x-ndjson" if format == "ndjson" else "text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 
 if __name__ == "__main__":
     import uvicorn
     port = int(os.getenv("PORT", "8001"))
     uvicorn.run(app, host="0.0.0.0", port=port)
-
-
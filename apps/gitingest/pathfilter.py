@@ -0,0 +1,211 @@
+"""
+Repository path filtering shared by the GitIngest analysis and the daytona
+agent-runner
+
+Both skip the same paths: dot-directories, IGNORED_DIRS, anything a
+.gitignore ignores and files marked linguist-generated or linguist-vendored
+in a .gitattributes. The agent image ships a copy of this file next to
+agent-runner.py.
+"""
+
+import os
+import re
+from typing import Optional
+
+
+# Directories never descended into (in addition to dot-directories). Build
+# outputs such as dist/ are left to .gitignore: some repositories keep sources
+# under those names
+IGNORED_DIRS = frozenset(["node_modules", "__pycache__", "venv"])
+
+
+def is_ignored_dir(name: str) -> bool:
+    return name.startswith('.') or name in IGNORED_DIRS
+
+
+# Rule files compiled into the PathFilter
+GITIGNORE_FILE = ".gitignore"
+GITATTRIBUTES_FILE = ".gitattributes"
+
+# Attributes that exclude a file, as they do from GitHub's language stats
+EXCLUDING_ATTRIBUTES = ("linguist-generated", "linguist-vendored")
+
+
+def _glob_to_regex(pattern: str) -> str:
+    """Translate a gitignore-style glob, without leading or trailing slash, into a regex"""
+    out = []
+    i, n = 0, len(pattern)
+    while i < n:
+        c = pattern[i]
+        if c == '*':
+            if pattern.startswith('**', i) and (i == 0 or pattern[i - 1] == '/'):
+                if i + 2 == n:
+                    # Trailing "/**" matches everything inside
+                    out.append('.*')
+                    break
+                if pattern[i + 2] == '/':
+                    # "**/" matches zero or more directories
+                    out.append('(?:.*/)?')
+                    i += 3
+                    continue
+            out.append('[^/]*')
+            while i + 1 < n and pattern[i + 1] == '*':
+                i += 1
+        elif c == '?':
+            out.append('[^/]')
+        elif c == '[':
+            j = i + 1
+            if j < n and pattern[j] in '!^':
+                j += 1
+            if j < n and pattern[j] == ']':
+                j += 1
+            end = pattern.find(']', j)
+            if end == -1:
+                out.append(re.escape(c))
+            else:
+                chars = pattern[i + 1:end]
+                negated = chars[:1] in ('!', '^')
+                chars = (chars[1:] if negated else chars).replace('\\', '\\\\').replace('[', '\\[')
+                out.append(f"[^/{chars}]" if negated else f"[{chars}]")
+                i = end
+        elif c == '\\' and i + 1 < n:
+            i += 1
+            out.append(re.escape(pattern[i]))
+        else:
+            out.append(re.escape(c))
+        i += 1
+    return ''.join(out)
+
+
+def _compile_glob(pattern: str) -> Optional[tuple[str, bool]]:
+    """
+    Compile a .gitignore/.gitattributes pattern into a regex over paths
+    relative to the rule file's directory, and whether it only matches
+    directories. Patterns with a slash (other than a trailing one) are
+    anchored to that directory; the rest match a name at any depth.
+    """
+    dir_only = pattern.endswith('/')
+    pattern = pattern.rstrip('/')
+    if not pattern:
+        return None
+    anchored = '/' in pattern
+    regex = _glob_to_regex(pattern.lstrip('/'))
+    return (regex if anchored else f"(?:.*/)?{regex}"), dir_only
+
+
+def _compile_rules(rules: list[tuple[str, bool]]) -> Optional[tuple[re.Pattern, list[bool]]]:
+    """
+    Combine (regex, value) rules into one regex. The last matching rule
+    wins, so alternatives are tried newest first and the matched group names
+    the rule.
+    """
+    if not rules:
+        return None
+    ordered = rules[::-1]
+    combined = re.compile('|'.join(f"(?P<r{i}>{regex})" for i, (regex, _) in enumerate(ordered)))
+    return combined, [value for _, value in ordered]
+
+
+def _match_rules(compiled: Optional[tuple[re.Pattern, list[bool]]], rel_path: str) -> Optional[bool]:
+    if compiled is None:
+        return None
+    match = compiled[0].fullmatch(rel_path)
+    return compiled[1][int(match.lastgroup[1:])] if match else None
+
+
+class _RuleSet:
+    """The .gitignore and .gitattributes rules of one directory"""
+
+    def __init__(self, gitignore: str, gitattributes: str):
+        ignore = []
+        for line in gitignore.splitlines():
+            if not line.strip() or line.startswith('#'):
+                continue
+            # Trailing spaces are ignored unless escaped
+            line = re.sub(r"(?<!\\)\s+$", "", line)
+            negated = line.startswith('!')
+            compiled = _compile_glob(line[1:] if negated else line)
+            if compiled:
+                ignore.append((compiled[0], not negated, compiled[1]))
+        self.ignore_files = _compile_rules([(regex, value) for regex, value, dir_only in ignore if not dir_only])
+        self.ignore_dirs = _compile_rules([(regex, value) for regex, value, _ in ignore])
+
+        attributes: dict[str, list[tuple[str, bool]]] = {name: [] for name in EXCLUDING_ATTRIBUTES}
+        dir_attributes: dict[str, list[tuple[str, bool]]] = {name: [] for name in EXCLUDING_ATTRIBUTES}
+        for line in gitattributes.splitlines():
+            fields = line.split()
+            # Skip comments, macros, negative patterns and directory patterns, which never match
+            if not fields or fields[0][0] in '#!' or fields[0].startswith('[attr]') or fields[0].endswith('/'):
+                continue
+            compiled = _compile_glob(fields[0])
+            if not compiled:
+                continue
+            regex = compiled[0]
+            for token in fields[1:]:
+                name, _, value = token.lstrip('-!').partition('=')
+                if name not in attributes:
+                    continue
+                enabled = token[0] not in '-!' and value != "false"
+                attributes[name].append((regex, enabled))
+                # "dir/**" covers the whole directory, so the directory itself can be pruned
+                if regex.endswith('/.*'):
+                    dir_attributes[name].append((regex[:-3], enabled))
+        self.attributes = {name: _compile_rules(rules) for name, rules in attributes.items()}
+        # Only prune when no rule turns the attribute back off for something inside
+        self.dir_attributes = {
+            name: _compile_rules(rules) if all(enabled for _, enabled in attributes[name]) else None
+            for name, rules in dir_attributes.items()
+        }
+
+
+class PathFilter:
+    """
+    Decides which repository paths are left out: paths
+    ignored by a .gitignore and files marked linguist-generated or
+    linguist-vendored in a .gitattributes.
+
+    Rules are added per directory and, like in git, rules in deeper
+    directories take precedence. Callers check directories before
+    descending into them, so excluded subtrees are pruned as a whole.
+    Instances are plain data and can be pickled (to send them to a worker
+    process).
+    """
+
+    def __init__(self):
+        self._rules: dict[str, _RuleSet] = {}
+
+    def add_rules(self, rel_dir: str, gitignore: str = "", gitattributes: str = "") -> None:
+        if gitignore.strip() or gitattributes.strip():
+            self._rules[rel_dir] = _RuleSet(gitignore, gitattributes)
+
+    def excluded(self, rel_path: str, is_dir: bool = False) -> bool:
+        if not self._rules:
+            return False
+        ignored: Optional[bool] = None
+        attributes: dict[str, Optional[bool]] = dict.fromkeys(EXCLUDING_ATTRIBUTES)
+        parent = rel_path
+        while parent:
+            parent = parent.rpartition('/')[0]
+            rules = self._rules.get(parent)
+            if rules is None:
+                continue
+            sub_path = rel_path[len(parent) + 1:] if parent else rel_path
+            if ignored is None:
+                ignored = _match_rules(rules.ignore_dirs if is_dir else rules.ignore_files, sub_path)
+            for name, value in attributes.items():
+                if value is None:
+                    compiled = (rules.dir_attributes if is_dir else rules.attributes)[name]
+                    attributes[name] = _match_rules(compiled, sub_path)
+        return bool(ignored) or any(attributes.values())
+
+
+def read_rule_files(directory: str) -> tuple[str, str]:
+    """Read the .gitignore and .gitattributes of a directory, if it has them"""
+    contents = []
+    for name in (GITIGNORE_FILE, GITATTRIBUTES_FILE):
+        try:
+            with open(os.path.join(directory, name), "r", encoding="utf-8", errors="ignore") as f:
+                contents.append(f.read())
+        except OSError:
+            contents.append("")
+    return contents[0], contents[1]
@@ -0,0 +1,367 @@
+"""
+Repository walking and file classification for the GitIngest analysis
+
+Everything the analysis executor runs lives here. Its worker processes are
+spawned and import this module, not main, so importing it must stay free of
+side effects: no stores, caches, queues or app setup.
+"""
+
+import os
+import re
+import fnmatch
+from collections import deque
+from typing import Optional
+
+from pygments.lexers import find_lexer_class_for_filename, get_all_lexers, guess_lexer_for_filename
+from pygments.util import ClassNotFound
+
+from pathfilter import GITATTRIBUTES_FILE, GITIGNORE_FILE, PathFilter, is_ignored_dir, read_rule_files
+
+
+# Common entry points
+ENTRY_POINT_FILES = frozenset([
+    "main.py", "app.py", "index.py", "server.py", "app.js", "index.js",
+    "main.ts", "index.ts", "main.go", "main.rs", "main.java", "App.java",
+    "index.html", "app.tsx", "App.tsx", "main.tsx"
+])
+
+# Framework detection patterns (checked in order, first match wins)
+FRAMEWORK_PATTERNS = {
+    "Next.js": ["next.config", "package.json"],
+    "React": ["package.json"],
+    "Vue": ["vue.config", "vite.config"],
+    "Django": ["manage.py", "settings.py"],
+    "Flask": ["app.py", "application.py"],
+    "FastAPI": ["main.py", "app.py"],
+    "Express": ["package.json", "server.js"],
+    "Spring Boot": ["pom.xml", "build.gradle"],
+    "Rails": ["Gemfile", "config.ru"],
+}
+FRAMEWORK_MATCHERS = [
+    (framework, re.compile("|".join(re.escape(indicator) for indicator in indicators)))
+    for framework, indicators in FRAMEWORK_PATTERNS.items()
+]
+
+# Build tool detection (manifest filename -> tool)
+BUILD_TOOLS = {
+    "package.json": "npm",
+    "yarn.lock": "yarn",
+    "pnpm-lock.yaml": "pnpm",
+    "requirements.txt": "pip",
+    "pyproject.toml": "poetry",
+    "Cargo.toml": "cargo",
+    "pom.xml": "maven",
+    "build.gradle": "gradle",
+    "go.mod": "go",
+}
+
+# Test file detection
+TEST_PATH_RE = re.compile(r"test_|_test|\.test\.|\.spec\.|tests/")
+
+# Files whose contents are parsed for dependencies
+MANIFEST_FILES = frozenset(["package.json", "requirements.txt", "Cargo.toml"])
+
+# Directories are split into separate walk shards down to this depth
+WALK_MAX_SPLIT_DEPTH = 3
+
+
+def path_sort_key(rel_dir: str) -> tuple:
+    # Sort shards in pre-order so merged results follow a top-down walk
+    return tuple(rel_dir.split('/')) if rel_dir else ()
+
+
+def plan_walk_shards(repo_root: str, target_shards: int) -> list[tuple[str, bool]]:
+    """
+    Split the repository into walk shards.
+
+    Returns (relative directory, recursive) pairs. Directories are split
+    breadth-first into their own files plus one shard per subdirectory until
+    there are enough shards to keep every worker busy.
+    """
+    shards: list[tuple[str, bool]] = [("", False)]
+    pending = deque((name, 1) for name in _list_subdirs(repo_root, ""))
+
+    while pending and len(shards) + len(pending) < target_shards:
+        rel_dir, depth = pending.popleft()
+        if depth >= WALK_MAX_SPLIT_DEPTH:
+            shards.append((rel_dir, True))
+            continue
+        shards.append((rel_dir, False))
+        pending.extend((sub, depth + 1) for sub in _list_subdirs(repo_root, rel_dir))
+
+    shards.extend((rel_dir, True) for rel_dir, _ in pending)
+    shards.sort(key=lambda shard: path_sort_key(shard[0]))
+    return shards
+
+
+def _list_subdirs(repo_root: str, rel_dir: str) -> list[str]:
+    """List walkable subdirectories of rel_dir as repository-relative paths"""
+    subdirs = []
+    try:
+        with os.scandir(os.path.join(repo_root, rel_dir)) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False) and not is_ignored_dir(entry.name):
+                    subdirs.append(f"{rel_dir}/{entry.name}" if rel_dir else entry.name)
+    except OSError:
+        pass
+    return sorted(subdirs)
+
+
+def _new_walk_result() -> dict:
+    return {
+        "directories": [],
+        "fileCount": 0,
+        "languages": set(),
+        "entryPoints": [],
+        "framework": None,
+        "buildTools": [],
+        "packageManager": None,
+        "testing": [],
+        "manifests": [],
+        "unresolved": {},
+    }
+
+
+class LanguageIndex:
+    """
+    Filename -> language index built once from the Pygments lexer registry.
+
+    Most lexers are registered by simple "*.ext" patterns, so the result for a
+    filename only depends on its extension tail (everything from the first
+    dot). Those lookups are memoized per tail; exact filenames and the few
+    complex globs are memoized per filename instead.
+    """
+
+    _SIMPLE_EXT_RE = re.compile(r"^\*\.[^*?\[\]]+$")
+
+    def __init__(self):
+        self._exact_names: set[str] = set()
+        complex_patterns = []
+        for _, _, filenames, _ in get_all_lexers():
+            for pattern in filenames:
+                if not any(c in pattern for c in "*?["):
+                    self._exact_names.add(pattern)
+                elif not self._SIMPLE_EXT_RE.match(pattern):
+                    complex_patterns.append(fnmatch.translate(pattern))
+        self._complex_re = re.compile("|".join(complex_patterns)) if complex_patterns else None
+        self._cache: dict[str, Optional[str]] = {}
+
+    def key_for(self, name: str) -> str:
+        """Return the memoization key for a filename"""
+        if name in self._exact_names or (self._complex_re and self._complex_re.match(name)):
+            return name
+        dot = name.find('.')
+        return "*" + (name[dot:] if dot != -1 else "")
+
+    def lookup(self, name: str) -> tuple[str, Optional[str]]:
+        """
+        Resolve a filename to (key, language).
+
+        language is "" for plain text and None when no lexer matches the
+        name, in which case only the file content can tell.
+        """
+        key = self.key_for(name)
+        try:
+            return key, self._cache[key]
+        except KeyError:
+            pass
+        lexer_cls = find_lexer_class_for_filename(name)
+        if lexer_cls is None:
+            lang = None
+        elif lexer_cls.name in ['Text only', 'Text']:
+            lang = ""
+        else:
+            lang = lexer_cls.name
+        self._cache[key] = lang
+        return key, lang
+
+
+# Built at import time so every analysis worker process has its own copy
+LANGUAGE_INDEX = LanguageIndex()
+
+# Files sampled per unresolved extension for content-based guessing
+LANGUAGE_GUESS_SAMPLES = int(os.getenv("LANGUAGE_GUESS_SAMPLES", "3"))
+
+
+def _guess_language(file_path: str, content: str) -> Optional[str]:
+    """Guess a file's language from its content"""
+    if not content.strip():
+        return None
+    try:
+        lang = guess_lexer_for_filename(file_path, content).name
+    except (ClassNotFound, ValueError):
+        return None
+    if lang in ['Text only', 'Text']:
+        return None
+    return lang
+
+
+def guess_sample_languages(samples: dict[str, str]) -> set[str]:
+    """Guess languages for the sampled files of unresolved extensions"""
+    languages = set()
+    for rel_path, content in samples.items():
+        lang = _guess_language(rel_path, content)
+        if lang:
+            languages.add(lang)
+    return languages
+
+
+def _detect_test_framework(rel_path: str) -> str:
+    if '.test.' in rel_path or '.spec.' in rel_path:
+        if 'jest' in rel_path or 'package.json' in rel_path:
+            return "Jest"
+        if 'pytest' in rel_path or 'test_' in rel_path:
+            return "pytest"
+        if 'unittest' in rel_path:
+            return "unittest"
+    return "unknown"
+
+
+def _classify_file(result: dict, rel_path: str, name: str) -> None:
+    """Classify a single file against every matcher, computing each key once"""
+    result["fileCount"] += 1
+
+    key, lang = LANGUAGE_INDEX.lookup(name)
+    if lang:
+        result["languages"].add(lang)
+    elif lang is None:
+        samples = result["unresolved"].setdefault(key, [])
+        if len(samples) < LANGUAGE_GUESS_SAMPLES:
+            samples.append(rel_path)
+
+    if name in ENTRY_POINT_FILES:
+        result["entryPoints"].append(rel_path)
+
+    # Only the first framework hit counts, so stop matching once we have one
+    if result["framework"] is None:
+        for framework, matcher in FRAMEWORK_MATCHERS:
+            if matcher.search(rel_path):
+                result["framework"] = framework
+                break
+
+    tool = BUILD_TOOLS.get(name)
+    if tool:
+        if tool not in result["buildTools"]:
+            result["buildTools"].append(tool)
+        result["packageManager"] = tool
+
+    if TEST_PATH_RE.search(rel_path):
+        test_framework = _detect_test_framework(rel_path)
+        if test_framework not in result["testing"]:
+            result["testing"].append(test_framework)
+
+    if name in MANIFEST_FILES:
+        result["manifests"].append(rel_path)
+
+
+def walk_shard(repo_root: str, shard_dir: str, recursive: bool) -> dict:
+    """
+    Walk one shard of the repository and classify its files.
+
+    Runs inside the analysis executor, so it must stay a picklable
+    module-level function that returns plain data.
+    """
+    result = _new_walk_result()
+    top = os.path.join(repo_root, shard_dir) if shard_dir else repo_root
+
+    # Load the rules of every directory above the shard, and give up early if one of them is excluded
+    path_filter = PathFilter()
+    parts = shard_dir.split('/') if shard_dir else []
+    for depth in range(len(parts) + 1):
+        rel_dir = '/'.join(parts[:depth])
+        if rel_dir and path_filter.excluded(rel_dir, is_dir=True):
+            return result
+        path_filter.add_rules(rel_dir, *read_rule_files(os.path.join(repo_root, rel_dir)))
+
+    if recursive:
+        walker = os.walk(top)
+    else:
+        try:
+            with os.scandir(top) as entries:
+                files = [entry.name for entry in entries if entry.is_file()]
+        except OSError:
+            files = []
+        walker = [(top, [], files)]
+
+    for root, dirs, files in walker:
+        rel_root = os.path.relpath(root, repo_root)
+        rel_root = '' if rel_root == '.' else rel_root
+        if root != top and (GITIGNORE_FILE in files or GITATTRIBUTES_FILE in files):
+            path_filter.add_rules(rel_root, *read_rule_files(root))
+        prefix = f"{rel_root}/" if rel_root else ''
+
+        # Skip hidden directories, common ignore patterns and excluded subtrees
+        dirs[:] = sorted(
+            d for d in dirs
+            if not is_ignored_dir(d) and not path_filter.excluded(prefix + d, is_dir=True)
+        )
+
+        if rel_root:
+            result["directories"].append(rel_root)
+
+        for file in sorted(files):
+            if file.startswith('.'):
+                continue
+            rel_path = prefix + file
+            if path_filter.excluded(rel_path):
+                continue
+            _classify_file(result, rel_path, file)
+
+    return result
+
+
+def merge_walk_results(results: list[dict]) -> dict:
+    """Merge per-shard results, in shard order"""
+    merged = _new_walk_result()
+    for result in results:
+        merged["directories"].extend(result["directories"])
+        merged["fileCount"] += result["fileCount"]
+        merged["languages"].update(result["languages"])
+        merged["entryPoints"].extend(result["entryPoints"])
+        if merged["framework"] is None:
+            merged["framework"] = result["framework"]
+        for tool in result["buildTools"]:
+            if tool not in merged["buildTools"]:
+                merged["buildTools"].append(tool)
+        if result["packageManager"]:
+            merged["packageManager"] = result["packageManager"]
+        for test_framework in result["testing"]:
+            if test_framework not in merged["testing"]:
+                merged["testing"].append(test_framework)
+        merged["manifests"].extend(result["manifests"])
+        for key, rel_paths in result["unresolved"].items():
+            samples = merged["unresolved"].setdefault(key, [])
+            samples.extend(rel_paths[:LANGUAGE_GUESS_SAMPLES - len(samples)])
+    return merged
+
+
+def classify_tree_shard(paths: list[str], path_filter: PathFilter) -> dict:
+    """
+    Classify one shard of `git ls-tree` paths.
+
+    Mirrors walk_shard for trees read from the object database: paths under
+    ignored or excluded directories are dropped and directories are derived
+    from the paths that remain.
+    """
+    result = _new_walk_result()
+    # directory -> whether it is walkable (not under an ignored directory)
+    walkable: dict[str, bool] = {"": True}
+
+    def is_walkable(rel_dir: str) -> bool:
+        known = walkable.get(rel_dir)
+        if known is not None:
+            return known
+        parent, _, name = rel_dir.rpartition('/')
+        ok = is_walkable(parent) and not is_ignored_dir(name) and not path_filter.excluded(rel_dir, is_dir=True)
+        walkable[rel_dir] = ok
+        if ok:
+            result["directories"].append(rel_dir)
+        return ok
+
+    for rel_path in paths:
+        rel_dir, _, name = rel_path.rpartition('/')
+        if not is_walkable(rel_dir) or name.startswith('.') or path_filter.excluded(rel_path):
+            continue
+        _classify_file(result, rel_path, name)
+
+    return result
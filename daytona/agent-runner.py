@@ -7,26 +7,60 @@ Outputs unified diff format that can be applied with git apply.
 """
 
 import argparse
+import asyncio
+import contextvars
 import json
 import os
 import sys
 import subprocess
 import re
+import socket
+import socketserver
+import bisect
+import difflib
+import hashlib
+import io
+import math
+import sqlite3
+import tempfile
+import threading
+import time
+import zlib
 from pathlib import Path
-from typing import Optional, Dict, Any, List, Tuple
-import signal
-from contextlib import contextmanager
+from typing import Optional, Dict, Any, Iterator, List, NamedTuple, Tuple
+from concurrent.futures import Future, ThreadPoolExecutor
 
-# LLM Provider imports
+# LLM Provider imports, deferred to load_provider_sdk(): importing them takes
+# seconds, which a run using the other provider (or the thin client of a
+# running daemon, see run_in_daemon) should not spend
+openai = None
+anthropic = None
+
+# Path filtering shared with the GitIngest service; the image ships it next to
+# this script, a checkout keeps it in apps/gitingest
 try:
-    import openai
+    from pathfilter import GITATTRIBUTES_FILE, GITIGNORE_FILE, PathFilter, is_ignored_dir, read_rule_files
 except ImportError:
-    openai = None
+    sys.path.append(str(Path(__file__).resolve().parent.parent / "apps" / "gitingest"))
+    from pathfilter import GITATTRIBUTES_FILE, GITIGNORE_FILE, PathFilter, is_ignored_dir, read_rule_files
 
+# Optional: exact token counts for prompt budgeting
 try:
-    import anthropic
+    import tiktoken
 except ImportError:
-    anthropic = None
+    tiktoken = None
+
+
+def load_provider_sdk(name: str) -> None:
+    """Import a provider SDK ("openai" or "anthropic") if it is installed and not imported yet"""
+    global openai, anthropic
+    try:
+        if name == "openai" and openai is None:
+            import openai
+        elif name == "anthropic" and anthropic is None:
+            import anthropic
+    except ImportError:
+        pass
 
 
 class TimeoutError(Exception):
@@ -34,6 +68,11 @@ class TimeoutError(Exception):
     pass
 
 
+class OperationCancelled(Exception):
+    """Raised when an operation stops because its deadline was cancelled"""
+    pass
+
+
 def get_max_tokens_for_model(provider: str, model: str) -> int:
     """
     Get the maximum completion tokens supported by a model.
@@ -88,22 +127,598 @@ def get_max_tokens_for_model(provider: str, model: str) -> int:
     return 16384
 
 
-@contextmanager
-def timeout(seconds: int):
-    """Context manager for timing out operations"""
-    def timeout_handler(signum, frame):
-        raise TimeoutError(f"Operation timed out after {seconds} seconds")
+TASK_BUDGET = float(os.getenv("AGENT_TASK_BUDGET", "900"))  # Seconds for the whole run's provider calls
+LLM_CALL_TIMEOUT = 180.0  # Seconds for one blocking provider call
+
+
+class Deadline:
+    """
+    A time by which an operation has to finish, within its parent's (the
+    task budget) if it has one. Works in any thread, unlike SIGALRM: long
+    operations call check() as they go (streams do it per chunk) and give
+    the HTTP client a timeout from client_timeout(), and cancel() makes the
+    next check() fail, so concurrent requests can be stopped together.
+    """
+    
+    def __init__(self, seconds: Optional[float] = None, parent: Optional["Deadline"] = None, label: str = "Operation"):
+        self.seconds = seconds
+        self.at = time.monotonic() + seconds if seconds is not None else math.inf
+        self.parent = parent
+        self.label = label
+        self.reason: Optional[str] = None
+        self._cancelled = threading.Event()
+    
+    def child(self, seconds: Optional[float], label: str) -> "Deadline":
+        return Deadline(seconds, parent=self, label=label)
+    
+    def remaining(self) -> float:
+        remaining = self.at - time.monotonic()
+        return min(remaining, self.parent.remaining()) if self.parent else remaining
+    
+    def cancel(self, reason: str) -> None:
+        self.reason = reason
+        self._cancelled.set()
+    
+    def cancelled(self) -> Optional["Deadline"]:
+        """The deadline (this one or a parent) that was cancelled, if any"""
+        if self._cancelled.is_set():
+            return self
+        return self.parent.cancelled() if self.parent else None
     
-    # Set up signal handler
-    old_handler = signal.signal(signal.SIGALRM, timeout_handler)
-    signal.alarm(seconds)
+    def expired(self) -> Optional["Deadline"]:
+        """The outermost deadline that has passed, if any"""
+        expired = self.parent.expired() if self.parent else None
+        return expired or (self if time.monotonic() >= self.at else None)
+    
+    def check(self) -> None:
+        cancelled = self.cancelled()
+        if cancelled:
+            raise OperationCancelled(f"{self.label} cancelled: {cancelled.reason}")
+        expired = self.expired()
+        if expired:
+            raise TimeoutError(f"{expired.label} timed out after {expired.seconds:g} seconds")
+    
+    def client_timeout(self, limit: float) -> float:
+        """An HTTP client timeout of at most `limit` that also ends by this deadline"""
+        return max(min(limit, self.remaining()), 0.1)
+
+
+_task_deadline: contextvars.ContextVar[Optional[Deadline]] = contextvars.ContextVar("task_deadline", default=None)
+
+
+def start_task_budget(seconds: Optional[float] = TASK_BUDGET) -> Deadline:
+    """
+    Start the overall budget that every later call_deadline() in this
+    context falls within (and within any budget already started in it)
+    """
+    deadline = Deadline(seconds, parent=_task_deadline.get(), label="Task")
+    _task_deadline.set(deadline)
+    return deadline
+
+
+def call_deadline(seconds: Optional[float], label: str) -> Deadline:
+    """A deadline for one operation, within the current task budget"""
+    return Deadline(seconds, parent=_task_deadline.get(), label=label)
+
+
+def _is_timeout(error: BaseException) -> bool:
+    """Whether an exception is a timeout, including the provider SDKs' HTTP timeouts"""
+    return isinstance(error, (TimeoutError, asyncio.TimeoutError)) or "Timeout" in type(error).__name__
+
+
+def _client_for(client, deadline: Deadline, limit: float):
+    """The client with its request timeout set to `limit`, or less when the deadline is closer"""
+    if client is None:
+        return None
+    return client.with_options(timeout=deadline.client_timeout(limit))
+
+
+def run_concurrently(calls: List, limit: int, deadline: Deadline) -> List[Any]:
+    """
+    Run blocking calls concurrently on an asyncio loop, at most `limit` at a
+    time, each in a worker thread. Every call has to finish by the deadline;
+    when one fails or time runs out, the deadline is cancelled so the rest
+    stop at their next check instead of running to completion. Returns each
+    call's result or exception, in order.
+    """
+    async def run_all() -> List[Any]:
+        semaphore = asyncio.Semaphore(limit)
+        
+        async def run(call):
+            async with semaphore:
+                deadline.check()
+                remaining = deadline.remaining()
+                try:
+                    return await asyncio.wait_for(asyncio.to_thread(call), timeout=remaining if remaining != math.inf else None)
+                except asyncio.TimeoutError:
+                    deadline.cancel("out of time")
+                    expired = deadline.expired()
+                    raise TimeoutError(f"{expired.label} timed out after {expired.seconds:g} seconds" if expired else f"{deadline.label} ran out of time")
+                except Exception as e:
+                    deadline.cancel(f"another request failed ({e})")
+                    raise
+        
+        return await asyncio.gather(*(run(call) for call in calls), return_exceptions=True)
     
+    return asyncio.run(run_all())
+
+
+def walk_repository_files(repo_path: Path) -> Iterator[Path]:
+    """
+    Yield the repository's files in a sorted, top-down walk.
+    Dot-directories, pathfilter.IGNORED_DIRS and directories excluded by the repository's
+    .gitignore/.gitattributes rules are pruned without being descended into.
+    """
+    path_filter = PathFilter()
+    for root, dirs, files in os.walk(repo_path):
+        rel_root = os.path.relpath(root, repo_path)
+        rel_root = "" if rel_root == "." else rel_root
+        if GITIGNORE_FILE in files or GITATTRIBUTES_FILE in files:
+            path_filter.add_rules(rel_root, *read_rule_files(root))
+        prefix = f"{rel_root}/" if rel_root else ""
+        
+        dirs[:] = sorted(
+            d for d in dirs
+            if not is_ignored_dir(d) and not path_filter.excluded(prefix + d, is_dir=True)
+        )
+        for name in sorted(files):
+            if not path_filter.excluded(prefix + name):
+                yield Path(root) / name
+
+
+# On-disk cache of file indexes, one file per repository and commit
+INDEX_CACHE_DIR = Path(os.getenv("AGENT_INDEX_CACHE_DIR", os.path.join(tempfile.gettempdir(), "pithy-jaunt", "file-index")))
+INDEX_CACHE_VERSION = 1
+INDEX_CACHE_MAX_ENTRIES = int(os.getenv("AGENT_INDEX_CACHE_MAX_ENTRIES", "64"))  # Cached indexes (HEAD and working tree states) kept
+BINARY_SNIFF_BYTES = 8000  # Same window git uses to spot binary files
+
+
+class FileEntry(NamedTuple):
+    path: str  # Relative to the repository root, with forward slashes
+    name: str  # Lowercase file name
+    size: int
+    ext: str  # Lowercase suffix including the dot, or ""
+    binary: bool
+
+
+def _is_binary(file_path: Path) -> bool:
     try:
-        yield
-    finally:
-        # Restore old handler and cancel alarm
-        signal.alarm(0)
-        signal.signal(signal.SIGALRM, old_handler)
+        with open(file_path, "rb") as f:
+            return b"\0" in f.read(BINARY_SNIFF_BYTES)
+    except OSError:
+        return True
+
+
+class FileIndex:
+    """
+    Index of the repository's files (as listed by walk_repository_files),
+    so a task never walks the tree more than once.
+    Lookups by file name, extension and path are dict lookups; directory
+    listings bisect the sorted paths.
+    """
+
+    def __init__(self, entries: List[FileEntry]):
+        self.entries = sorted(entries)
+        self._paths = [entry.path for entry in self.entries]
+        self._by_path = {entry.path: entry for entry in self.entries}
+        self._by_lower_path: Dict[str, FileEntry] = {}
+        self._by_name: Dict[str, List[FileEntry]] = {}
+        self._by_ext: Dict[str, List[FileEntry]] = {}
+        for entry in self.entries:
+            self._by_lower_path.setdefault(entry.path.lower(), entry)
+            self._by_name.setdefault(entry.name, []).append(entry)
+            self._by_ext.setdefault(entry.ext, []).append(entry)
+
+    @classmethod
+    def build(cls, repo_path: Path) -> "FileIndex":
+        entries = []
+        for file_path in walk_repository_files(repo_path):
+            try:
+                size = file_path.stat().st_size
+            except OSError:
+                continue
+            name = file_path.name.lower()
+            entries.append(FileEntry(
+                file_path.relative_to(repo_path).as_posix(),
+                name,
+                size,
+                file_path.suffix.lower(),
+                _is_binary(file_path),
+            ))
+        return cls(entries)
+
+    def get(self, rel_path: str, ignore_case: bool = False) -> Optional[FileEntry]:
+        rel_path = rel_path.strip("/")
+        if ignore_case:
+            return self._by_lower_path.get(rel_path.lower())
+        return self._by_path.get(rel_path)
+
+    def find_name(self, name: str) -> List[FileEntry]:
+        """Files with this name in any directory, case-insensitively"""
+        return self._by_name.get(name.lower(), [])
+
+    def find_suffix(self, suffix: str) -> List[FileEntry]:
+        """Files whose path ends with this path suffix (e.g. "api/route.ts"), case-insensitively"""
+        suffix = suffix.strip("/").lower()
+        name = suffix.rpartition("/")[2]
+        return [
+            entry for entry in self.find_name(name)
+            if entry.path.lower() == suffix or entry.path.lower().endswith("/" + suffix)
+        ]
+
+    def with_extension(self, ext: str) -> List[FileEntry]:
+        return self._by_ext.get(ext.lower(), [])
+
+    def extensions(self) -> List[str]:
+        return [ext for ext in self._by_ext if ext]
+
+    def in_directory(self, rel_dir: str, recursive: bool = True) -> List[FileEntry]:
+        """Files under a directory, in path order"""
+        prefix = rel_dir.strip("/") + "/" if rel_dir.strip("/") else ""
+        start = bisect.bisect_left(self._paths, prefix)
+        # "0" sorts right after "/", so this bound ends the prefix range
+        end = bisect.bisect_left(self._paths, prefix[:-1] + "0") if prefix else len(self._paths)
+        entries = self.entries[start:end]
+        if not recursive:
+            entries = [entry for entry in entries if "/" not in entry.path[len(prefix):]]
+        return entries
+
+
+def _index_cache_key(repo_path: Path) -> Optional[str]:
+    """
+    Key the on-disk index by HEAD and the working tree status, so edits and
+    untracked files invalidate it. The size and mtime of every dirty path are
+    part of the key, so a file edited again without changing its status still
+    misses. None when the repository is not a git checkout.
+    """
+    try:
+        head = subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=repo_path, capture_output=True, text=True, check=True
+        ).stdout.strip()
+        status = subprocess.run(
+            ["git", "status", "--porcelain", "-z", "--untracked-files=all"], cwd=repo_path, capture_output=True, check=True
+        ).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    digest = hashlib.sha256(str(repo_path).encode() + b"\0" + status)
+    records = iter(status.split(b"\0"))
+    for record in records:
+        if len(record) < 4:
+            continue
+        if record[:1] in (b"R", b"C"):
+            next(records, None)  # Rename and copy sources follow as a record of their own
+        try:
+            st = os.stat(repo_path / os.fsdecode(record[3:]))
+            digest.update(f"\0{st.st_mtime_ns}:{st.st_size}".encode())
+        except OSError:
+            digest.update(b"\0-")
+    return f"{head}-{digest.hexdigest()[:16]}"
+
+
+def _evict_index_files() -> None:
+    """Drop the least recently used cached file indexes beyond INDEX_CACHE_MAX_ENTRIES"""
+    try:
+        files = sorted(INDEX_CACHE_DIR.glob("*.json"), key=lambda f: f.stat().st_mtime)
+    except OSError:
+        return
+    for cache_file in files[:max(len(files) - INDEX_CACHE_MAX_ENTRIES, 0)]:
+        try:
+            cache_file.unlink()
+        except OSError:
+            pass
+
+
+_file_indexes: Dict[Path, FileIndex] = {}
+_index_keys: Dict[Path, Optional[str]] = {}  # What the in-memory indexes of each repository were built from
+
+
+def _run_index_key(repo_path: Path) -> Optional[str]:
+    """The repository's index cache key, computed once and shared by the file and search indexes"""
+    if repo_path not in _index_keys:
+        _index_keys[repo_path] = _index_cache_key(repo_path)
+    return _index_keys[repo_path]
+
+
+def get_file_index(repo_path: Path) -> FileIndex:
+    """Return the repository's file index, loading or building it once per run"""
+    repo_path = repo_path.resolve()
+    index = _file_indexes.get(repo_path)
+    if index is not None:
+        return index
+    
+    key = _run_index_key(repo_path)
+    cache_file = INDEX_CACHE_DIR / f"{key}.json" if key else None
+    if cache_file and cache_file.exists():
+        try:
+            with open(cache_file) as f:
+                data = json.load(f)
+            if data.get("version") == INDEX_CACHE_VERSION:
+                index = FileIndex([FileEntry(*entry) for entry in data["entries"]])
+                print(f"[pj] Loaded file index ({len(index.entries)} files) from cache", file=sys.stderr)
+                os.utime(cache_file)
+        except (OSError, ValueError, TypeError):
+            index = None
+    
+    if index is None:
+        index = FileIndex.build(repo_path)
+        print(f"[pj] Indexed {len(index.entries)} files", file=sys.stderr)
+        if cache_file:
+            try:
+                INDEX_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+                tmp_file = cache_file.with_suffix(f".{os.getpid()}.tmp")
+                with open(tmp_file, "w") as f:
+                    json.dump({"version": INDEX_CACHE_VERSION, "entries": index.entries}, f)
+                os.replace(tmp_file, cache_file)
+            except OSError as e:
+                print(f"[pj] Could not cache file index: {e}", file=sys.stderr)
+            _evict_index_files()
+    
+    _file_indexes[repo_path] = index
+    return index
+
+
+# Relevance ranking (BM25 over path and content tokens)
+SEARCH_MAX_FILE_BYTES = 100000  # Larger files are never sent as context, so they are not indexed
+SEARCH_PATH_BOOST = 3  # A token in the path counts as this many occurrences in the content
+BM25_K1 = 1.2
+BM25_B = 0.75
+TRIGRAM_MIN_CONTAINMENT = 0.8  # Share of a query token's trigrams a vocabulary term must contain
+
+IDENTIFIER_RE = re.compile(r"[A-Za-z_][A-Za-z0-9_]*|[0-9]+")
+SUBWORD_RE = re.compile(r"[A-Z]+(?![a-z])|[A-Z]?[a-z]+|[0-9]+")
+STOP_WORDS = frozenset("""
+    a an and are as at be by can do does for from has have if in into is it its make
+    not of on or should so that the their then this to use when which will with
+    const def else function import let new return self var
+""".split())
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Split text into lowercase search tokens: every identifier, plus its
+    camelCase/snake_case parts. Plural "s" is stripped so "routes" matches
+    "route".
+    """
+    tokens = []
+    for identifier in IDENTIFIER_RE.findall(text):
+        parts = SUBWORD_RE.findall(identifier)
+        words = [identifier] if len(parts) <= 1 else [identifier, *parts]
+        for word in words:
+            word = word.lower().strip("_")
+            if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+                word = word[:-1]
+            if len(word) > 1 and word not in STOP_WORDS:
+                tokens.append(word)
+    return tokens
+
+
+def _trigrams(term: str) -> set:
+    return {term[i:i + 3] for i in range(len(term) - 2)}
+
+
+class SearchIndex:
+    """
+    BM25 index over the repository's text files, for ranking context files
+    against a task description.
+
+    Each file is a document made of its content tokens plus its path tokens
+    (boosted). Query tokens missing from the vocabulary fall back to
+    vocabulary terms that contain most of their trigrams, so "auth" still
+    finds "authentication". Per-file term counts are cached on disk by
+    content hash, so a new commit only tokenizes the files that changed.
+    """
+
+    def __init__(self, paths: List[str], term_counts: List[Dict[str, int]]):
+        self.paths = paths
+        self.lengths = [sum(counts.values()) for counts in term_counts]
+        self.average_length = (sum(self.lengths) / len(self.lengths)) if self.lengths else 0.0
+        self.postings: Dict[str, List[Tuple[int, int]]] = {}
+        for doc, counts in enumerate(term_counts):
+            for term, count in counts.items():
+                self.postings.setdefault(term, []).append((doc, count))
+        self._trigram_terms: Optional[Dict[str, List[str]]] = None
+
+    def _expand(self, token: str) -> List[Tuple[str, float]]:
+        """Vocabulary terms to score for a query token, with a weight each"""
+        if token in self.postings:
+            return [(token, 1.0)]
+        grams = _trigrams(token)
+        if not grams:
+            return []
+        if self._trigram_terms is None:
+            self._trigram_terms = {}
+            for term in self.postings:
+                for gram in _trigrams(term):
+                    self._trigram_terms.setdefault(gram, []).append(term)
+        shared: Dict[str, int] = {}
+        for gram in grams:
+            for term in self._trigram_terms.get(gram, []):
+                shared[term] = shared.get(term, 0) + 1
+        return [
+            (term, count / len(grams))
+            for term, count in shared.items()
+            if count / len(grams) >= TRIGRAM_MIN_CONTAINMENT
+        ]
+
+    def search(self, query: str, limit: int = 10) -> List[Tuple[str, float]]:
+        """Return up to `limit` (path, score) pairs, best first"""
+        query_counts: Dict[str, int] = {}
+        for token in tokenize(query):
+            query_counts[token] = query_counts.get(token, 0) + 1
+        
+        total = len(self.paths)
+        scores: Dict[int, float] = {}
+        for token, query_count in query_counts.items():
+            for term, weight in self._expand(token):
+                postings = self.postings[term]
+                idf = math.log(1 + (total - len(postings) + 0.5) / (len(postings) + 0.5))
+                for doc, count in postings:
+                    norm = BM25_K1 * (1 - BM25_B + BM25_B * self.lengths[doc] / self.average_length)
+                    scores[doc] = scores.get(doc, 0.0) + query_count * weight * idf * count * (BM25_K1 + 1) / (count + norm)
+        
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], self.paths[item[0]]))
+        return [(self.paths[doc], score) for doc, score in ranked[:limit]]
+
+
+class _TermCache:
+    """
+    SQLite store of per-file term counts by content hash, and of each commit's
+    (path, hash) list. Only the INDEX_CACHE_MAX_ENTRIES most recently used
+    commit lists are kept, along with the term counts they still refer to.
+    """
+
+    def __init__(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(path), isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS doc_terms (hash TEXT PRIMARY KEY, terms BLOB NOT NULL)")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS commit_docs (key TEXT PRIMARY KEY, docs BLOB NOT NULL, last_used REAL NOT NULL)"
+        )
+
+    def commit_docs(self, key: str) -> Optional[List[Tuple[str, str]]]:
+        row = self._db.execute("SELECT docs FROM commit_docs WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        self._db.execute("UPDATE commit_docs SET last_used = ? WHERE key = ?", (time.time(), key))
+        return [tuple(doc) for doc in json.loads(zlib.decompress(row[0]))]
+
+    def put_commit_docs(self, key: str, docs: List[Tuple[str, str]]) -> None:
+        self._db.execute(
+            "INSERT OR REPLACE INTO commit_docs (key, docs, last_used) VALUES (?, ?, ?)",
+            (key, zlib.compress(json.dumps(docs).encode()), time.time())
+        )
+        self._evict()
+
+    def _evict(self) -> None:
+        evicted = self._db.execute(
+            "SELECT key FROM commit_docs ORDER BY last_used DESC LIMIT -1 OFFSET ?", (INDEX_CACHE_MAX_ENTRIES,)
+        ).fetchall()
+        if not evicted:
+            return
+        with self._db:
+            self._db.executemany("DELETE FROM commit_docs WHERE key = ?", evicted)
+            live = set()
+            for (docs,) in self._db.execute("SELECT docs FROM commit_docs"):
+                live.update(digest for _, digest in json.loads(zlib.decompress(docs)))
+            stale = [(digest,) for (digest,) in self._db.execute("SELECT hash FROM doc_terms") if digest not in live]
+            self._db.executemany("DELETE FROM doc_terms WHERE hash = ?", stale)
+        print(f"[pj] Search index cache: evicted {len(evicted)} least recently used commits", file=sys.stderr)
+
+    def terms(self, hashes: List[str]) -> Dict[str, Dict[str, int]]:
+        found = {}
+        for start in range(0, len(hashes), 500):
+            batch = hashes[start:start + 500]
+            rows = self._db.execute(
+                f"SELECT hash, terms FROM doc_terms WHERE hash IN ({','.join('?' * len(batch))})", batch
+            ).fetchall()
+            found.update((digest, json.loads(zlib.decompress(terms))) for digest, terms in rows)
+        return found
+
+    def put_terms(self, items: List[Tuple[str, Dict[str, int]]]) -> None:
+        with self._db:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO doc_terms (hash, terms) VALUES (?, ?)",
+                [(digest, zlib.compress(json.dumps(counts).encode())) for digest, counts in items]
+            )
+
+    def close(self) -> None:
+        self._db.close()
+
+
+def _count_terms(text: str) -> Dict[str, int]:
+    counts: Dict[str, int] = {}
+    for token in tokenize(text):
+        counts[token] = counts.get(token, 0) + 1
+    return counts
+
+
+_search_indexes: Dict[Path, SearchIndex] = {}
+
+
+def get_search_index(repo_path: Path) -> SearchIndex:
+    """Return the repository's search index, building it (incrementally) once per run"""
+    repo_path = repo_path.resolve()
+    index = _search_indexes.get(repo_path)
+    if index is not None:
+        return index
+    
+    try:
+        cache: Optional[_TermCache] = _TermCache(INDEX_CACHE_DIR / "terms.sqlite3")
+    except (OSError, sqlite3.Error) as e:
+        print(f"[pj] Search index cache unavailable: {e}", file=sys.stderr)
+        cache = None
+    key = _run_index_key(repo_path)
+    docs = cache.commit_docs(key) if cache and key else None
+    contents: Dict[str, str] = {}
+    
+    if docs is None:
+        docs = []
+        for entry in get_file_index(repo_path).entries:
+            # Dotfiles (.env and friends) are never sent as context
+            if entry.binary or entry.size > SEARCH_MAX_FILE_BYTES or entry.name.startswith("."):
+                continue
+            try:
+                data = (repo_path / entry.path).read_bytes()
+            except OSError:
+                continue
+            digest = hashlib.sha1(data).hexdigest()
+            docs.append((entry.path, digest))
+            contents[digest] = data.decode("utf-8", errors="ignore")
+    
+    hashes = list(dict.fromkeys(digest for _, digest in docs))
+    cached = cache.terms(hashes) if cache else {}
+    missing = [digest for digest in hashes if digest not in cached]
+    paths_by_digest = {digest: path for path, digest in docs} if missing else {}
+    fresh = []
+    for digest in missing:
+        text = contents.get(digest)
+        if text is None:
+            # Listed for this commit but no longer in the cache, read it again
+            path = paths_by_digest[digest]
+            try:
+                text = (repo_path / path).read_text(encoding="utf-8", errors="ignore")
+            except OSError:
+                text = ""
+        fresh.append((digest, _count_terms(text)))
+    cached.update(fresh)
+    if cache:
+        try:
+            cache.put_terms(fresh)
+            if key:
+                cache.put_commit_docs(key, docs)
+        except sqlite3.Error as e:
+            print(f"[pj] Could not cache search index: {e}", file=sys.stderr)
+        cache.close()
+    print(f"[pj] Search index: {len(docs)} files, {len(fresh)} tokenized", file=sys.stderr)
+    
+    term_counts = []
+    for path, digest in docs:
+        counts = dict(cached[digest])
+        for token in tokenize(path):
+            counts[token] = counts.get(token, 0) + SEARCH_PATH_BOOST
+        term_counts.append(counts)
+    index = SearchIndex([path for path, _ in docs], term_counts)
+    _search_indexes[repo_path] = index
+    return index
+
+
+def refresh_indexes(repo_path: Path) -> None:
+    """
+    Forget the in-memory indexes of a repository whose HEAD or working tree
+    changed since they were built. A single run builds them once; the
+    daemon calls this before each task so that unchanged checkouts keep
+    theirs across tasks.
+    """
+    repo_path = repo_path.resolve()
+    if repo_path not in _index_keys:
+        return
+    key = _index_cache_key(repo_path)
+    if key is None or key != _index_keys.get(repo_path):
+        _file_indexes.pop(repo_path, None)
+        _search_indexes.pop(repo_path, None)
+    # The task's indexes are built from this key without looking it up again
+    _index_keys[repo_path] = key
 
 
 def find_relevant_files(repo_path: Path, task_description: str, max_files: int = 10) -> List[Tuple[str, str]]:
@@ -112,12 +727,12 @@ def find_relevant_files(repo_path: Path, task_description: str, max_files: int =
     Returns a list of (file_path, content) tuples.
     """
     relevant_files = []
-    task_lower = task_description.lower()
     
     # First, extract explicit file names mentioned in the task
     # Look for patterns like "README.md", "file.ts", "src/file.js", etc.
     import re
     file_patterns = re.findall(r'\b[\w\-/]+\.\w+\b', task_description)
+    index = get_file_index(repo_path)
     explicit_files = []
     for pattern in file_patterns:
         # Try to find the file
@@ -126,67 +741,27 @@ def find_relevant_files(repo_path: Path, task_description: str, max_files: int =
             explicit_files.append(file_path)
         else:
             # Try case-insensitive search
-            for path in repo_path.rglob("*"):
-                if path.is_file() and path.name.lower() == pattern.lower():
-                    explicit_files.append(path)
-                    break
+            matches = index.find_suffix(pattern)
+            if matches:
+                explicit_files.append(repo_path / matches[0].path)
     
-    # Keywords that might indicate which files to read
-    keywords = []
-    if any(word in task_lower for word in ["api", "route", "endpoint", "handler"]):
-        keywords.extend(["api", "route", "handler", "controller"])
-    if any(word in task_lower for word in ["component", "ui", "page", "view"]):
-        keywords.extend(["component", "page", "view", "ui"])
-    if any(word in task_lower for word in ["config", "setting"]):
-        keywords.extend(["config", "setting", ".env"])
-    if any(word in task_lower for word in ["test", "spec"]):
-        keywords.extend(["test", "spec"])
-    if any(word in task_lower for word in ["readme", "read me"]):
-        keywords.extend(["readme"])
-    
-    # Find files matching keywords or common patterns
+    # Rank the remaining files against the task description
     files_to_check = list(explicit_files)  # Start with explicitly mentioned files
-    for file_path in repo_path.rglob("*"):
-        if file_path.is_file() and not any(part.startswith(".") for part in file_path.parts):
-            # Skip if already in explicit files
-            if file_path in files_to_check:
-                continue
-                
-            # Skip large files and binary files
-            if file_path.stat().st_size > 100000:  # Skip files > 100KB
-                continue
-            
-            file_name = file_path.name.lower()
-            file_path_str = str(file_path.relative_to(repo_path))
-            
-            # Check if file matches keywords or is in common directories
-            if any(keyword in file_name or keyword in file_path_str.lower() for keyword in keywords):
-                files_to_check.append(file_path)
-            elif any(part in ["src", "lib", "app", "components", "pages", "api"] for part in file_path.parts):
-                files_to_check.append(file_path)
-    
-    # Read file contents
-    # For explicitly mentioned files, read the full content (up to a reasonable limit)
-    # For other files, truncate to save tokens
+    explicit_set = set(explicit_files)
+    for rel_path, score in get_search_index(repo_path).search(task_description, limit=max_files + len(explicit_files)):
+        file_path = repo_path / rel_path
+        if file_path not in explicit_set:
+            files_to_check.append(file_path)
+    
+    # Read file contents in full; the context packer (pack_files) decides how
+    # much of each fits in the model's prompt
     for file_path in files_to_check[:max_files]:
         try:
             # Try to read as text
             with open(file_path, "r", encoding="utf-8", errors="ignore") as f:
-                content = f.read()
-                # For explicitly mentioned files, read the FULL content (up to 50KB for markdown/text files)
-                # For other files, limit to 5KB
-                is_explicit = file_path in explicit_files
-                # For markdown and text files, allow much larger content
-                is_text_file = file_path.suffix in ['.md', '.txt', '.rst', '.adoc'] or 'readme' in file_path.name.lower()
-                if is_explicit and is_text_file:
-                    max_size = 50000  # 50KB for text files that are explicitly mentioned
-                elif is_explicit:
-                    max_size = 20000  # 20KB for other explicitly mentioned files
-                else:
-                    max_size = 5000   # 5KB for other files
-                    
-                if len(content) > max_size:
-                    content = content[:max_size] + "\n... (truncated at " + str(max_size) + " characters)"
+                content = f.read(MAX_CONTEXT_FILE_CHARS + 1)
+                if len(content) > MAX_CONTEXT_FILE_CHARS:
+                    content = content[:MAX_CONTEXT_FILE_CHARS] + "\n... (truncated at " + str(MAX_CONTEXT_FILE_CHARS) + " characters)"
                 relevant_files.append((str(file_path.relative_to(repo_path)), content))
         except Exception:
             # Skip files that can't be read
@@ -208,12 +783,7 @@ def analyze_codebase(repo_path: Path) -> Dict[str, Any]:
     }
     
     # Detect languages by file extensions
-    extensions = set()
-    for file_path in repo_path.rglob("*"):
-        if file_path.is_file():
-            ext = file_path.suffix
-            if ext:
-                extensions.add(ext)
+    extensions = set(get_file_index(repo_path).extensions())
     
     # Map extensions to languages
     lang_map = {
@@ -257,13 +827,198 @@ def analyze_codebase(repo_path: Path) -> Dict[str, Any]:
     return analysis
 
 
+def get_context_window_for_model(provider: str, model: str) -> int:
+    """
+    Get the context window (prompt plus completion tokens) of a model.
+    """
+    model_lower = model.lower()
+    
+    # Anthropic models
+    if provider == "anthropic" or "claude" in model_lower:
+        # All Claude 3 models have a 200K context window
+        return 200000
+    # GPT-4o and GPT-4-turbo have a 128K context window
+    if "gpt-4o" in model_lower or "gpt-4-turbo" in model_lower or "gpt-4-1106" in model_lower:
+        return 128000
+    # GPT-4 base has 8K
+    if "gpt-4" in model_lower:
+        return 8192
+    # GPT-3.5-turbo has 16K
+    if "gpt-3.5" in model_lower:
+        return 16385
+    # Kimi K2 has a 200K context window
+    if "kimi-k2" in model_lower or "moonshotai/kimi" in model_lower:
+        return 200000
+    # Other OpenAI and OpenRouter models - assume the common 128K
+    return 128000
+
+
+CHARS_PER_TOKEN = 3.5  # Conservative estimate when tiktoken is not available
+PROMPT_SAFETY_MARGIN = 0.1  # Share of the context window kept free (other tokenizers count differently)
+MAX_CONTEXT_FILE_CHARS = 200000  # Files are never read past this, whatever the budget
+
+_encodings: Dict[str, Any] = {}
+
+
+def count_tokens(text: str, model: str) -> int:
+    """
+    Count prompt tokens with tiktoken when it is installed (and its encoding
+    files are available), otherwise estimate from the length.
+    """
+    if tiktoken is not None:
+        if model not in _encodings:
+            try:
+                try:
+                    _encodings[model] = tiktoken.encoding_for_model(model)
+                except KeyError:
+                    # Not an OpenAI model; o200k_base is close enough for budgeting
+                    _encodings[model] = tiktoken.get_encoding("o200k_base")
+            except Exception as e:
+                print(f"[pj] Warning: tiktoken unavailable ({e}), estimating token counts", file=sys.stderr)
+                _encodings[model] = None
+        encoding = _encodings[model]
+        if encoding is not None:
+            return len(encoding.encode(text, disallowed_special=()))
+    return int(len(text) / CHARS_PER_TOKEN) + 1
+
+
+def input_token_budget(provider: str, model: str, *fixed_parts: str) -> int:
+    """
+    Tokens left for file contents once the completion (max_tokens), the
+    fixed parts of the prompt and a safety margin are taken out of the
+    model's context window.
+    """
+    window = get_context_window_for_model(provider, model)
+    completion = get_max_tokens_for_model(provider, model)
+    fixed = sum(count_tokens(part, model) for part in fixed_parts if part)
+    budget = int(window * (1 - PROMPT_SAFETY_MARGIN)) - completion - fixed
+    print(f"[pj] Context budget: {max(0, budget)} tokens for files (window {window}, completion {completion}, fixed prompt {fixed})", file=sys.stderr)
+    return max(0, budget)
+
+
+# Lines kept in a symbol outline: declarations in the common languages, and markdown headings
+OUTLINE_RE = re.compile(
+    r"^\s*(?:"
+    r"(?:export\s+)?(?:default\s+)?(?:abstract\s+)?(?:async\s+)?(?:function\*?|class|interface|type|enum|namespace)\s+\w"
+    r"|(?:export\s+)?(?:const|let|var)\s+\w+\s*(?::[^=]+)?=\s*(?:async\s+)?(?:\([^)]*\)|\w+)\s*(?::[^=]+)?=>"
+    r"|(?:async\s+)?def\s+\w"
+    r"|(?:pub(?:\([\w:]+\))?\s+)?(?:async\s+)?(?:fn|struct|trait|impl|mod)\b"
+    r"|func\s"
+    r"|(?:public|private|protected|internal)\s+(?:static\s+)?[\w<>\[\],\s]*\w+\s*\("
+    r"|#{1,3}\s"
+    r")"
+)
+OUTLINE_FALLBACK_LINES = 20  # Shown when a file has no recognizable declarations
+
+
+def split_target_files(task_description: str, relevant_files: List[Tuple[str, str]]) -> Tuple[List[Tuple[str, str]], List[Tuple[str, str]]]:
+    """Split relevant files into the ones the task names (to modify) and context files"""
+    targets, context = [], []
+    for file_path, content in relevant_files:
+        file_name = file_path.split('/')[-1]
+        if file_path in task_description or file_name in task_description:
+            targets.append((file_path, content))
+        else:
+            context.append((file_path, content))
+    return targets, context
+
+
+def _numbered(lines: List[str], start: int = 1) -> str:
+    return '\n'.join(f"{i:4d}| {line}" for i, line in enumerate(lines, start))
+
+
+def outline_file(content: str) -> str:
+    """Symbol outline of a file: its declaration lines, with their line numbers"""
+    lines = content.split('\n')
+    outline = [f"{i + 1:4d}| {line}" for i, line in enumerate(lines) if OUTLINE_RE.match(line)]
+    if not outline:
+        outline = [f"{i + 1:4d}| {line}" for i, line in enumerate(lines[:OUTLINE_FALLBACK_LINES])]
+    return '\n'.join(outline)
+
+
+def _cut_middle(lines: List[str], budget: int, tokens: int) -> str:
+    """Numbered head and tail of a file, dropping the middle so it fits in about `budget` tokens"""
+    keep = max(2, int(len(lines) * budget / max(tokens, 1)))
+    head = keep * 2 // 3
+    tail = keep - head
+    return (
+        _numbered(lines[:head])
+        + f"\n... (lines {head + 1}-{len(lines) - tail} omitted to fit the context window) ...\n"
+        + _numbered(lines[-tail:], len(lines) - tail + 1)
+    )
+
+
+def pack_files(
+    files: List[Tuple[str, str]],
+    budget: int,
+    model: str,
+    required: bool = False,
+    numbered: bool = True,
+    note: str = "",
+) -> Tuple[List[str], int]:
+    """
+    Render files as prompt blocks that fit in `budget` tokens, in priority
+    order. Returns the blocks and the tokens they use.
+    
+    Required files (the ones to modify) are always shown in full; only when
+    one does not fit on its own is its middle cut out. Other files are shown
+    in full while they fit, then as symbol outlines, then left out.
+    """
+    blocks = []
+    used = 0
+    for file_path, content in files:
+        lines = content.split('\n')
+        header = f"\n--- File: {file_path} ({len(lines)} lines total){note} ---\n"
+        body = _numbered(lines) if numbered else content
+        block = header + body + "\n"
+        tokens = count_tokens(block, model)
+        if required or used + tokens <= budget:
+            if required and used + tokens > budget:
+                remaining = max(budget - used, 0)
+                print(f"[pj] Warning: {file_path} needs {tokens} tokens, only {remaining} left - cutting its middle", file=sys.stderr)
+                block = header + _cut_middle(lines, remaining, tokens) + "\n"
+                tokens = count_tokens(block, model)
+            blocks.append(block)
+            used += tokens
+            continue
+        
+        block = f"\n--- File: {file_path} ({len(lines)} lines total){note} - OUTLINE ONLY ---\n{outline_file(content)}\n"
+        tokens = count_tokens(block, model)
+        if used + tokens <= budget:
+            print(f"[pj] Context: {file_path} shown as an outline", file=sys.stderr)
+            blocks.append(block)
+            used += tokens
+        else:
+            print(f"[pj] Context: {file_path} left out (no budget left)", file=sys.stderr)
+    return blocks, used
+
+
+_system_prompts: Dict[Tuple[Path, int], str] = {}
+
+
 def load_system_prompt(prompt_file: Path) -> str:
-    """Load the system prompt from file"""
+    """Load the system prompt from file, reading each version of it once per process"""
     if not prompt_file.exists():
         raise FileNotFoundError(f"System prompt file not found: {prompt_file}")
     
-    with open(prompt_file, "r") as f:
-        return f.read()
+    key = (prompt_file.resolve(), prompt_file.stat().st_mtime_ns)
+    prompt = _system_prompts.get(key)
+    if prompt is None:
+        with open(prompt_file, "r") as f:
+            prompt = _system_prompts[key] = f.read()
+    return prompt
+
+
+# Closing instructions of the direct diff prompts
+DIFF_INSTRUCTIONS = "\n\nGenerate a unified diff patch that implements the task.\n\n**CRITICAL INSTRUCTIONS:**\n1. **If a file is shown above, it EXISTS and must be MODIFIED, not created**\n2. **Check if the content you're trying to add already exists** - if it does, modify the existing content instead of adding duplicates\n3. Use the EXACT context lines from the files shown above - copy them character-for-character\n4. Do NOT modify, reformat, or guess any context lines\n5. Ensure all whitespace (spaces, tabs, newlines) matches exactly\n6. **Include at least 3 lines of context BEFORE and AFTER each change** - this is critical for git apply to work\n7. Verify the hunk line numbers (the @@ lines) match the actual line positions in the file\n8. **For existing files**: The hunk must start with a line number > 0 (e.g., @@ -1,10 +1,12 @@), NOT @@ -0,0 +1,10 @@\n9. **@@ -0,0 +X,Y @@ means creating a NEW file - only use this if the file is NOT shown above**\n10. **Complete the patch fully** - do not leave incomplete lines or sections\n11. **End the patch properly** - ensure the last line is complete and the patch is valid\n12. **The patch must include context lines after the change** - show what comes after your changes so git apply knows where the hunk ends\n\nOutput ONLY the unified diff, with no explanations, no markdown formatting, no code blocks - just the raw diff text."
+
+# Follow-up for the hunks of a direct patch that could not be placed
+REJECTS_PROMPT = (
+    "The rest of a previous patch for this task has already been applied: the files shown above are their "
+    "current content. The hunks below could not be applied to them. Generate a unified diff against the files "
+    "exactly as shown that makes ONLY the changes these hunks were meant to make, and nothing that is already "
+    "done. Rejected hunks:"
+)
 
 
 def generate_patch_openai(
@@ -274,8 +1029,10 @@ def generate_patch_openai(
     relevant_files: List[Tuple[str, str]],
     model: str = "gpt-4o",
     api_key: Optional[str] = None,
+    provider: str = "openai",
 ) -> str:
     """Generate code patch using OpenAI API"""
+    load_provider_sdk("openai")
     if openai is None:
         raise ImportError("openai package is not installed. Install with: pip install openai")
     
@@ -284,7 +1041,7 @@ def generate_patch_openai(
         if not api_key:
             raise ValueError("OPENAI_API_KEY environment variable is required")
     
-    client = openai.OpenAI(api_key=api_key)
+    client = shared_client(("openai", api_key), lambda: openai.OpenAI(api_key=api_key))
     
     # Build user prompt
     user_prompt = f"""Task Description:
@@ -297,75 +1054,65 @@ Codebase Analysis:
 - Top-level structure: {', '.join(codebase_analysis.get('file_structure', [])[:20])}
 """
     
-    # Include relevant file contents
+    # Include relevant file contents, fitted to the model's context window:
+    # files named in the task in full, the rest in full or as outlines
     if relevant_files:
+        budget = input_token_budget(provider, model, system_prompt, user_prompt, coderabbit_analysis or "", DIFF_INSTRUCTIONS)
+        targets, context = split_target_files(task_description, relevant_files)
+        target_blocks, used = pack_files(targets, budget, model, required=True)
+        context_blocks, _ = pack_files(context, budget - used, model)
         user_prompt += "\n\nRelevant Files (these files EXIST and should be MODIFIED, not created):\n"
-        for file_path, content in relevant_files:
-            # Add line numbers to help the agent understand the file structure
-            lines = content.split('\n')
-            line_count = len(lines)
-            user_prompt += f"\n--- File: {file_path} ({line_count} lines total) ---\n"
-            # For files that might be truncated, show first and last portions
-            if "... (truncated" in content:
-                # Show first 100 lines and last 50 lines
-                first_lines = '\n'.join(lines[:100])
-                last_lines = '\n'.join(lines[-50:]) if len(lines) > 150 else ""
-                if last_lines:
-                    user_prompt += f"{first_lines}\n... (middle section truncated) ...\n{last_lines}\n"
-                else:
-                    user_prompt += f"{content}\n"
-            else:
-                # Show full content with line numbers for reference (first 10 chars of line number for alignment)
-                numbered_lines = [f"{i+1:4d}| {line}" for i, line in enumerate(lines)]
-                user_prompt += '\n'.join(numbered_lines) + "\n"
+        user_prompt += "".join(target_blocks + context_blocks)
     
     if coderabbit_analysis:
         user_prompt += f"\n\nCodeRabbit Analysis:\n{coderabbit_analysis}\n"
     
-    user_prompt += "\n\nGenerate a unified diff patch that implements the task.\n\n**CRITICAL INSTRUCTIONS:**\n1. **If a file is shown above, it EXISTS and must be MODIFIED, not created**\n2. **Check if the content you're trying to add already exists** - if it does, modify the existing content instead of adding duplicates\n3. Use the EXACT context lines from the files shown above - copy them character-for-character\n4. Do NOT modify, reformat, or guess any context lines\n5. Ensure all whitespace (spaces, tabs, newlines) matches exactly\n6. **Include at least 3 lines of context BEFORE and AFTER each change** - this is critical for git apply to work\n7. Verify the hunk line numbers (the @@ lines) match the actual line positions in the file\n8. **For existing files**: The hunk must start with a line number > 0 (e.g., @@ -1,10 +1,12 @@), NOT @@ -0,0 +1,10 @@\n9. **@@ -0,0 +X,Y @@ means creating a NEW file - only use this if the file is NOT shown above**\n10. **Complete the patch fully** - do not leave incomplete lines or sections\n11. **End the patch properly** - ensure the last line is complete and the patch is valid\n12. **The patch must include context lines after the change** - show what comes after your changes so git apply knows where the hunk ends\n\nOutput ONLY the unified diff, with no explanations, no markdown formatting, no code blocks - just the raw diff text."
+    user_prompt += DIFF_INSTRUCTIONS
     
+    deadline = call_deadline(LLM_CALL_TIMEOUT, "OpenAI API call")
+    deadline.check()  # A spent or cancelled task budget fails here, not as an HTTP timeout
+    call_timeout = deadline.client_timeout(LLM_CALL_TIMEOUT)
+    client = client.with_options(timeout=call_timeout)  # The HTTP client enforces the limit, in any thread
     try:
-        with timeout(180):  # 3 minute timeout
-            max_tokens = get_max_tokens_for_model(provider, model)
-            print(f"[pj] Using max_tokens={max_tokens} for model {model} (provider: {provider})", file=sys.stderr)
-            
-            response = client.chat.completions.create(
-                model=model,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt},
-                ],
-                temperature=0.0,  # Deterministic output
-                max_tokens=max_tokens,  # Model-specific limit
-            )
-            
-            # Safely extract content and metadata
-            if not response.choices or len(response.choices) == 0:
-                raise RuntimeError("No choices in API response")
-            
-            choice = response.choices[0]
-            if not hasattr(choice, 'message') or not choice.message:
-                raise RuntimeError("No message in API response choice")
-            
-            if not hasattr(choice.message, 'content') or not choice.message.content:
-                raise RuntimeError("No content in API response message")
-            
-            patch = choice.message.content.strip()
-            
-            # Track token usage
-            usage = getattr(response, 'usage', None)
-            if usage:
-                print(f"[pj] Token usage: {usage.total_tokens} (prompt: {usage.prompt_tokens}, completion: {usage.completion_tokens})", file=sys.stderr)
-            
-            # Check if response was truncated (finish_reason indicates truncation)
-            finish_reason = getattr(choice, 'finish_reason', None)
-            if finish_reason == "length":
-                print(f"[pj] Warning: Response was truncated (finish_reason: {finish_reason}). Patch may be incomplete.", file=sys.stderr)
-            
-            return patch
-    except TimeoutError:
-        raise TimeoutError("OpenAI API call timed out after 180 seconds")
+        max_tokens = get_max_tokens_for_model(provider, model)
+        print(f"[pj] Using max_tokens={max_tokens} for model {model} (provider: {provider})", file=sys.stderr)
+        
+        response = client.chat.completions.create(
+            model=model,
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_prompt},
+            ],
+            temperature=0.0,  # Deterministic output
+            max_tokens=max_tokens,  # Model-specific limit
+        )
+        
+        # Safely extract content and metadata
+        if not response.choices or len(response.choices) == 0:
+            raise RuntimeError("No choices in API response")
+        
+        choice = response.choices[0]
+        if not hasattr(choice, 'message') or not choice.message:
+            raise RuntimeError("No message in API response choice")
+        
+        if not hasattr(choice.message, 'content') or not choice.message.content:
+            raise RuntimeError("No content in API response message")
+        
+        patch = choice.message.content.strip()
+        
+        # Track token usage
+        usage = getattr(response, 'usage', None)
+        log_token_usage(usage)
+        
+        # Check if response was truncated (finish_reason indicates truncation)
+        finish_reason = getattr(choice, 'finish_reason', None)
+        if finish_reason == "length":
+            print(f"[pj] Warning: Response was truncated (finish_reason: {finish_reason}). Patch may be incomplete.", file=sys.stderr)
+        
+        return patch
     except Exception as e:
+        if _is_timeout(e):
+            raise TimeoutError(f"OpenAI API call timed out after {call_timeout:g} seconds")
         raise RuntimeError(f"OpenAI API error: {str(e)}")
 
 
@@ -377,8 +1124,10 @@ def generate_patch_anthropic(
     relevant_files: List[Tuple[str, str]],
     model: str = "claude-3-5-sonnet-20241022",
     api_key: Optional[str] = None,
+    provider: str = "anthropic",
 ) -> str:
     """Generate code patch using Anthropic API"""
+    load_provider_sdk("anthropic")
     if anthropic is None:
         raise ImportError("anthropic package is not installed. Install with: pip install anthropic")
     
@@ -387,7 +1136,7 @@ def generate_patch_anthropic(
         if not api_key:
             raise ValueError("ANTHROPIC_API_KEY environment variable is required")
     
-    client = anthropic.Anthropic(api_key=api_key)
+    client = shared_client(("anthropic", api_key), lambda: anthropic.Anthropic(api_key=api_key))
     
     # Build user prompt
     user_prompt = f"""Task Description:
@@ -400,171 +1149,601 @@ Codebase Analysis:
 - Top-level structure: {', '.join(codebase_analysis.get('file_structure', [])[:20])}
 """
     
-    # Include relevant file contents
+    # Include relevant file contents, fitted to the model's context window:
+    # files named in the task in full, the rest in full or as outlines
     if relevant_files:
+        budget = input_token_budget(provider, model, system_prompt, user_prompt, coderabbit_analysis or "", DIFF_INSTRUCTIONS)
+        targets, context = split_target_files(task_description, relevant_files)
+        target_blocks, used = pack_files(targets, budget, model, required=True)
+        context_blocks, _ = pack_files(context, budget - used, model)
         user_prompt += "\n\nRelevant Files (these files EXIST and should be MODIFIED, not created):\n"
-        for file_path, content in relevant_files:
-            # Add line numbers to help the agent understand the file structure
-            lines = content.split('\n')
-            line_count = len(lines)
-            user_prompt += f"\n--- File: {file_path} ({line_count} lines total) ---\n"
-            # For files that might be truncated, show first and last portions
-            if "... (truncated" in content:
-                # Show first 100 lines and last 50 lines
-                first_lines = '\n'.join(lines[:100])
-                last_lines = '\n'.join(lines[-50:]) if len(lines) > 150 else ""
-                if last_lines:
-                    user_prompt += f"{first_lines}\n... (middle section truncated) ...\n{last_lines}\n"
-                else:
-                    user_prompt += f"{content}\n"
-            else:
-                # Show full content with line numbers for reference (first 10 chars of line number for alignment)
-                numbered_lines = [f"{i+1:4d}| {line}" for i, line in enumerate(lines)]
-                user_prompt += '\n'.join(numbered_lines) + "\n"
+        user_prompt += "".join(target_blocks + context_blocks)
     
     if coderabbit_analysis:
         user_prompt += f"\n\nCodeRabbit Analysis:\n{coderabbit_analysis}\n"
     
-    user_prompt += "\n\nGenerate a unified diff patch that implements the task.\n\n**CRITICAL INSTRUCTIONS:**\n1. **If a file is shown above, it EXISTS and must be MODIFIED, not created**\n2. **Check if the content you're trying to add already exists** - if it does, modify the existing content instead of adding duplicates\n3. Use the EXACT context lines from the files shown above - copy them character-for-character\n4. Do NOT modify, reformat, or guess any context lines\n5. Ensure all whitespace (spaces, tabs, newlines) matches exactly\n6. **Include at least 3 lines of context BEFORE and AFTER each change** - this is critical for git apply to work\n7. Verify the hunk line numbers (the @@ lines) match the actual line positions in the file\n8. **For existing files**: The hunk must start with a line number > 0 (e.g., @@ -1,10 +1,12 @@), NOT @@ -0,0 +1,10 @@\n9. **@@ -0,0 +X,Y @@ means creating a NEW file - only use this if the file is NOT shown above**\n10. **Complete the patch fully** - do not leave incomplete lines or sections\n11. **End the patch properly** - ensure the last line is complete and the patch is valid\n12. **The patch must include context lines after the change** - show what comes after your changes so git apply knows where the hunk ends\n\nOutput ONLY the unified diff, with no explanations, no markdown formatting, no code blocks - just the raw diff text."
+    user_prompt += DIFF_INSTRUCTIONS
     
+    deadline = call_deadline(LLM_CALL_TIMEOUT, "Anthropic API call")
+    deadline.check()  # A spent or cancelled task budget fails here, not as an HTTP timeout
+    call_timeout = deadline.client_timeout(LLM_CALL_TIMEOUT)
+    client = client.with_options(timeout=call_timeout)  # The HTTP client enforces the limit, in any thread
     try:
-        with timeout(180):  # 3 minute timeout
-            message = client.messages.create(
-                model=model,
-                max_tokens=16384,  # Increased limit for larger patches
-                temperature=0.0,  # Deterministic output
-                system=system_prompt,
-                messages=[
-                    {"role": "user", "content": user_prompt},
-                ],
-            )
-            
-            # Safely extract content from Anthropic response
-            if not hasattr(message, 'content') or not message.content or len(message.content) == 0:
-                raise RuntimeError("No content in Anthropic API response")
-            
-            if not hasattr(message.content[0], 'text') or not message.content[0].text:
-                raise RuntimeError("No text in Anthropic API response content")
-            
-            patch = message.content[0].text.strip()
-            
-            # Track token usage
-            usage = getattr(message, 'usage', None)
-            if usage:
-                print(f"[pj] Token usage: {usage.input_tokens} input, {usage.output_tokens} output", file=sys.stderr)
-            
-            # Check if response was truncated (stop_reason indicates truncation)
-            stop_reason = getattr(message, 'stop_reason', None)
-            if stop_reason == "max_tokens":
-                print(f"[pj] Warning: Response was truncated (stop_reason: {stop_reason}). Patch may be incomplete.", file=sys.stderr)
-            
-            return patch
-    except TimeoutError:
-        raise TimeoutError("Anthropic API call timed out after 180 seconds")
+        message = client.messages.create(
+            model=model,
+            max_tokens=16384,  # Increased limit for larger patches
+            temperature=0.0,  # Deterministic output
+            system=system_prompt,
+            messages=[
+                {"role": "user", "content": user_prompt},
+            ],
+        )
+        
+        # Safely extract content from Anthropic response
+        if not hasattr(message, 'content') or not message.content or len(message.content) == 0:
+            raise RuntimeError("No content in Anthropic API response")
+        
+        if not hasattr(message.content[0], 'text') or not message.content[0].text:
+            raise RuntimeError("No text in Anthropic API response content")
+        
+        patch = message.content[0].text.strip()
+        
+        # Track token usage
+        usage = getattr(message, 'usage', None)
+        log_token_usage(usage)
+        
+        # Check if response was truncated (stop_reason indicates truncation)
+        stop_reason = getattr(message, 'stop_reason', None)
+        if stop_reason == "max_tokens":
+            print(f"[pj] Warning: Response was truncated (stop_reason: {stop_reason}). Patch may be incomplete.", file=sys.stderr)
+        
+        return patch
     except Exception as e:
+        if _is_timeout(e):
+            raise TimeoutError(f"Anthropic API call timed out after {call_timeout:g} seconds")
         raise RuntimeError(f"Anthropic API error: {str(e)}")
 
 
-def validate_diff_format(patch: str) -> Tuple[bool, List[str]]:
-    """
-    Validate that the patch is in proper unified diff format.
-    Returns (is_valid, list_of_errors)
-    """
-    errors = []
-    lines = patch.split("\n")
+HUNK_HEADER_RE = re.compile(r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@(.*)$")
+NO_NEWLINE_PREFIX = "\\ "  # "\ No newline at end of file" (the wording varies with git's locale)
+PATCH_CHECKED_SUFFIX = ".checked"  # Marker execution.sh reads to skip `git apply --check`
+PATCH_REJECTS_SUFFIX = ".rej"  # Hunks that could not be placed, in git's .rej layout
+HUNK_MAX_FUZZ = 2  # Context lines that may be dropped from each end of a hunk to place it, as patch(1) does
+REJECT_REPROMPTS = int(os.getenv("AGENT_REJECT_REPROMPTS", "1"))  # Follow-up requests covering only rejected hunks
+EXTENDED_HEADER_PREFIXES = (
+    "index ", "old mode ", "new mode ", "new file mode ", "deleted file mode ",
+    "similarity index ", "dissimilarity index ", "rename from ", "rename to ", "copy from ", "copy to ",
+)
+
+
+class PatchLine(NamedTuple):
+    kind: str  # " " (context), "-" (removed) or "+" (added)
+    text: str  # Without the line ending
+    newline: bool  # False when followed by the no-newline marker
+
+
+class Hunk:
+    """One @@ section of a file patch"""
     
-    if not patch.strip():
-        return False, ["Patch is empty"]
+    def __init__(self, number: int, old_start: int, old_count: int, new_start: int, new_count: int, line_no: int):
+        self.number = number  # 1-based across the whole patch, as reported in errors
+        self.old_start = old_start
+        self.old_count = old_count
+        self.new_start = new_start
+        self.new_count = new_count
+        self.line_no = line_no  # 1-based line of the @@ header in the patch
+        self.lines: List[PatchLine] = []
     
-    # Check for diff header markers
-    has_diff_markers = False
-    has_file_headers = False
-    for i, line in enumerate(lines):
-        if line.startswith("--- "):
-            has_diff_markers = True
-            # Check if next line is +++
-            if i + 1 < len(lines) and lines[i + 1].startswith("+++ "):
-                has_file_headers = True
-            break
+    def old_lines(self) -> List[str]:
+        return [l.text + ("\n" if l.newline else "") for l in self.lines if l.kind != "+"]
     
-    if not has_diff_markers:
-        errors.append("Missing diff header markers (--- or +++ lines)")
+    def new_lines(self) -> List[str]:
+        return [l.text + ("\n" if l.newline else "") for l in self.lines if l.kind != "-"]
     
-    if not has_file_headers:
-        errors.append("Missing file header pair (--- and +++ must be consecutive)")
-    
-    # Check for at least one hunk (starts with @@)
-    hunk_lines = [line for line in lines if line.startswith("@@")]
-    if not hunk_lines:
-        errors.append("Missing diff hunk markers (@@ lines)")
-        return False, errors
-    
-    # Validate each hunk format and content
-    for hunk_idx, hunk_line in enumerate(hunk_lines):
-        # Hunk should match: @@ -start,count +start,count @@
-        hunk_match = re.match(r"^@@\s+-(\d+)(?:,(\d+))?\s+\+(\d+)(?:,(\d+))?\s+@@", hunk_line)
-        if not hunk_match:
-            errors.append(f"Invalid hunk format: {hunk_line}")
-            continue
-        
-        old_start = int(hunk_match.group(1))
-        old_count = int(hunk_match.group(2)) if hunk_match.group(2) else 1
-        new_start = int(hunk_match.group(3))
-        new_count = int(hunk_match.group(4)) if hunk_match.group(4) else 1
-        
-        # Find the lines in this hunk (from this @@ to the next @@ or end)
-        hunk_start_idx = lines.index(hunk_line)
-        if hunk_idx + 1 < len(hunk_lines):
-            hunk_end_idx = lines.index(hunk_lines[hunk_idx + 1])
-        else:
-            hunk_end_idx = len(lines)
-        
-        hunk_content = lines[hunk_start_idx + 1:hunk_end_idx]
-        
-        # Count lines in hunk
-        context_lines = [l for l in hunk_content if l.startswith(" ")]
-        remove_lines = [l for l in hunk_content if l.startswith("-")]
-        add_lines = [l for l in hunk_content if l.startswith("+")]
-        
-        total_old_lines = len(context_lines) + len(remove_lines)
-        total_new_lines = len(context_lines) + len(add_lines)
-        
-        # Validate line counts match hunk header
-        if total_old_lines != old_count:
-            errors.append(f"Hunk {hunk_idx + 1}: Expected {old_count} old lines (context + removes), but found {total_old_lines} (context: {len(context_lines)}, removes: {len(remove_lines)})")
-        
-        if total_new_lines != new_count:
-            errors.append(f"Hunk {hunk_idx + 1}: Expected {new_count} new lines (context + adds), but found {total_new_lines} (context: {len(context_lines)}, adds: {len(add_lines)})")
+    def text(self) -> str:
+        """The hunk as patch text, with a header recomputed from its lines"""
+        context, removed, added = self.counts()
+        out = [f"@@ -{self.old_start},{context + removed} +{self.new_start},{context + added} @@\n"]
+        for line in self.lines:
+            out.append(line.kind + line.text + "\n")
+            if not line.newline:
+                out.append("\\ No newline at end of file\n")
+        return "".join(out)
+    
+    def counts(self) -> Tuple[int, int, int]:
+        """Context, removed and added line counts"""
+        kinds = [l.kind for l in self.lines]
+        return kinds.count(" "), kinds.count("-"), kinds.count("+")
+
+
+class FilePatch:
+    """The changes to one file: paths relative to the repository (None for /dev/null) and hunks"""
+    
+    def __init__(self, old_path: Optional[str] = None, new_path: Optional[str] = None):
+        self.old_path = old_path
+        self.new_path = new_path
+        self.is_new = False
+        self.is_deleted = False
+        self.checkable = True  # False for renames, mode-only and binary changes
+        self.hunks: List[Hunk] = []
+    
+    @property
+    def path(self) -> Optional[str]:
+        return self.new_path or self.old_path
+    
+    def label(self) -> str:
+        return self.path or "<unknown file>"
+
+
+def _header_path(text: str) -> Optional[str]:
+    """The repository path in a ---/+++ or diff --git name, without its a/ or b/ prefix"""
+    if text.startswith('"'):
+        end = 1
+        while end < len(text) and text[end] != '"':
+            end += 2 if text[end] == "\\" else 1
+        raw = text[1:end].encode("latin-1", "backslashreplace")
+        text = raw.decode("unicode_escape").encode("latin-1").decode("utf-8", "replace")
+    else:
+        text = text.split("\t", 1)[0].rstrip()
+    if text == "/dev/null":
+        return None
+    return text.split("/", 1)[1] if "/" in text else text
+
+
+def parse_patch(patch: str) -> Tuple[List[FilePatch], List[str]]:
+    """
+    Parse a unified diff in one pass into files, hunks and lines. Returns
+    the files and the structural errors found (bad headers, hunk bodies that
+    do not match their line counts, lines outside any hunk).
+    """
+    files: List[FilePatch] = []
+    errors: List[str] = []
+    current: Optional[FilePatch] = None
+    hunk: Optional[Hunk] = None
+    old_left = new_left = 0
+    hunk_number = 0
+    headers_seen = False  # Whether the current file already had its ---/+++ pair
+    
+    def close_hunk():
+        nonlocal hunk
+        if hunk is None:
+            return
+        context, removed, added = hunk.counts()
+        where = f"Hunk {hunk.number} ({current.label()}, patch line {hunk.line_no})"
+        if context + removed != hunk.old_count:
+            errors.append(f"{where}: Expected {hunk.old_count} old lines (context + removes), but found {context + removed} (context: {context}, removes: {removed})")
+        if context + added != hunk.new_count:
+            errors.append(f"{where}: Expected {hunk.new_count} new lines (context + adds), but found {context + added} (context: {context}, adds: {added})")
+        hunk = None
+    
+    lines = patch.split("\n")
+    if lines and lines[-1] == "":
+        lines.pop()
+    
+    for line_no, line in enumerate(lines, 1):
+        if hunk is not None:
+            in_body = old_left > 0 or new_left > 0
+            if line.startswith(("@@ ", "diff --git ")) or (not in_body and line.startswith(("--- ", "+++ "))):
+                close_hunk()
+            elif line.startswith(NO_NEWLINE_PREFIX) and hunk.lines:
+                hunk.lines[-1] = hunk.lines[-1]._replace(newline=False)
+                continue
+            elif line[:1] in (" ", "-", "+") or (line == "" and in_body):
+                # An empty line is an empty context line whose leading space was stripped
+                kind = line[:1] or " "
+                hunk.lines.append(PatchLine(kind, line[1:], True))
+                if kind != "+":
+                    old_left -= 1
+                if kind != "-":
+                    new_left -= 1
+                continue
+            else:
+                close_hunk()
         
-        # Check for context lines before and after changes
-        if hunk_content:
-            # Check if there are context lines before first change
-            first_change_idx = next((i for i, l in enumerate(hunk_content) if l.startswith(("-", "+"))), None)
-            if first_change_idx is not None and first_change_idx == 0:
-                errors.append(f"Hunk {hunk_idx + 1}: Missing context lines before changes (should have at least 3 lines of context before first - or +)")
-            
-            # Check if there are context lines after last change
-            last_change_idx = next((i for i in range(len(hunk_content) - 1, -1, -1) if hunk_content[i].startswith(("-", "+"))), None)
-            if last_change_idx is not None and last_change_idx == len(hunk_content) - 1:
-                errors.append(f"Hunk {hunk_idx + 1}: Missing context lines after changes (should have at least 3 lines of context after last - or +)")
-    
-    # Check for context lines (lines starting with space, -, or +)
-    has_context = any(
-        line.startswith((" ", "-", "+")) and not line.startswith("---") and not line.startswith("+++")
-        for line in lines
-    )
-    if not has_context:
-        errors.append("Missing context lines (lines starting with space, -, or +)")
+        if line.startswith("diff --git "):
+            names = line[len("diff --git "):]
+            split = names.find(" b/") if not names.startswith('"') else names.find('" ') + 1
+            current = FilePatch(_header_path(names[:split]) if split > 0 else None, _header_path(names[split + 1:]) if split > 0 else None)
+            files.append(current)
+            headers_seen = False
+        elif line.startswith("--- "):
+            if current is None or current.hunks or headers_seen:
+                current = FilePatch()
+                files.append(current)
+            headers_seen = True
+            current.old_path = _header_path(line[4:])
+            current.is_new = current.old_path is None
+        elif line.startswith("+++ "):
+            if current is None:
+                errors.append(f"Patch line {line_no}: '+++' header without a preceding '---' header")
+                current = FilePatch()
+                files.append(current)
+            current.new_path = _header_path(line[4:])
+            current.is_deleted = current.new_path is None
+        elif line.startswith("@@"):
+            match = HUNK_HEADER_RE.match(line)
+            if not match:
+                errors.append(f"Patch line {line_no}: Invalid hunk format: {line}")
+                continue
+            if current is None:
+                errors.append(f"Patch line {line_no}: Hunk before any file header")
+                current = FilePatch()
+                files.append(current)
+            hunk_number += 1
+            hunk = Hunk(
+                hunk_number,
+                int(match.group(1)), int(match.group(2)) if match.group(2) is not None else 1,
+                int(match.group(3)), int(match.group(4)) if match.group(4) is not None else 1,
+                line_no,
+            )
+            current.hunks.append(hunk)
+            old_left, new_left = hunk.old_count, hunk.new_count
+        elif current is not None and line.startswith(EXTENDED_HEADER_PREFIXES):
+            if line.startswith("new file mode "):
+                current.is_new = True
+            elif line.startswith("deleted file mode "):
+                current.is_deleted = True
+            elif not line.startswith("index "):
+                current.checkable = False
+        elif line.startswith("Binary files ") or line.startswith("GIT binary patch"):
+            if current is not None:
+                current.checkable = False
+        elif line.strip():
+            errors.append(f"Patch line {line_no}: Unexpected line outside a hunk: {line[:80]}")
+    close_hunk()
     
-    # Check for balanced file headers
-    file_headers = [line for line in lines if line.startswith("--- ") or line.startswith("+++ ")]
-    if len(file_headers) % 2 != 0:
-        errors.append("Unbalanced file headers (--- and +++ should come in pairs)")
+    if not files:
+        errors.append("Missing diff header markers (--- or +++ lines)")
+    for file_patch in files:
+        if file_patch.checkable and not file_patch.hunks and not (file_patch.is_new or file_patch.is_deleted):
+            errors.append(f"{file_patch.label()}: Missing diff hunk markers (@@ lines)")
+    return files, errors
+
+
+def _nearest_first(pos: int, last: int) -> Iterator[int]:
+    """Window starts 0..last, from pos outwards (forwards first), the order git apply searches in"""
+    pos = max(0, min(pos, last))
+    yield pos
+    for offset in range(1, max(pos, last - pos) + 1):
+        if pos + offset <= last:
+            yield pos + offset
+        if pos - offset >= 0:
+            yield pos - offset
+
+
+def _find_hunk(image: List[str], old: List[str], pos: int, match_beginning: bool, match_end: bool) -> int:
+    """Where `old` occurs in `image`, nearest to `pos` first, as git apply searches; -1 if nowhere"""
+    n = len(old)
+    if match_beginning:
+        candidates = [0]
+    elif match_end:
+        candidates = [len(image) - n]
+    else:
+        candidates = _nearest_first(pos, len(image) - n)
+    for candidate in candidates:
+        if candidate >= 0 and image[candidate:candidate + n] == old:
+            return candidate
+    return -1
+
+
+def _relocate_hunk(image: List[str], hunk: Hunk, pos: int) -> Optional[Tuple[int, List[PatchLine], str, str, str]]:
+    """
+    Place a hunk whose lines do not occur in the file as they are: ignoring
+    trailing and then all surrounding whitespace, with up to HUNK_MAX_FUZZ
+    context lines dropped from each end, and finally by similarity. Returns
+    the window start, the hunk lines that matched it, the base indentation of
+    the hunk and of the match, and how it was found.
+    """
+    leading = next((i for i, l in enumerate(hunk.lines) if l.kind != " "), len(hunk.lines))
+    trailing = next((i for i, l in enumerate(reversed(hunk.lines)) if l.kind != " "), len(hunk.lines))
+    
+    def window(lines: List[PatchLine]) -> Tuple[List[str], int]:
+        old = [l.text for l in lines if l.kind != "+"]
+        return old, len(image) - len(old)
+    
+    def indents(old: List[str], start: int) -> Tuple[str, str]:
+        search_indent = next((_leading_whitespace(l) for l in old if l.strip()), "")
+        match_indent = next((_leading_whitespace(l) for l in image[start:start + len(old)] if l.strip()), "")
+        return search_indent, match_indent
+    
+    for fuzz in range(min(HUNK_MAX_FUZZ, max(leading, trailing)) + 1):
+        front, back = min(fuzz, leading), min(fuzz, trailing)
+        lines = hunk.lines[front:len(hunk.lines) - back]
+        old, last = window(lines)
+        if not old or last < 0:
+            continue
+        for name, normalize in (("ignoring line endings", lambda s: s), ("ignoring trailing whitespace", str.rstrip), ("ignoring indentation", str.strip)):
+            wanted = [normalize(l) for l in old]
+            for i in _nearest_first(pos + front, last):
+                if all(normalize(image[i + k].rstrip("\r\n")) == w for k, w in enumerate(wanted)):
+                    how = name + (f", {front + back} context line(s) dropped" if front + back else "")
+                    return (i, lines) + indents(old, i) + (how,)
+    
+    # Similarity over the whole hunk, preferring the best match and then the nearest one
+    old, last = window(hunk.lines)
+    if not old or last < 0:
+        return None
+    wanted = "\n".join(l.strip() for l in old)
+    best, best_ratio = None, EDIT_FUZZY_THRESHOLD
+    for i in _nearest_first(pos, last):
+        matcher = difflib.SequenceMatcher(None, wanted, "\n".join(l.strip() for l in image[i:i + len(old)]), autojunk=False)
+        if matcher.real_quick_ratio() >= best_ratio and matcher.quick_ratio() >= best_ratio:
+            ratio = matcher.ratio()
+            if ratio > best_ratio or (best is None and ratio >= best_ratio):
+                best, best_ratio = i, ratio
+    if best is None:
+        return None
+    return (best, hunk.lines) + indents(old, best) + (f"{best_ratio:.0%} similar",)
+
+
+def _splice(image: List[str], start: int, lines: List[PatchLine], old_indent: str, new_indent: str) -> Tuple[int, List[str]]:
+    """
+    Replacement for a relocated hunk's window: the file's own context lines
+    and the hunk's added lines, moved to the file's indentation and line
+    endings. Returns the window length and the replacement.
+    """
+    length = sum(1 for l in lines if l.kind != "+")
+    eol = "\r\n" if any(l.endswith("\r\n") for l in image[start:start + length]) else "\n"
+    result = []
+    i = start
+    for line in lines:
+        if line.kind == " ":
+            result.append(image[i])
+        elif line.kind == "+":
+            result.append(_reindent([line.text], old_indent, new_indent)[0] + (eol if line.newline else ""))
+        if line.kind != "+":
+            i += 1
+    return length, result
+
+
+def apply_hunks(original: List[str], file_patch: FilePatch, relocate: bool = False) -> Tuple[List[str], List[Tuple[Hunk, str]]]:
+    """
+    Apply a file's hunks to its lines (with line endings) the way `git apply`
+    does: each hunk's removed and context lines must match exactly, near the
+    position its header gives. With `relocate`, hunks that do not match are
+    placed by _relocate_hunk instead, and the offset of each placed hunk
+    carries over to the next. Returns the patched lines and the rejected
+    hunks with the reason.
+    """
+    image = list(original)
+    rejected = []
+    adjust = 0
+    for hunk in file_patch.hunks:
+        old, new = hunk.old_lines(), hunk.new_lines()
+        trailing = next((i for i, l in enumerate(reversed(hunk.lines)) if l.kind != " "), len(hunk.lines))
+        expected = (hunk.new_start - 1 if hunk.new_start else 0) + adjust
+        pos = _find_hunk(image, old, expected, hunk.old_start <= 1, trailing == 0)
+        where = f"Hunk {hunk.number} ({file_patch.label()}, @@ -{hunk.old_start},{hunk.old_count})"
+        if pos >= 0:
+            if pos != expected and hunk.new_start:
+                print(f"[pj] {where} applies at offset {pos - expected}", file=sys.stderr)
+            image[pos:pos + len(old)] = new
+        elif relocate and (placed := _relocate_hunk(image, hunk, expected)):
+            pos, lines, old_indent, new_indent, how = placed
+            print(f"[pj] {where} relocated to line {pos + 1} ({how})", file=sys.stderr)
+            length, replacement = _splice(image, pos, lines, old_indent, new_indent)
+            image[pos:pos + length] = replacement
+        else:
+            # Report the first line that differs where the header says the hunk goes
+            start = max(0, min(expected, len(image)))
+            mismatch = next((i for i, line in enumerate(old) if start + i >= len(image) or image[start + i] != line), None)
+            if mismatch is None:
+                detail = "it must match at the " + ("start" if hunk.old_start <= 1 else "end") + " of the file"
+            else:
+                actual = image[start + mismatch] if start + mismatch < len(image) else "end of file"
+                detail = f"line {hunk.old_start + mismatch} is {actual!r}, expected {old[mismatch]!r}"
+            rejected.append((hunk, f"{where}: does not apply, {detail}"))
+            if relocate:
+                adjust -= hunk.new_count - hunk.old_count
+            continue
+        if relocate:
+            adjust += pos - expected
+    return image, rejected
+
+
+def check_patch(files: List[FilePatch], repo_path: Path) -> Tuple[List[str], bool]:
+    """
+    Check parsed file patches against the repository, like `git apply
+    --check`. Returns the errors and whether every file could be checked
+    (renames, mode changes and binary patches are left to git).
+    """
+    errors = []
+    complete = True
+    for file_patch in files:
+        if not file_patch.checkable or file_patch.path is None:
+            complete = False
+            continue
+        target = repo_path / file_patch.path
+        if file_patch.is_new:
+            if target.exists():
+                errors.append(f"{file_patch.path}: already exists in the repository but the patch creates it")
+                continue
+            original = []
+        else:
+            if not target.is_file():
+                errors.append(f"{file_patch.path}: does not exist in the repository")
+                continue
+            with open(target, "r", encoding="utf-8", errors="surrogateescape", newline="") as f:
+                # Only "\n" ends a line for git; str.splitlines would also break at "\r", "\f" and friends
+                original = io.StringIO(f.read()).readlines()
+        patched, rejected = apply_hunks(original, file_patch)
+        errors.extend(error for _, error in rejected)
+        if file_patch.is_deleted and not rejected and patched:
+            errors.append(f"{file_patch.path}: the patch deletes the file but does not remove all of its content")
+    return errors, complete
+
+
+class PatchedTree:
+    """
+    The files a patch touches, patched in memory with hunk relocation.
+    Several patches can be applied in turn (a follow-up for rejected hunks
+    applies on top of the rest); diff() gives one patch against the
+    repository for all of them.
+    """
+    
+    def __init__(self, repo_path: Path):
+        self.repo_path = repo_path
+        self._original: Dict[str, Optional[bytes]] = {}
+        self._current: Dict[str, Optional[List[str]]] = {}
+    
+    def _load(self, path: str) -> Optional[List[str]]:
+        if path not in self._current:
+            target = self.repo_path / path
+            data = target.read_bytes() if target.is_file() else None
+            self._original[path] = data
+            # Only "\n" ends a line, as in check_patch
+            self._current[path] = io.StringIO(data.decode("utf-8", "surrogateescape")).readlines() if data is not None else None
+        return self._current[path]
+    
+    def content(self, path: str) -> Optional[str]:
+        lines = self._load(path)
+        return "".join(lines) if lines is not None else None
+    
+    def apply(self, files: List[FilePatch]) -> List[Tuple[FilePatch, Optional[Hunk], str]]:
+        """Apply what can be placed; returns the rejected hunks (None for a whole file) with the reason"""
+        rejects = []
+        for file_patch in files:
+            label = file_patch.label()
+            if not file_patch.checkable or file_patch.path is None:
+                rejects.append((file_patch, None, f"{label}: renames, mode changes and binary patches are not applied in-process"))
+                continue
+            current = self._load(file_patch.path)
+            if file_patch.is_new and current is not None:
+                rejects.append((file_patch, None, f"{label}: already exists in the repository but the patch creates it"))
+                continue
+            if not file_patch.is_new and current is None:
+                rejects.append((file_patch, None, f"{label}: does not exist in the repository"))
+                continue
+            image, rejected = apply_hunks(current or [], file_patch, relocate=True)
+            deleted = file_patch.is_deleted and not rejected and not image
+            self._current[file_patch.path] = None if deleted else image
+            rejects.extend((file_patch, hunk, reason) for hunk, reason in rejected)
+        return rejects
+    
+    def diff(self) -> str:
+        patches = []
+        for path, lines in self._current.items():
+            old = self._original[path]
+            new = "".join(lines).encode("utf-8", "surrogateescape") if lines is not None else None
+            mode = "100755" if old is not None and os.access(self.repo_path / path, os.X_OK) else "100644"
+            patches.append(unified_diff(path, old, new, mode=mode))
+        return "".join(patches)
+
+
+def format_rejects(rejects: List[Tuple[FilePatch, Optional[Hunk], str]]) -> str:
+    """Rejected hunks in git's .rej layout, one section per file"""
+    out = []
+    last = None
+    for file_patch, hunk, _ in rejects:
+        if file_patch is not last:
+            out.append(f"diff a/{file_patch.old_path or file_patch.path} b/{file_patch.new_path or file_patch.path}\t(rejected hunks)\n")
+            last = file_patch
+        if hunk is not None:
+            out.append(hunk.text())
+    return "".join(out)
+
+
+def validate_diff_format(patch: str, repo_path: Optional[Path] = None) -> Tuple[bool, List[str]]:
+    """
+    Validate that the patch is in proper unified diff format and, given the
+    repository, that every hunk applies to it.
+    Returns (is_valid, list_of_errors)
+    """
+    if not patch.strip():
+        return False, ["Patch is empty"]
+    
+    files, errors = parse_patch(patch)
+    for file_patch in files:
+        if file_patch.is_new or file_patch.is_deleted or repo_path is not None:
+            continue
+        # Without the files to check against, hunks in the middle of a file should carry context
+        for hunk in file_patch.hunks:
+            if hunk.old_start > 1 and hunk.lines and hunk.lines[0].kind != " ":
+                errors.append(f"Hunk {hunk.number}: Missing context lines before changes (should have at least 3 lines of context before first - or +)")
+            # A last line without a newline marks the end of the file, where no context can follow
+            if hunk.lines and hunk.lines[-1].kind != " " and hunk.lines[-1].newline:
+                errors.append(f"Hunk {hunk.number}: Missing context lines after changes (should have at least 3 lines of context after last - or +)")
+    if repo_path is not None and not errors:
+        errors, _ = check_patch(files, repo_path)
     
     is_valid = len(errors) == 0
     return is_valid, errors
 
 
+def heal_patch(files: List[FilePatch], repo_path: Path, reprompt=None) -> Tuple[str, List[Tuple[FilePatch, Optional[Hunk], str]]]:
+    """
+    Rebuild a patch that does not apply: place what can be placed, ask
+    `reprompt` (given the rejected hunks in .rej form and the current content
+    of their files) for a follow-up patch covering only the rest, and diff the
+    result against the repository so every hunk header is recomputed.
+    Returns the new patch and the hunks that still could not be placed.
+    """
+    tree = PatchedTree(repo_path)
+    rejects = tree.apply(files)
+    for attempt in range(REJECT_REPROMPTS if reprompt else 0):
+        if not rejects:
+            break
+        paths = list(dict.fromkeys(file_patch.path for file_patch, _, _ in rejects if file_patch.path))
+        print(f"[pj] Asking for a follow-up patch covering {len(rejects)} rejected hunk(s) (attempt {attempt + 1}/{REJECT_REPROMPTS})", file=sys.stderr)
+        try:
+            followup = reprompt(format_rejects(rejects), {path: tree.content(path) for path in paths if tree.content(path) is not None})
+        except Exception as e:
+            print(f"[pj] Warning: Follow-up request for rejected hunks failed: {e}", file=sys.stderr)
+            break
+        # Only files that still have rejects are taken from the follow-up
+        followup_files = [f for f in parse_patch(followup)[0] if f.path in paths]
+        covered = {f.path for f in followup_files}
+        rejects = [r for r in rejects if r[0].path not in covered] + tree.apply(followup_files)
+    return tree.diff(), rejects
+
+
+def write_patch(out_path: Path, patch: str, repo_path: Path, reprompt=None) -> str:
+    """
+    Write the patch, plus a marker holding its sha256 when it checks clean
+    against the repository, so execution.sh can skip `git apply --check`.
+    A patch that does not check clean is healed first (see heal_patch);
+    hunks that could still not be placed go to a .rej file next to it.
+    Returns the patch as written.
+    """
+    marker = Path(str(out_path) + PATCH_CHECKED_SUFFIX)
+    rejects_file = Path(str(out_path) + PATCH_REJECTS_SUFFIX)
+    marker.unlink(missing_ok=True)
+    rejects_file.unlink(missing_ok=True)
+    
+    started = time.monotonic()
+    files, errors = parse_patch(patch)
+    complete = False
+    if not errors:
+        errors, complete = check_patch(files, repo_path)
+    if errors:
+        print(f"[pj] Warning: Patch does not check clean against the repository:", file=sys.stderr)
+        for error in errors:
+            print(f"[pj]   - {error}", file=sys.stderr)
+        if any(file_patch.hunks for file_patch in files):
+            patch, rejects = heal_patch(files, repo_path, reprompt)
+            print(f"[pj] Rebuilt the patch from the hunks that could be placed ({len(rejects)} rejected)", file=sys.stderr)
+            # Whole files left out (renames, mode changes, binary patches) are for git to judge, and a
+            # rebuilt diff of non-UTF-8 content may not match the files; check it again as written
+            files, errors = parse_patch(patch)
+            if not errors:
+                errors, complete = check_patch(files, repo_path)
+            complete = complete and all(hunk is not None for _, hunk, _ in rejects)
+            if errors:
+                print(f"[pj] Warning: Rebuilt patch does not check clean either, leaving it to git apply", file=sys.stderr)
+            if rejects:
+                rejects_file.write_text(format_rejects(rejects))
+                for _, _, reason in rejects:
+                    print(f"[pj]   rejected: {reason}", file=sys.stderr)
+                print(f"[pj] Rejected hunks written to {rejects_file}", file=sys.stderr)
+    
+    with open(out_path, "w") as f:
+        f.write(patch)
+    if not errors and complete and patch.strip():
+        marker.write_text(hashlib.sha256(patch.encode("utf-8", "surrogateescape")).hexdigest() + "\n")
+        print(f"[pj] Patch checked against the repository in {time.monotonic() - started:.3f}s ({len(files)} file(s))", file=sys.stderr)
+    return patch
+
+
 def extract_diff_from_response(response: str) -> str:
     """Extract diff from LLM response, handling markdown code blocks"""
     # Remove markdown code blocks if present
@@ -594,20 +1773,650 @@ def extract_diff_from_response(response: str) -> str:
     return cleaned
 
 
-def generate_modified_file_content(
-    system_prompt: str,
-    task_description: str,
-    codebase_analysis: Dict[str, Any],
-    coderabbit_analysis: Optional[str],
-    relevant_files: List[Tuple[str, str]],
-    model: str = "gpt-4o",
-    provider: str = "openai",
-    api_key: Optional[str] = None,
-) -> Dict[str, str]:
+STREAM_RESPONSES = os.getenv("AGENT_STREAM", "true").lower() != "false"
+STREAM_STALL_TIMEOUT = int(os.getenv("AGENT_STREAM_STALL_TIMEOUT", "60"))  # Seconds without a token before giving up
+DEBUG_RESPONSES = os.getenv("AGENT_DEBUG", "false").lower() == "true"  # Log response sizes and the start of raw responses
+PARALLEL_FILE_GENERATION = os.getenv("AGENT_PARALLEL_FILES", "true").lower() != "false"
+MAX_PARALLEL_REQUESTS = int(os.getenv("AGENT_MAX_PARALLEL_REQUESTS", "4"))
+FORMAT_SNIFF_CHARS = 200  # A response that gets this far without a FILE: header is rejected
+
+# Lines that mean the model started echoing logs or errors instead of file content
+OUTPUT_ARTIFACTS = ('patch preview', 'error:', 'traceback', 'debug:', 'warning:')
+
+
+class FileFormatError(RuntimeError):
+    """Raised when an LLM response does not follow the FILE: <path> ... --- format"""
+    pass
+
+
+class FileBlockParser:
     """
-    Generate modified file content using two-step approach.
-    Returns a dict mapping file_path -> modified_content.
+    Incremental parser for the two-step response format:
+    
+        FILE: <path>
+        <complete file content>
+        ---
+    
+    Text can be fed in chunks as it streams in; `on_file(path, content)` is
+    called as soon as each file is complete. Format violations raise
+    FileFormatError at the point they are seen, so a stream can be aborted
+    before the rest of the token budget is spent.
+    """
+    
+    def __init__(self, on_file=None):
+        self.on_file = on_file
+        self.files: Dict[str, str] = {}
+        self.stopped = False
+        self._buffer = ""
+        self._seen_header = False
+        self._current_file: Optional[str] = None
+        self._current_content: List[str] = []
+        self._in_edit_block = False
+    
+    def feed(self, text: str) -> None:
+        if self.stopped:
+            return
+        self._buffer += text
+        *lines, self._buffer = self._buffer.split('\n')
+        for line in lines:
+            self._line(line)
+            if self.stopped:
+                return
+        if not self._seen_header:
+            pending = self._buffer.lstrip()
+            if len(pending) >= FORMAT_SNIFF_CHARS or (len(pending) >= 5 and not pending.startswith("FILE:")):
+                self._reject(pending)
+    
+    @property
+    def current_file(self) -> Optional[str]:
+        """The file whose block is open (not yet terminated)"""
+        return self._current_file
+    
+    def discard_current(self) -> None:
+        """Drop the open block and any unterminated line, e.g. of a truncated response"""
+        self._buffer = ""
+        self._current_file, self._current_content = None, []
+        self._in_edit_block = False
+    
+    def finish(self) -> Dict[str, str]:
+        """Flush the last (possibly unterminated) line and file; returns all files"""
+        if self._buffer and not self.stopped:
+            self._line(self._buffer)
+        self._buffer = ""
+        self._complete()
+        return self.files
+    
+    def _reject(self, text: str) -> None:
+        print(f"[pj] ERROR: LLM response does not start with 'FILE:' - this indicates wrong content type", file=sys.stderr)
+        print(f"[pj] Response starts with: {text[:200]}", file=sys.stderr)
+        print(f"[pj] This likely means the LLM returned shell commands, documentation, or instructions instead of file content", file=sys.stderr)
+        raise FileFormatError(
+            f"LLM response does not start with 'FILE:' format. "
+            f"Response preview: {text[:200]}. "
+            f"The LLM may have returned shell commands, documentation, or instructions instead of the modified file content. "
+            f"Expected format: 'FILE: <path>\\n<content>\\n---'"
+        )
+    
+    def _line(self, line: str) -> None:
+        if not self._seen_header:
+            if not line.strip():
+                return
+            if not line.startswith("FILE:"):
+                self._reject(line)
+            self._seen_header = True
+        
+        # Inside a SEARCH/REPLACE block everything is file content
+        if self._current_file and (self._in_edit_block or line.startswith('<<<<<<< SEARCH')):
+            self._in_edit_block = not line.startswith('>>>>>>> REPLACE')
+            self._current_content.append(line)
+            return
+        
+        # Stop parsing if we hit debug/error messages
+        if any(artifact in line.lower() for artifact in OUTPUT_ARTIFACTS):
+            print(f"[pj] WARNING: Stopping file parsing at line containing: {line[:50]}", file=sys.stderr)
+            self.stopped = True
+            return
+        
+        if line.startswith('FILE: '):
+            self._complete()
+            file_path = line[6:].strip()  # Remove 'FILE: ' prefix
+            if not file_path or file_path.startswith('/') or '..' in Path(file_path).parts:
+                raise FileFormatError(f"LLM response names an invalid file path: {file_path!r}")
+            self._current_file = file_path
+        elif line == '---' and self._current_file:
+            self._complete()
+        elif self._current_file:
+            self._current_content.append(line)
+    
+    def _complete(self) -> None:
+        file_path, lines = self._current_file, self._current_content
+        self._current_file, self._current_content = None, []
+        if not file_path or not lines:
+            return
+        file_content = '\n'.join(lines).rstrip() + '\n'
+        # Validate content is not empty and doesn't look corrupted
+        if not file_content.strip() or file_content.startswith('\\n'):
+            print(f"[pj] WARNING: Skipping corrupted file content for {file_path}", file=sys.stderr)
+            return
+        self.files[file_path] = file_content
+        if self.on_file:
+            self.on_file(file_path, file_content)
+
+
+EDIT_FORMAT = os.getenv("AGENT_EDIT_FORMAT", "edits").lower()  # "edits" (search/replace blocks) or "full" (complete files)
+EDIT_FUZZY_THRESHOLD = 0.9  # Minimum similarity for a SEARCH block that matches no lines exactly
+
+EDIT_BLOCK_RE = re.compile(
+    r"^<{7} SEARCH[ \t]*\n(.*?)^={7}[ \t]*\n(.*?)^>{7} REPLACE[ \t]*$",
+    re.MULTILINE | re.DOTALL,
+)
+NUMBERED_LINE_RE = re.compile(r"^\s*\d+\| ?")  # Line-number prefixes copied from the prompt
+
+
+class EditBlockError(ValueError):
+    """Raised when SEARCH/REPLACE edit blocks cannot be applied to a file"""
+    pass
+
+
+def _strip_line_numbers(text: str) -> str:
+    lines = text.split('\n')
+    if all(NUMBERED_LINE_RE.match(line) for line in lines if line.strip()):
+        return '\n'.join(NUMBERED_LINE_RE.sub('', line, count=1) for line in lines)
+    return text
+
+
+def _leading_whitespace(line: str) -> str:
+    return line[:len(line) - len(line.lstrip())]
+
+
+def _reindent(lines: List[str], old_indent: str, new_indent: str) -> List[str]:
+    """Move lines from one base indentation to another, for matches found ignoring indentation"""
+    result = []
+    for line in lines:
+        if line.strip() and line.startswith(old_indent):
+            line = new_indent + line[len(old_indent):]
+        result.append(line)
+    return result
+
+
+def _find_lines(content_lines: List[str], search_lines: List[str]) -> Optional[Tuple[int, str, str]]:
+    """
+    Locate search_lines in content_lines, first ignoring trailing whitespace,
+    then all surrounding whitespace, then by similarity. Returns the start
+    index and the base indentation of the search text and of the match.
+    """
+    n = len(search_lines)
+    windows = range(len(content_lines) - n + 1)
+    search_indent = next((_leading_whitespace(l) for l in search_lines if l.strip()), "")
+    
+    for normalize in (str.rstrip, str.strip):
+        wanted = [normalize(l) for l in search_lines]
+        for i in windows:
+            if [normalize(l) for l in content_lines[i:i + n]] == wanted:
+                match_indent = next((_leading_whitespace(l) for l in content_lines[i:i + n] if l.strip()), "")
+                return i, search_indent, match_indent
+    
+    wanted = '\n'.join(l.strip() for l in search_lines)
+    best, best_ratio = None, EDIT_FUZZY_THRESHOLD
+    for i in windows:
+        matcher = difflib.SequenceMatcher(None, wanted, '\n'.join(l.strip() for l in content_lines[i:i + n]), autojunk=False)
+        if matcher.real_quick_ratio() >= best_ratio and matcher.quick_ratio() >= best_ratio:
+            ratio = matcher.ratio()
+            if ratio >= best_ratio:
+                best, best_ratio = i, ratio
+    if best is None:
+        return None
+    match_indent = next((_leading_whitespace(l) for l in content_lines[best:best + n] if l.strip()), "")
+    return best, search_indent, match_indent
+
+
+def apply_edit_block(content: str, search: str, replace: str) -> str:
+    """Apply one SEARCH/REPLACE edit; raises EditBlockError if SEARCH is not found"""
+    search, replace = _strip_line_numbers(search), _strip_line_numbers(replace)
+    if not search.strip():
+        # Empty SEARCH creates the file, or appends to it
+        return content + ('' if not content or content.endswith('\n') else '\n') + replace
+    
+    position = content.find(search)
+    if position != -1:
+        return content[:position] + replace + content[position + len(search):]
+    
+    content_lines = content.split('\n')
+    search_lines = search.rstrip('\n').split('\n')
+    found = _find_lines(content_lines, search_lines)
+    if found is None:
+        raise EditBlockError(f"SEARCH text not found: {search_lines[0].strip()[:80]!r}")
+    start, search_indent, match_indent = found
+    replace_lines = _reindent(replace.rstrip('\n').split('\n'), search_indent, match_indent) if replace.strip() else []
+    return '\n'.join(content_lines[:start] + replace_lines + content_lines[start + len(search_lines):])
+
+
+def apply_edit_blocks(original: str, body: str) -> str:
+    """Apply every SEARCH/REPLACE block of a FILE: body, in order"""
+    blocks = EDIT_BLOCK_RE.findall(body + '\n')
+    if not blocks:
+        raise EditBlockError("no SEARCH/REPLACE blocks")
+    content = original
+    for search, replace in blocks:
+        content = apply_edit_block(content, search, replace)
+    return content
+
+
+LLM_CACHE_MODE = os.getenv("AGENT_LLM_CACHE", "on").lower()  # "on", "off", or "replay" (cache only, never call the provider)
+LLM_CACHE_PATH = Path(os.getenv("AGENT_LLM_CACHE_PATH", os.path.join(tempfile.gettempdir(), "pithy-jaunt", "llm-cache.sqlite3")))
+LLM_CACHE_MAX_BYTES = int(os.getenv("AGENT_LLM_CACHE_MAX_MB", "256")) * 1024 * 1024
+LLM_CACHE_VERSION = 1
+
+
+class LLMCacheMiss(RuntimeError):
+    """Raised in replay mode when a request has no cached response"""
+    pass
+
+
+def llm_cache_key(provider: str, model: str, max_tokens: int, system_prompt: str, messages: List[Dict[str, str]]) -> str:
+    """Content address of a request: provider, model, max_tokens and hashes of the prompts"""
+    system_hash = hashlib.sha256(system_prompt.encode()).hexdigest()
+    messages_hash = hashlib.sha256(json.dumps(messages, sort_keys=True).encode()).hexdigest()
+    return hashlib.sha256(f"{LLM_CACHE_VERSION}\0{provider}\0{model}\0{max_tokens}\0{system_hash}\0{messages_hash}".encode()).hexdigest()
+
+
+class LLMCache:
+    """
+    SQLite store of LLM responses by request content address, evicting the
+    least recently used entries once it grows past LLM_CACHE_MAX_BYTES.
+    Requests are sent at temperature 0, so a retry of the same task with
+    the same prompts can reuse the earlier response.
+    """
+    
+    def __init__(self, path: Path, max_bytes: int):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(path), isolation_level=None, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, text BLOB NOT NULL, finish_reason TEXT, size INTEGER NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+    
+    def get(self, key: str) -> Optional[Tuple[str, Optional[str]]]:
+        with self._lock:
+            row = self._db.execute("SELECT text, finish_reason FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            self._db.execute("UPDATE responses SET last_used = ? WHERE key = ?", (time.time(), key))
+        return zlib.decompress(row[0]).decode(), row[1]
+    
+    def put(self, key: str, text: str, finish_reason: Optional[str]) -> None:
+        blob = zlib.compress(text.encode())
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses (key, text, finish_reason, size, last_used) VALUES (?, ?, ?, ?, ?)",
+                (key, blob, finish_reason, len(blob), time.time())
+            )
+            self._evict()
+    
+    def _evict(self) -> None:
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        evicted = []
+        for key, size in self._db.execute("SELECT key, size FROM responses ORDER BY last_used"):
+            if total <= self.max_bytes:
+                break
+            evicted.append((key,))
+            total -= size
+        with self._db:
+            self._db.executemany("DELETE FROM responses WHERE key = ?", evicted)
+        print(f"[pj] LLM cache: evicted {len(evicted)} least recently used responses", file=sys.stderr)
+    
+    def close(self) -> None:
+        self._db.close()
+
+
+_llm_cache: Optional[LLMCache] = None
+_llm_cache_lock = threading.Lock()
+
+
+def get_llm_cache() -> Optional[LLMCache]:
+    """The process-wide response cache, or None when AGENT_LLM_CACHE=off or it cannot be opened"""
+    global _llm_cache
+    if LLM_CACHE_MODE == "off":
+        return None
+    with _llm_cache_lock:
+        if _llm_cache is None:
+            try:
+                _llm_cache = LLMCache(LLM_CACHE_PATH, LLM_CACHE_MAX_BYTES)
+            except sqlite3.Error as e:
+                if LLM_CACHE_MODE == "replay":
+                    raise
+                print(f"[pj] Warning: LLM cache unavailable ({e}), calling the provider directly", file=sys.stderr)
+                return None
+    return _llm_cache
+
+
+MAX_CONTINUATIONS = int(os.getenv("AGENT_MAX_CONTINUATIONS", "3"))  # Follow-up requests for a response cut off by max_tokens
+TRUNCATED_FINISH_REASONS = ("length", "max_tokens")
+STITCH_DECISION_CHARS = 256  # Continuation text buffered before deciding how it joins the partial response
+MIN_STITCH_OVERLAP = 16  # Shortest repeated text treated as overlap rather than coincidence
+
+CONTINUATION_PROMPT = (
+    "Your previous response was cut off by the output limit. Continue it EXACTLY where it stopped, "
+    "starting with the next character. Do not repeat anything already written and do not add any preamble. "
+    "If you cannot continue mid-file, restart the unfinished FILE: block from its FILE: line."
+)
+
+
+PROMPT_CACHING = os.getenv("AGENT_PROMPT_CACHING", "true").lower() != "false"
+
+
+def supports_cache_control(provider: str, model: str) -> bool:
+    """Whether requests can mark cacheable prefixes (Anthropic models, directly or through OpenRouter)"""
+    if not PROMPT_CACHING:
+        return False
+    return provider == "anthropic" or (provider == "openrouter" and ("claude" in model.lower() or model.lower().startswith("anthropic/")))
+
+
+def _cacheable(text: str) -> Dict[str, Any]:
+    return {"type": "text", "text": text, "cache_control": {"type": "ephemeral"}}
+
+
+def anthropic_system(system_prompt: str, model: str):
+    """System prompt for messages.create, marked as a cacheable prefix"""
+    return [_cacheable(system_prompt)] if supports_cache_control("anthropic", model) else system_prompt
+
+
+def _llm_messages(provider: str, model: str, system_prompt: str, user_prompt: str, partial: str = "", prompt_prefix: str = "") -> List[Dict[str, Any]]:
+    """
+    Chat messages for a request, or for the continuation of a truncated
+    response. Anthropic continues a prefilled assistant turn directly; the
+    OpenAI API does not, so there the partial output is followed by an
+    instruction to continue.
+    
+    `prompt_prefix` is the part of the user prompt shared by every request
+    of a run (repository summary and context files). It comes first, so
+    providers with automatic prefix caching (OpenAI) reuse it, and it is
+    marked with cache_control where supported.
+    """
+    if supports_cache_control(provider, model) and prompt_prefix:
+        user_content = [_cacheable(prompt_prefix), {"type": "text", "text": user_prompt}]
+    else:
+        user_content = prompt_prefix + user_prompt
+    messages = [{"role": "user", "content": user_content}]
+    if provider in ("openai", "openrouter"):
+        system_content = [_cacheable(system_prompt)] if supports_cache_control(provider, model) else system_prompt
+        messages.insert(0, {"role": "system", "content": system_content})
+    if partial:
+        if provider == "anthropic":
+            # The API rejects a final assistant turn ending in whitespace
+            messages.append({"role": "assistant", "content": partial.rstrip()})
+        else:
+            messages.append({"role": "assistant", "content": partial})
+            messages.append({"role": "user", "content": CONTINUATION_PROMPT})
+    return messages
+
+
+def log_token_usage(usage) -> None:
+    """Log token usage of an OpenAI- or Anthropic-style response, including prompt cache hits"""
+    if not usage:
+        return
+    if hasattr(usage, 'input_tokens'):
+        # Anthropic: input_tokens excludes the tokens read from or written to the cache
+        cache_read = getattr(usage, 'cache_read_input_tokens', None) or 0
+        cache_write = getattr(usage, 'cache_creation_input_tokens', None) or 0
+        print(f"[pj] Token usage: {usage.input_tokens} input ({cache_read} cached, {cache_write} written to cache), {usage.output_tokens} output", file=sys.stderr)
+    else:
+        details = getattr(usage, 'prompt_tokens_details', None)
+        cached = (getattr(details, 'cached_tokens', None) or 0) if details else 0
+        print(f"[pj] Token usage: {usage.total_tokens} (prompt: {usage.prompt_tokens}, {cached} cached, completion: {usage.completion_tokens})", file=sys.stderr)
+
+
+class _ContinuationStitcher:
+    """
+    Joins a continuation onto a truncated response, at the FILE: block level,
+    before passing it to the parser. The continuation either picks up the
+    unfinished block (any text repeated from the end of the partial output
+    is dropped), or restarts it from its FILE: line, in which case the
+    partial block is discarded. A truncated block followed by a different
+    file is discarded too, since it can no longer be completed.
+    """
+    
+    def __init__(self, parser: FileBlockParser, partial: str):
+        self.parser = parser
+        self.text = partial
+        self._pending = ""
+        self._decided = False
+    
+    @property
+    def stopped(self) -> bool:
+        return self.parser.stopped
+    
+    def feed(self, text: str) -> None:
+        if self._decided:
+            self.text += text
+            self.parser.feed(text)
+            return
+        self._pending += text
+        if len(self._pending) >= STITCH_DECISION_CHARS:
+            self.flush()
+    
+    def flush(self) -> None:
+        if self._decided:
+            return
+        self._decided = True
+        partial, continuation = self.text, self._pending
+        current_file = self.parser.current_file
+        head = continuation.lstrip()
+        
+        if head.startswith("FILE: "):
+            restarted = head.split('\n', 1)[0][6:].strip()
+            if current_file:
+                if restarted == current_file:
+                    print(f"[pj] Continuation restarts {current_file}, discarding its partial content", file=sys.stderr)
+                else:
+                    print(f"[pj] WARNING: Dropping truncated {current_file}; continuation moved on to {restarted}", file=sys.stderr)
+                self.parser.discard_current()
+                block_start = partial.rfind(f"FILE: {current_file}")
+                partial = partial[:block_start] if block_start != -1 else partial
+            elif partial and not partial.endswith('\n'):
+                partial += '\n'
+                self.parser.feed('\n')
+            continuation = head
+        else:
+            trailing = partial[len(partial.rstrip()):]
+            if trailing and continuation.startswith(trailing):
+                # Whitespace the prefilled turn could not end with, already parsed
+                continuation = continuation[len(trailing):]
+            else:
+                for size in range(min(len(partial), len(continuation)), MIN_STITCH_OVERLAP - 1, -1):
+                    if partial.endswith(continuation[:size]):
+                        print(f"[pj] Continuation repeats {size} chars of the partial response, dropping them", file=sys.stderr)
+                        continuation = continuation[size:]
+                        break
+        
+        self.text = partial
+        self.feed(continuation)
+
+
+def _stream_openai(client, provider: str, model: str, messages: List[Dict[str, str]], max_tokens: int, parser: FileBlockParser, deadline: Deadline) -> Tuple[str, Optional[str]]:
+    """Stream a chat completion into the parser; returns the text and finish reason"""
+    extra = {"stream_options": {"include_usage": True}} if provider == "openai" else {}
+    stream = client.chat.completions.create(
+        model=model,
+        messages=messages,
+        temperature=0.0,
+        max_tokens=max_tokens,  # Model-specific limit
+        stream=True,
+        **extra,
+    )
+    parts = []
+    finish_reason = None
+    usage = None
+    try:
+        for chunk in stream:
+            deadline.check()
+            usage = getattr(chunk, 'usage', None) or usage
+            if not chunk.choices:
+                continue
+            choice = chunk.choices[0]
+            text = getattr(choice.delta, 'content', None)
+            if text:
+                parts.append(text)
+                parser.feed(text)
+                if parser.stopped:
+                    print(f"[pj] Aborting response stream after {len(''.join(parts))} chars", file=sys.stderr)
+                    break
+            finish_reason = choice.finish_reason or finish_reason
+    finally:
+        stream.close()
+    
+    log_token_usage(usage)
+    return ''.join(parts), finish_reason
+
+
+def _stream_anthropic(client, model: str, system_prompt: str, messages: List[Dict[str, str]], max_tokens: int, parser: FileBlockParser, deadline: Deadline) -> Tuple[str, Optional[str]]:
+    """Stream a message into the parser; returns the text and stop reason"""
+    parts = []
+    finish_reason = None
+    with client.messages.stream(
+        model=model,
+        max_tokens=max_tokens,  # Model-specific limit
+        temperature=0.0,
+        system=anthropic_system(system_prompt, model),
+        messages=messages,
+    ) as stream:
+        for text in stream.text_stream:
+            deadline.check()
+            parts.append(text)
+            parser.feed(text)
+            if parser.stopped:
+                print(f"[pj] Aborting response stream after {len(''.join(parts))} chars", file=sys.stderr)
+                break
+        else:
+            message = stream.get_final_message()
+            finish_reason = getattr(message, 'stop_reason', None)
+            usage = getattr(message, 'usage', None)
+            log_token_usage(usage)
+    return ''.join(parts), finish_reason
+
+
+# Closing instructions of the two-step (complete file) prompt
+FILE_GENERATION_INSTRUCTIONS = """
+
+Generate the COMPLETE modified file content that implements the task.
+
+**CRITICAL INSTRUCTIONS:**
+1. **Output the COMPLETE file content** - not a diff, not a patch, but the full modified file
+2. **For each file shown above**, output the complete modified version
+3. **Preserve all existing content** that should not change - copy it exactly
+4. **Make only the necessary changes** to implement the task
+5. **Maintain exact formatting** - preserve whitespace, indentation, line endings
+6. **If a file is shown above, it EXISTS** - you are modifying it, not creating it
+7. **Check if content already exists** - if it does, modify existing content instead of adding duplicates
+
+**Output Format:**
+For each file to modify, output:
+```
+FILE: <file_path>
+<complete file content here>
+---
+```
+
+Example:
+```
+FILE: README.md
+# Project Name
+
+## Description
+...
+
+## New Section Added Here
+...
+---
+```
+
+Output ONLY the file content(s), with no explanations, no markdown formatting around the content itself.
+
+**CRITICAL REMINDER:**
+- You are modifying an EXISTING file - output the COMPLETE file from line 1 to the end
+- DO NOT output just a snippet or excerpt from the file
+- DO NOT output shell commands or instructions
+- You MUST include ALL existing content, then add the new section
+- The file shown above is the COMPLETE file - you need to output it ALL with your changes added"""
+
+
+# Closing instructions of the edit-block prompt (AGENT_EDIT_FORMAT=edits)
+EDIT_GENERATION_INSTRUCTIONS = """
+
+Generate ONLY the changes that implement the task, as SEARCH/REPLACE edit blocks.
+
+**CRITICAL INSTRUCTIONS:**
+1. **Do NOT output complete files** - output only the edits
+2. **SEARCH must copy existing lines exactly** - same characters, whitespace and indentation, WITHOUT the line-number prefixes shown above
+3. **Include enough lines in SEARCH to be unique** - usually 2-5 lines around the change
+4. **REPLACE holds the new version of exactly those lines** - to delete lines, leave REPLACE empty
+5. **Use several small blocks rather than one large one** - blocks are applied top to bottom
+6. **To create a new file**, use an empty SEARCH section and put the whole file in REPLACE
+7. **Check if content already exists** - if it does, edit it instead of adding duplicates
+
+**Output Format:**
+```
+FILE: <file_path>
+<<<<<<< SEARCH
+<existing lines>
+=======
+<replacement lines>
+>>>>>>> REPLACE
+---
+```
+
+Example:
+```
+FILE: README.md
+<<<<<<< SEARCH
+## Description
+Old description.
+=======
+## Description
+New description.
+
+## New Section Added Here
+...
+>>>>>>> REPLACE
+---
+```
+
+Output ONLY the FILE blocks, with no explanations and no markdown formatting around them."""
+
+
+_llm_clients: Dict[Tuple[str, str], Any] = {}
+_llm_clients_lock = threading.Lock()
+
+
+def shared_client(key: Tuple[str, str], factory):
     """
+    The process's client for a provider and API key, created by `factory`
+    on first use. Later requests (and, in the daemon, later tasks) reuse
+    its connection pool instead of opening new TLS connections; the SDK
+    clients are thread-safe.
+    """
+    with _llm_clients_lock:
+        client = _llm_clients.get(key)
+        if client is None:
+            client = _llm_clients[key] = factory()
+    return client
+
+
+def create_llm_client(provider: str, api_key: Optional[str] = None):
+    """
+    Create the API client for a provider, reading its key from the
+    environment if not given. In cache replay mode no client is needed.
+    """
+    if LLM_CACHE_MODE == "replay":
+        print(f"[pj] LLM cache replay mode: responses come from {LLM_CACHE_PATH} only", file=sys.stderr)
+        return None
+    load_provider_sdk("anthropic" if provider == "anthropic" else "openai")
     if provider == "openai":
         if openai is None:
             raise ImportError("openai package is not installed. Install with: pip install openai")
@@ -615,7 +2424,7 @@ def generate_modified_file_content(
             api_key = os.getenv("OPENAI_API_KEY")
             if not api_key:
                 raise ValueError("OPENAI_API_KEY environment variable is required")
-        client = openai.OpenAI(api_key=api_key)
+        client = shared_client(("openai", api_key), lambda: openai.OpenAI(api_key=api_key))
     elif provider == "anthropic":
         if anthropic is None:
             raise ImportError("anthropic package is not installed. Install with: pip install anthropic")
@@ -623,7 +2432,7 @@ def generate_modified_file_content(
             api_key = os.getenv("ANTHROPIC_API_KEY")
             if not api_key:
                 raise ValueError("ANTHROPIC_API_KEY environment variable is required")
-        client = anthropic.Anthropic(api_key=api_key)
+        client = shared_client(("anthropic", api_key), lambda: anthropic.Anthropic(api_key=api_key))
     elif provider == "openrouter":
         # OpenRouter uses OpenAI-compatible API
         if openai is None:
@@ -633,468 +2442,1103 @@ def generate_modified_file_content(
             if not api_key:
                 raise ValueError("OPENROUTER_API_KEY environment variable is required")
         # OpenRouter uses OpenAI client with base_url and default_headers
-        client = openai.OpenAI(
+        client = shared_client(("openrouter", api_key), lambda: openai.OpenAI(
             base_url="https://openrouter.ai/api/v1",
             api_key=api_key,
             default_headers={
                 "HTTP-Referer": os.getenv("OPENROUTER_HTTP_REFERER", "https://github.com/jakebutler/pithy-jaunt"),
                 "X-Title": "Pithy Jaunt",
             },
-        )
+        ))
     else:
         raise ValueError(f"Unknown provider: {provider}")
+    return client
+
+
+def build_context_prefix(
+    repo_header: str,
+    context_files: List[Tuple[str, str]],
+    budget: int,
+    model: str,
+) -> Tuple[str, int]:
+    """
+    The stable start of every two-step prompt in a run: the repository
+    summary and the context files, in full while they fit in `budget`
+    tokens, then as outlines. Returns the prefix and the tokens it uses.
+    """
+    prefix = repo_header
+    used = 0
+    # Show other relevant files for context only
+    if context_files:
+        blocks, used = pack_files(context_files, budget, model, numbered=False, note=" - CONTEXT ONLY")
+        if blocks:
+            prefix += f"\n\nContext Files (for reference only - DO NOT modify these):\n"
+            prefix += "".join(blocks)
+    return prefix, used
+
+
+def build_file_generation_prompt(
+    task_header: str,
+    target_files: List[Tuple[str, str]],
+    coderabbit_analysis: Optional[str],
+    budget: int,
+    model: str,
+    closing_note: str = "",
+    instructions: str = FILE_GENERATION_INSTRUCTIONS,
+) -> str:
+    """
+    The task-specific part of a two-step prompt, after the context prefix:
+    the task and the files to modify, in full unless one alone exceeds
+    `budget` tokens.
+    """
+    user_prompt = task_header
+    if target_files:
+        user_prompt += f"\n\nFiles to MODIFY (explicitly mentioned in task - generate modified content for these):\n"
+        blocks, _ = pack_files(target_files, budget, model, required=True)
+        user_prompt += "".join(blocks)
+    
+    if coderabbit_analysis:
+        user_prompt += f"\n\nCodeRabbit Analysis:\n{coderabbit_analysis}\n"
+    
+    return user_prompt + instructions + closing_note
+
+
+def request_modified_files(
+    client,
+    system_prompt: str,
+    user_prompt: str,
+    model: str,
+    provider: str,
+    on_file=None,
+    prompt_prefix: str = "",
+    deadline: Optional[Deadline] = None,
+) -> Dict[str, str]:
+    """
+    Send a two-step prompt and parse the FILE: blocks of the response.
+    Returns a dict mapping file_path -> modified_content.
+    
+    With streaming on (AGENT_STREAM), the response is parsed as it arrives:
+    `on_file(path, content)` is called for each file as soon as it is
+    complete, and a response that breaks the format is aborted early.
+    
+    The request ends by `deadline` (by default, the task budget) and stops
+    at its next chunk when the deadline is cancelled.
+    """
+    parser = FileBlockParser(on_file=on_file)
+    deadline = deadline or call_deadline(None, f"{provider} API call")
+    # Streaming responses only time out when no token arrives for a while
+    read_timeout = float(STREAM_STALL_TIMEOUT) if STREAM_RESPONSES else LLM_CALL_TIMEOUT
+    try:
+        finish_reason = None
+        max_tokens = get_max_tokens_for_model(provider, model)
+        print(f"[pj] Using max_tokens={max_tokens} for model {model} (provider: {provider}, streaming: {STREAM_RESPONSES})", file=sys.stderr)
+        
+        # A response cut off by max_tokens is continued from where it
+        # stopped, so only the missing tokens are generated again
+        content = ""
+        for continuation in range(MAX_CONTINUATIONS + 1):
+            deadline.check()
+            if continuation:
+                print(f"[pj] Response truncated at {len(content)} chars, requesting continuation {continuation}/{MAX_CONTINUATIONS}", file=sys.stderr)
+            sink = _ContinuationStitcher(parser, content) if content else parser
+            messages = _llm_messages(provider, model, system_prompt, user_prompt, content, prompt_prefix)
+            llm_cache = get_llm_cache()
+            cache_key = llm_cache_key(provider, model, max_tokens, system_prompt, messages)
+            cached = llm_cache.get(cache_key) if llm_cache else None
+            
+            if cached is not None:
+                text, finish_reason = cached
+                print(f"[pj] LLM cache hit: {len(text)} chars, finish reason: {finish_reason}", file=sys.stderr)
+            elif LLM_CACHE_MODE == "replay":
+                raise LLMCacheMiss(f"No cached response for request {cache_key[:12]} (replay mode)")
+            elif STREAM_RESPONSES:
+                call_client = _client_for(client, deadline, read_timeout)
+                if provider == "openai" or provider == "openrouter":
+                    text, finish_reason = _stream_openai(call_client, provider, model, messages, max_tokens, sink, deadline)
+                else:  # anthropic
+                    text, finish_reason = _stream_anthropic(call_client, model, system_prompt, messages, max_tokens, sink, deadline)
+                if DEBUG_RESPONSES:
+                    print(f"[pj] DEBUG: Streamed LLM response length: {len(text)} chars, finish reason: {finish_reason}", file=sys.stderr)
+            elif provider == "openai" or provider == "openrouter":
+                # Both OpenAI and OpenRouter use OpenAI-compatible API
+                response = _client_for(client, deadline, read_timeout).chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    temperature=0.0,
+                    max_tokens=max_tokens,  # Model-specific limit
+                )
+                # Safely extract content and metadata
+                if not response.choices or len(response.choices) == 0:
+                    raise RuntimeError("No choices in API response")
+                
+                choice = response.choices[0]
+                if not hasattr(choice, 'message') or not choice.message:
+                    raise RuntimeError("No message in API response choice")
+                
+                if not hasattr(choice.message, 'content') or not choice.message.content:
+                    raise RuntimeError("No content in API response message")
+                
+                text = choice.message.content
+                finish_reason = getattr(choice, 'finish_reason', None)  # finish_reason is on the choice, not the message
+                usage = getattr(response, 'usage', None)
+                
+                # Debug: Log BEFORE any processing
+                if DEBUG_RESPONSES:
+                    print(f"[pj] DEBUG: Raw LLM response length: {len(text)} chars", file=sys.stderr)
+                    print(f"[pj] DEBUG: Raw LLM response (first 1000 chars): {text[:1000]}", file=sys.stderr)
+                    print(f"[pj] DEBUG: System prompt length: {len(system_prompt)} chars", file=sys.stderr)
+                    print(f"[pj] DEBUG: User prompt length: {len(user_prompt)} chars", file=sys.stderr)
+                    print(f"[pj] DEBUG: Finish reason: {finish_reason}", file=sys.stderr)
+                
+                log_token_usage(usage)
+            else:  # anthropic
+                message = _client_for(client, deadline, read_timeout).messages.create(
+                    model=model,
+                    max_tokens=max_tokens,  # Model-specific limit
+                    temperature=0.0,
+                    system=anthropic_system(system_prompt, model),
+                    messages=messages,
+                )
+                # Safely extract content from Anthropic response
+                if not hasattr(message, 'content') or not message.content or len(message.content) == 0:
+                    raise RuntimeError("No content in Anthropic API response")
+                
+                if not hasattr(message.content[0], 'text') or not message.content[0].text:
+                    raise RuntimeError("No text in Anthropic API response content")
+                
+                text = message.content[0].text
+                finish_reason = getattr(message, 'stop_reason', None)
+                usage = getattr(message, 'usage', None)
+                
+                log_token_usage(usage)
+            
+            if cached is None and llm_cache and not sink.stopped:
+                llm_cache.put(cache_key, text, finish_reason)
+            if cached is not None or not STREAM_RESPONSES:
+                sink.feed(text if content else text.lstrip())
+            if sink is parser:
+                content += text
+            else:
+                sink.flush()
+                content = sink.text
+            
+            if finish_reason not in TRUNCATED_FINISH_REASONS or parser.stopped:
+                break
+        else:
+            print(f"[pj] WARNING: LLM response still truncated after {MAX_CONTINUATIONS} continuations (finish_reason: {finish_reason}). Content may be incomplete.", file=sys.stderr)
+        
+        content = content.strip()
+        # Parse the response to extract file contents
+        modified_files = parser.finish()
+        
+        # Validate we got at least one file
+        if not modified_files:
+            print(f"[pj] ERROR: No valid file content extracted from LLM response", file=sys.stderr)
+            print(f"[pj] Response preview (first 1000 chars): {content[:1000]}", file=sys.stderr)
+            print(f"[pj] Response length: {len(content)} characters", file=sys.stderr)
+            
+            # Check if response looks like documentation/instructions instead of file content
+            if any(indicator in content[:200].lower() for indicator in [
+                '##', '###', '**', '* ', '- ', '1.', '2.', 
+                'use ', 'to create', 'to edit', 'instructions',
+                'guide', 'tutorial', 'documentation'
+            ]) and 'FILE:' not in content:
+                error_msg = (
+                    "LLM returned documentation/instructions instead of file content format. "
+                    "Expected format: 'FILE: <path>\\n<content>\\n---'. "
+                    "The LLM may have misunderstood the task or the system prompt was not used correctly."
+                )
+                print(f"[pj] {error_msg}", file=sys.stderr)
+                raise FileFormatError(error_msg)
+            
+            raise FileFormatError("Failed to extract file content from LLM response. Response may be truncated or malformed. Expected format: 'FILE: <path>\\n<content>\\n---'")
+        
+        # Validate file contents don't contain obvious corruption
+        for file_path, file_content in modified_files.items():
+            # Check for literal \n sequences (should be actual newlines)
+            if '\\n' in file_content and file_content.count('\\n') > file_content.count('\n'):
+                print(f"[pj] WARNING: File {file_path} contains literal \\n sequences - may be corrupted", file=sys.stderr)
+            # Check for incomplete content (ends mid-sentence or has placeholder text)
+            if file_content.strip().endswith(('...', '...\n', 'TODO', 'FIXME')):
+                print(f"[pj] WARNING: File {file_path} may be incomplete (ends with placeholder)", file=sys.stderr)
+        
+        return modified_files
+        
+    except (TimeoutError, OperationCancelled, FileFormatError):
+        # An unusable response is not a provider error; the edit-block path falls back on it
+        raise
+    except Exception as e:
+        if _is_timeout(e):
+            raise TimeoutError(f"{provider} API call timed out after {read_timeout:g} seconds without a response")
+        raise RuntimeError(f"{provider} API error: {str(e)}")
+
+
+def generate_files_in_parallel(target_files: List[Tuple[str, str]], generate) -> Dict[str, str]:
+    """
+    Generate each target file in its own request, at most
+    MAX_PARALLEL_REQUESTS at a time. `generate(targets, closing_note,
+    deadline)` sends one request for the given files; every request carries
+    the shared task and context plus that one file, so each completion only
+    has to hold one file and the run takes about as long as the slowest file.
+    The requests share one deadline within the task budget: the first
+    failure cancels the others, since the run fails anyway.
+    """
+    group = call_deadline(None, "Parallel file generation")
+    
+    def generate_one(target: Tuple[str, str]):
+        file_path = target[0]
+        closing_note = f"\n\nThis request covers ONLY {file_path}. Output exactly one FILE block, for {file_path}. Other files are handled separately."
+        return lambda: generate([target], closing_note, group)
+    
+    print(f"[pj] Generating {len(target_files)} files in parallel (up to {MAX_PARALLEL_REQUESTS} requests at a time)", file=sys.stderr)
+    results = run_concurrently([generate_one(target) for target in target_files], MAX_PARALLEL_REQUESTS, group)
+    
+    modified_files = {}
+    errors = []
+    timed_out = False
+    for (file_path, _), files in zip(target_files, results):
+        if isinstance(files, OperationCancelled):
+            continue  # Stopped because of another file's error, reported below
+        if isinstance(files, Exception):
+            timed_out = timed_out or _is_timeout(files)
+            errors.append(f"{file_path}: {files}")
+            continue
+        if file_path not in files:
+            print(f"[pj] WARNING: Response for {file_path} did not include it (got: {', '.join(files)})", file=sys.stderr)
+        for other_path, content in files.items():
+            # A file's own request wins over another request touching it in passing
+            if other_path == file_path or other_path not in modified_files:
+                modified_files[other_path] = content
+    
+    if errors:
+        message = f"Generation failed for {len(errors)} of {len(target_files)} files: " + "; ".join(errors)
+        raise TimeoutError(message) if timed_out else RuntimeError(message)
+    return modified_files
+
+
+def request_file_edits(
+    client,
+    system_prompt: str,
+    user_prompt: str,
+    original_files: Dict[str, str],
+    model: str,
+    provider: str,
+    on_file=None,
+    prompt_prefix: str = "",
+    deadline: Optional[Deadline] = None,
+) -> Tuple[Dict[str, str], List[str]]:
+    """
+    Send an edit-block prompt and apply the returned SEARCH/REPLACE blocks to
+    the original files as each FILE: block completes. Returns the modified
+    files and the paths whose edits could not be applied.
+    """
+    modified_files = {}
+    failed = []
+    
+    def apply(file_path: str, body: str) -> None:
+        original = original_files.get(file_path, "")
+        if "... (truncated at " in original:
+            print(f"[pj] WARNING: {file_path} was truncated in the prompt, edits cannot be applied to it", file=sys.stderr)
+            failed.append(file_path)
+            return
+        try:
+            content = apply_edit_blocks(original, body)
+        except EditBlockError as e:
+            print(f"[pj] WARNING: Could not apply edits to {file_path}: {e}", file=sys.stderr)
+            failed.append(file_path)
+            return
+        if not content.endswith('\n'):
+            content += '\n'
+        modified_files[file_path] = content
+        if on_file:
+            on_file(file_path, content)
+    
+    request_modified_files(client, system_prompt, user_prompt, model, provider, on_file=apply, prompt_prefix=prompt_prefix, deadline=deadline)
+    return modified_files, failed
+
+
+def generate_modified_file_content(
+    system_prompt: str,
+    task_description: str,
+    codebase_analysis: Dict[str, Any],
+    coderabbit_analysis: Optional[str],
+    relevant_files: List[Tuple[str, str]],
+    model: str = "gpt-4o",
+    provider: str = "openai",
+    api_key: Optional[str] = None,
+    on_file=None,
+    edit_system_prompt: Optional[str] = None,
+) -> Dict[str, str]:
+    """
+    Generate modified file content using two-step approach.
+    Returns a dict mapping file_path -> modified_content.
+    
+    When the task names several files and AGENT_PARALLEL_FILES is on, each
+    file is generated by its own concurrent request. `on_file(path, content)`
+    is called as each file completes (see request_modified_files).
+    
+    When an edit-block system prompt is given and AGENT_EDIT_FORMAT is
+    "edits", the model only returns SEARCH/REPLACE blocks, which are applied
+    locally; files whose edits do not apply are regenerated in full.
+    """
+    client = create_llm_client(provider, api_key)
+    use_edits = edit_system_prompt is not None and EDIT_FORMAT == "edits"
+    
+    # Build user prompt - ask for the modified file content. The repository
+    # summary and context files come first and are the same for every request
+    # of this run, so providers can cache them as a prompt prefix.
+    repo_header = f"""Codebase Analysis:
+- Languages: {', '.join(codebase_analysis.get('languages', []))}
+- Framework: {codebase_analysis.get('framework', 'Unknown')}
+- Package Manager: {codebase_analysis.get('package_manager', 'Unknown')}
+- Top-level structure: {', '.join(codebase_analysis.get('file_structure', [])[:20])}
+"""
+    task_header = f"""
+
+Task Description:
+{task_description}
+"""
+    
+    # Plan the files to touch: the ones explicitly mentioned in the task
+    explicit_files, context_files = split_target_files(task_description, relevant_files)
+    original_files = dict(relevant_files)
+    parallel = PARALLEL_FILE_GENERATION and len(explicit_files) > 1
+    
+    # Fit everything in the context window: the files to modify (all of them,
+    # or the largest one when each gets its own request) before context files
+    instructions = max(FILE_GENERATION_INSTRUCTIONS, EDIT_GENERATION_INSTRUCTIONS, key=len)
+    budget = input_token_budget(provider, model, system_prompt, repo_header, task_header, coderabbit_analysis or "", instructions)
+    target_tokens = [count_tokens(_numbered(content.split('\n')), model) for _, content in explicit_files]
+    reserved = (max(target_tokens) if parallel else sum(target_tokens)) if target_tokens else 0
+    prompt_prefix, context_used = build_context_prefix(repo_header, context_files, budget - reserved, model)
+    target_budget = budget - context_used
+    
+    def generate_full(targets: List[Tuple[str, str]], closing_note: str = "", deadline: Optional[Deadline] = None) -> Dict[str, str]:
+        user_prompt = build_file_generation_prompt(task_header, targets, coderabbit_analysis, target_budget, model, closing_note)
+        return request_modified_files(client, system_prompt, user_prompt, model, provider, on_file, prompt_prefix, deadline)
+    
+    def generate(targets: List[Tuple[str, str]], closing_note: str = "", deadline: Optional[Deadline] = None) -> Dict[str, str]:
+        if not use_edits:
+            return generate_full(targets, closing_note, deadline)
+        user_prompt = build_file_generation_prompt(
+            task_header, targets, coderabbit_analysis, target_budget, model, closing_note,
+            instructions=EDIT_GENERATION_INSTRUCTIONS,
+        )
+        try:
+            modified_files, failed = request_file_edits(client, edit_system_prompt, user_prompt, original_files, model, provider, on_file, prompt_prefix, deadline)
+        except FileFormatError as e:
+            # Provider errors (rate limits, auth, replay cache misses) propagate instead of being retried as a larger request
+            print(f"[pj] WARNING: Edit-block response unusable ({e}), falling back to complete files", file=sys.stderr)
+            return generate_full(targets, closing_note, deadline)
+        
+        retry = [(path, original_files[path]) for path in failed if path in original_files]
+        if retry:
+            print(f"[pj] Regenerating {len(retry)} file(s) in full: {', '.join(path for path, _ in retry)}", file=sys.stderr)
+            modified_files.update(generate_full(retry, deadline=deadline))
+        return modified_files
+    
+    if parallel:
+        return generate_files_in_parallel(explicit_files, generate)
+    return generate(explicit_files)
+
+
+# In-process unified diff, following git's xdiff (Myers with its cost
+# heuristics, change compaction with the indent heuristic, hunk merging and
+# default function-name hunk headers), so patches match `git diff` output
+DIFF_CONTEXT_LINES = 3
+DIFF_ABBREV = 7  # Abbreviated blob ids on index lines, as git uses for small repositories
+DIFF_WORKERS = 4  # Files diffed concurrently when a response did not stream
+
+XDL_MAX_COST_MIN = 256
+XDL_HEUR_MIN_COST = 256
+XDL_SNAKE_CNT = 20
+XDL_K_HEUR = 4
+XDL_MAX_EQLIMIT = 1024
+XDL_SIMSCAN_WINDOW = 100
+XDL_KPDIS_RUN = 4
+XDL_LINE_MAX = sys.maxsize
+
+# Indent heuristic weights (xdiff's split scoring)
+MAX_INDENT = 200
+MAX_BLANKS = 20
+START_OF_FILE_PENALTY = 1
+END_OF_FILE_PENALTY = 21
+TOTAL_BLANK_WEIGHT = -30
+POST_BLANK_WEIGHT = 6
+RELATIVE_INDENT_PENALTY = -4
+RELATIVE_INDENT_WITH_BLANK_PENALTY = 10
+RELATIVE_OUTDENT_PENALTY = 24
+RELATIVE_OUTDENT_WITH_BLANK_PENALTY = 17
+RELATIVE_DEDENT_PENALTY = 23
+RELATIVE_DEDENT_WITH_BLANK_PENALTY = 17
+INDENT_WEIGHT = 60
+INDENT_HEURISTIC_MAX_SLIDING = 100
+
+NO_NEWLINE_MARKER = b"\n\\ No newline at end of file\n"
+_SPACE_BYTES = b" \t\n\v\f\r"
+
+
+def _bogosqrt(n: int) -> int:
+    i = 1
+    while n > 0:
+        n >>= 2
+        i <<= 1
+    return i
+
+
+class _XdFile:
+    """One side of a diff: its lines, their equivalence classes and the changed-line marks"""
+    
+    def __init__(self, recs: List[bytes], classes: List[int]):
+        self.recs = recs
+        self.nrec = len(recs)
+        self.ha = classes
+        # rchg[i + 1] marks line i as changed; the extra slots are sentinels
+        self.rchg = bytearray(self.nrec + 2)
+        self.rindex: List[int] = []
+        self.reduced: List[int] = []
+        self.dstart = 0
+        self.dend = self.nrec - 1
+    
+    def changed(self, i: int) -> int:
+        return self.rchg[i + 1]
+    
+    def mark(self, i: int, value: int) -> None:
+        self.rchg[i + 1] = value
+
+
+def _prepare(old_lines: List[bytes], new_lines: List[bytes], ignore_space_at_eol: bool) -> Tuple[_XdFile, _XdFile]:
+    """Classify lines, trim the common ends and drop lines that cannot match (xdl_prepare_env)"""
+    ids: Dict[bytes, int] = {}
+    counts1: List[int] = []
+    counts2: List[int] = []
+    
+    def classify(lines: List[bytes], counts: List[int]) -> List[int]:
+        classes = []
+        for line in lines:
+            key = line.rstrip(_SPACE_BYTES) if ignore_space_at_eol else line
+            cls = ids.get(key)
+            if cls is None:
+                cls = ids[key] = len(ids)
+                counts1.append(0)
+                counts2.append(0)
+            counts[cls] += 1
+            classes.append(cls)
+        return classes
+    
+    xdf1 = _XdFile(old_lines, classify(old_lines, counts1))
+    xdf2 = _XdFile(new_lines, classify(new_lines, counts2))
+    
+    # xdl_trim_ends
+    limit = min(xdf1.nrec, xdf2.nrec)
+    i = 0
+    while i < limit and xdf1.ha[i] == xdf2.ha[i]:
+        i += 1
+    xdf1.dstart = xdf2.dstart = i
+    limit -= i
+    i = 0
+    while i < limit and xdf1.ha[xdf1.nrec - 1 - i] == xdf2.ha[xdf2.nrec - 1 - i]:
+        i += 1
+    xdf1.dend = xdf1.nrec - i - 1
+    xdf2.dend = xdf2.nrec - i - 1
+    
+    # xdl_cleanup_records: 0 = no match on the other side, 1 = keep, 2 = many matches
+    def discards(xdf: _XdFile, other_counts: List[int]) -> Dict[int, int]:
+        mlim = min(_bogosqrt(xdf.nrec), XDL_MAX_EQLIMIT)
+        dis = {}
+        for i in range(xdf.dstart, xdf.dend + 1):
+            nm = other_counts[xdf.ha[i]]
+            dis[i] = 0 if nm == 0 else 2 if nm >= mlim else 1
+        return dis
+    
+    def clean_mmatch(dis: Dict[int, int], i: int, s: int, e: int) -> bool:
+        s = max(s, i - XDL_SIMSCAN_WINDOW)
+        e = min(e, i + XDL_SIMSCAN_WINDOW)
+        rdis0, rpdis0 = 0, 1
+        r = 1
+        while i - r >= s:
+            if not dis[i - r]:
+                rdis0 += 1
+            elif dis[i - r] == 2:
+                rpdis0 += 1
+            else:
+                break
+            r += 1
+        if rdis0 == 0:
+            return False
+        rdis1, rpdis1 = 0, 1
+        r = 1
+        while i + r <= e:
+            if not dis[i + r]:
+                rdis1 += 1
+            elif dis[i + r] == 2:
+                rpdis1 += 1
+            else:
+                break
+            r += 1
+        if rdis1 == 0:
+            return False
+        rdis1 += rdis0
+        rpdis1 += rpdis0
+        return rpdis1 * XDL_KPDIS_RUN < rpdis1 + rdis1
+    
+    for xdf, dis in ((xdf1, discards(xdf1, counts2)), (xdf2, discards(xdf2, counts1))):
+        for i in range(xdf.dstart, xdf.dend + 1):
+            if dis[i] == 1 or (dis[i] == 2 and not clean_mmatch(dis, i, xdf.dstart, xdf.dend)):
+                xdf.rindex.append(i)
+                xdf.reduced.append(xdf.ha[i])
+            else:
+                xdf.mark(i, 1)
+    return xdf1, xdf2
+
+
+def _split(ha1: List[int], off1: int, lim1: int, ha2: List[int], off2: int, lim2: int,
+           kvdf: List[int], kvdb: List[int], koff: int, need_min: bool, mxcost: int) -> Tuple[int, int, bool, bool]:
+    """Find the split point of a middle snake (xdl_split); returns i1, i2, min_lo, min_hi"""
+    dmin, dmax = off1 - lim2, lim1 - off2
+    fmid, bmid = off1 - off2, lim1 - lim2
+    odd = (fmid - bmid) & 1
+    fmin = fmax = fmid
+    bmin = bmax = bmid
+    kvdf[fmid + koff] = off1
+    kvdb[bmid + koff] = lim1
+    ec = 0
+    while True:
+        ec += 1
+        got_snake = False
+        
+        if fmin > dmin:
+            fmin -= 1
+            kvdf[fmin - 1 + koff] = -1
+        else:
+            fmin += 1
+        if fmax < dmax:
+            fmax += 1
+            kvdf[fmax + 1 + koff] = -1
+        else:
+            fmax -= 1
+        
+        for d in range(fmax, fmin - 1, -2):
+            if kvdf[d - 1 + koff] >= kvdf[d + 1 + koff]:
+                i1 = kvdf[d - 1 + koff] + 1
+            else:
+                i1 = kvdf[d + 1 + koff]
+            prev1 = i1
+            i2 = i1 - d
+            while i1 < lim1 and i2 < lim2 and ha1[i1] == ha2[i2]:
+                i1 += 1
+                i2 += 1
+            if i1 - prev1 > XDL_SNAKE_CNT:
+                got_snake = True
+            kvdf[d + koff] = i1
+            if odd and bmin <= d <= bmax and kvdb[d + koff] <= i1:
+                return i1, i2, True, True
+        
+        if bmin > dmin:
+            bmin -= 1
+            kvdb[bmin - 1 + koff] = XDL_LINE_MAX
+        else:
+            bmin += 1
+        if bmax < dmax:
+            bmax += 1
+            kvdb[bmax + 1 + koff] = XDL_LINE_MAX
+        else:
+            bmax -= 1
+        
+        for d in range(bmax, bmin - 1, -2):
+            if kvdb[d - 1 + koff] < kvdb[d + 1 + koff]:
+                i1 = kvdb[d - 1 + koff]
+            else:
+                i1 = kvdb[d + 1 + koff] - 1
+            prev1 = i1
+            i2 = i1 - d
+            while i1 > off1 and i2 > off2 and ha1[i1 - 1] == ha2[i2 - 1]:
+                i1 -= 1
+                i2 -= 1
+            if prev1 - i1 > XDL_SNAKE_CNT:
+                got_snake = True
+            kvdb[d + koff] = i1
+            if not odd and fmin <= d <= fmax and i1 <= kvdf[d + koff]:
+                return i1, i2, True, True
+        
+        if need_min:
+            continue
+        
+        # Heuristics: accept a long enough snake once the search gets expensive
+        if got_snake and ec > XDL_HEUR_MIN_COST:
+            best = 0
+            for d in range(fmax, fmin - 1, -2):
+                dd = d - fmid if d > fmid else fmid - d
+                i1 = kvdf[d + koff]
+                i2 = i1 - d
+                v = (i1 - off1) + (i2 - off2) - dd
+                if (v > XDL_K_HEUR * ec and v > best and off1 + XDL_SNAKE_CNT <= i1 < lim1
+                        and off2 + XDL_SNAKE_CNT <= i2 < lim2):
+                    k = 1
+                    while ha1[i1 - k] == ha2[i2 - k]:
+                        if k == XDL_SNAKE_CNT:
+                            best, spl = v, (i1, i2)
+                            break
+                        k += 1
+            if best > 0:
+                return spl[0], spl[1], True, False
+            
+            best = 0
+            for d in range(bmax, bmin - 1, -2):
+                dd = d - bmid if d > bmid else bmid - d
+                i1 = kvdb[d + koff]
+                i2 = i1 - d
+                v = (lim1 - i1) + (lim2 - i2) - dd
+                if (v > XDL_K_HEUR * ec and v > best and off1 < i1 <= lim1 - XDL_SNAKE_CNT
+                        and off2 < i2 <= lim2 - XDL_SNAKE_CNT):
+                    k = 0
+                    while ha1[i1 + k] == ha2[i2 + k]:
+                        if k == XDL_SNAKE_CNT - 1:
+                            best, spl = v, (i1, i2)
+                            break
+                        k += 1
+            if best > 0:
+                return spl[0], spl[1], False, True
+        
+        # Cost limit: take the furthest reaching path found so far
+        if ec >= mxcost:
+            fbest = fbest1 = -1
+            for d in range(fmax, fmin - 1, -2):
+                i1 = min(kvdf[d + koff], lim1)
+                i2 = i1 - d
+                if lim2 < i2:
+                    i1, i2 = lim2 + d, lim2
+                if fbest < i1 + i2:
+                    fbest, fbest1 = i1 + i2, i1
+            bbest = bbest1 = XDL_LINE_MAX
+            for d in range(bmax, bmin - 1, -2):
+                i1 = max(off1, kvdb[d + koff])
+                i2 = i1 - d
+                if i2 < off2:
+                    i1, i2 = off2 + d, off2
+                if i1 + i2 < bbest:
+                    bbest, bbest1 = i1 + i2, i1
+            if (lim1 + lim2) - bbest < fbest - (off1 + off2):
+                return fbest1, fbest - fbest1, True, False
+            return bbest1, bbest - bbest1, False, True
+
+
+def _compare(xdf1: _XdFile, xdf2: _XdFile) -> None:
+    """Mark changed lines on both sides (xdl_do_diff / xdl_recs_cmp, without recursion)"""
+    ha1, ha2 = xdf1.reduced, xdf2.reduced
+    ndiags = len(ha1) + len(ha2) + 3
+    kvdf = [0] * ndiags
+    kvdb = [0] * ndiags
+    koff = len(ha2) + 1
+    mxcost = max(_bogosqrt(ndiags), XDL_MAX_COST_MIN)
+    
+    stack = [(0, len(ha1), 0, len(ha2), False)]
+    while stack:
+        off1, lim1, off2, lim2, need_min = stack.pop()
+        # Shrink the box by walking through each diagonal snake
+        while off1 < lim1 and off2 < lim2 and ha1[off1] == ha2[off2]:
+            off1 += 1
+            off2 += 1
+        while off1 < lim1 and off2 < lim2 and ha1[lim1 - 1] == ha2[lim2 - 1]:
+            lim1 -= 1
+            lim2 -= 1
+        if off1 == lim1:
+            for i in range(off2, lim2):
+                xdf2.mark(xdf2.rindex[i], 1)
+        elif off2 == lim2:
+            for i in range(off1, lim1):
+                xdf1.mark(xdf1.rindex[i], 1)
+        else:
+            i1, i2, min_lo, min_hi = _split(ha1, off1, lim1, ha2, off2, lim2, kvdf, kvdb, koff, need_min, mxcost)
+            stack.append((i1, lim1, i2, lim2, min_hi))
+            stack.append((off1, i1, off2, i2, min_lo))
+
+
+def _get_indent(line: bytes) -> int:
+    ret = 0
+    for c in line:
+        if c not in _SPACE_BYTES:
+            return ret
+        if c == 0x20:
+            ret += 1
+        elif c == 0x09:
+            ret += 8 - ret % 8
+        if ret >= MAX_INDENT:
+            return MAX_INDENT
+    return -1  # The line contains only whitespace
+
+
+def _split_score(xdf: _XdFile, split: int, score: List[int]) -> None:
+    """Add the badness of splitting the file before line `split` (measure_split + score_add_split)"""
+    if split >= xdf.nrec:
+        end_of_file, indent = True, -1
+    else:
+        end_of_file, indent = False, _get_indent(xdf.recs[split])
+    
+    pre_blank, pre_indent = 0, -1
+    for i in range(split - 1, -1, -1):
+        pre_indent = _get_indent(xdf.recs[i])
+        if pre_indent != -1:
+            break
+        pre_blank += 1
+        if pre_blank == MAX_BLANKS:
+            pre_indent = 0
+            break
+    
+    post_blank, post_indent = 0, -1
+    for i in range(split + 1, xdf.nrec):
+        post_indent = _get_indent(xdf.recs[i])
+        if post_indent != -1:
+            break
+        post_blank += 1
+        if post_blank == MAX_BLANKS:
+            post_indent = 0
+            break
+    
+    if pre_indent == -1 and pre_blank == 0:
+        score[1] += START_OF_FILE_PENALTY
+    if end_of_file:
+        score[1] += END_OF_FILE_PENALTY
+    
+    post_blank = 1 + post_blank if indent == -1 else 0
+    total_blank = pre_blank + post_blank
+    score[1] += TOTAL_BLANK_WEIGHT * total_blank
+    score[1] += POST_BLANK_WEIGHT * post_blank
+    
+    if indent == -1:
+        indent = post_indent
+    any_blanks = total_blank != 0
+    score[0] += indent
+    
+    if indent == -1 or pre_indent == -1 or indent == pre_indent:
+        pass
+    elif indent > pre_indent:
+        score[1] += RELATIVE_INDENT_WITH_BLANK_PENALTY if any_blanks else RELATIVE_INDENT_PENALTY
+    elif post_indent != -1 and post_indent > indent:
+        score[1] += RELATIVE_OUTDENT_WITH_BLANK_PENALTY if any_blanks else RELATIVE_OUTDENT_PENALTY
+    else:
+        score[1] += RELATIVE_DEDENT_WITH_BLANK_PENALTY if any_blanks else RELATIVE_DEDENT_PENALTY
+
+
+def _score_cmp(s1: List[int], s2: List[int]) -> int:
+    cmp_indents = (s1[0] > s2[0]) - (s1[0] < s2[0])
+    return INDENT_WEIGHT * cmp_indents + (s1[1] - s2[1])
+
+
+class _Group:
+    """A run of changed lines [start, end) in one file (end == start for an empty group)"""
+    
+    def __init__(self, xdf: _XdFile):
+        self.xdf = xdf
+        self.start = self.end = 0
+        while xdf.changed(self.end):
+            self.end += 1
+    
+    def next(self) -> bool:
+        if self.end == self.xdf.nrec:
+            return False
+        self.start = self.end = self.end + 1
+        while self.xdf.changed(self.end):
+            self.end += 1
+        return True
+    
+    def previous(self) -> bool:
+        if self.start == 0:
+            return False
+        self.start = self.end = self.start - 1
+        while self.xdf.changed(self.start - 1):
+            self.start -= 1
+        return True
+    
+    def slide_down(self) -> bool:
+        xdf = self.xdf
+        if self.end < xdf.nrec and xdf.ha[self.start] == xdf.ha[self.end]:
+            xdf.mark(self.start, 0)
+            xdf.mark(self.end, 1)
+            self.start += 1
+            self.end += 1
+            while xdf.changed(self.end):
+                self.end += 1
+            return True
+        return False
     
-    # Build user prompt - ask for complete modified file content
-    user_prompt = f"""Task Description:
-{task_description}
+    def slide_up(self) -> bool:
+        xdf = self.xdf
+        if self.start > 0 and xdf.ha[self.start - 1] == xdf.ha[self.end - 1]:
+            self.start -= 1
+            self.end -= 1
+            xdf.mark(self.start, 1)
+            xdf.mark(self.end, 0)
+            while xdf.changed(self.start - 1):
+                self.start -= 1
+            return True
+        return False
 
-Codebase Analysis:
-- Languages: {', '.join(codebase_analysis.get('languages', []))}
-- Framework: {codebase_analysis.get('framework', 'Unknown')}
-- Package Manager: {codebase_analysis.get('package_manager', 'Unknown')}
-- Top-level structure: {', '.join(codebase_analysis.get('file_structure', [])[:20])}
-"""
+
+def _compact(xdf: _XdFile, xdfo: _XdFile) -> None:
+    """Slide groups of changes to their most readable position (xdl_change_compact)"""
+    g, go = _Group(xdf), _Group(xdfo)
+    while True:
+        if g.end != g.start:
+            # Shift the change up and then down as far as possible, merging groups it bumps into
+            while True:
+                groupsize = g.end - g.start
+                end_matching_other = -1
+                while g.slide_up():
+                    go.previous()
+                earliest_end = g.end
+                if go.end > go.start:
+                    end_matching_other = g.end
+                while g.slide_down():
+                    go.next()
+                    if go.end > go.start:
+                        end_matching_other = g.end
+                if groupsize == g.end - g.start:
+                    break
+            
+            if g.end == earliest_end:
+                pass  # No shifting was possible
+            elif end_matching_other != -1:
+                # Line the group up with the last change in the other file it can align with
+                while go.end == go.start:
+                    g.slide_up()
+                    go.previous()
+            else:
+                # Indent heuristic: pick the shift whose two splits read best
+                shift = max(earliest_end, g.end - groupsize - 1, g.end - INDENT_HEURISTIC_MAX_SLIDING)
+                best_shift, best_score = -1, None
+                while shift <= g.end:
+                    score = [0, 0]
+                    _split_score(xdf, shift, score)
+                    _split_score(xdf, shift - groupsize, score)
+                    if best_shift == -1 or _score_cmp(score, best_score) <= 0:
+                        best_score, best_shift = score, shift
+                    shift += 1
+                while g.end > best_shift:
+                    g.slide_up()
+                    go.previous()
+        
+        if not g.next():
+            break
+        go.next()
+
+
+def _changes(xdf1: _XdFile, xdf2: _XdFile) -> List[Tuple[int, int, int, int]]:
+    """The edit script: (i1, i2, chg1, chg2) for each run of changes (xdl_build_script)"""
+    changes = []
+    i1 = i2 = 0
+    while i1 < xdf1.nrec or i2 < xdf2.nrec:
+        if xdf1.changed(i1) or xdf2.changed(i2):
+            l1, l2 = i1, i2
+            while xdf1.changed(i1):
+                i1 += 1
+            while xdf2.changed(i2):
+                i2 += 1
+            changes.append((l1, l2, i1 - l1, i2 - l2))
+        else:
+            i1 += 1
+            i2 += 1
+    return changes
+
+
+def _func_line(line: bytes) -> Optional[bytes]:
+    """git's default hunk-header function name: a line starting with a letter, '_' or '$'"""
+    if line and (chr(line[0]).isalpha() and line[0] < 0x80 or line[:1] in (b"_", b"$")):
+        return line[:80].rstrip(_SPACE_BYTES)
+    return None
+
+
+def _range(start: int, count: int) -> bytes:
+    start = start if count else start - 1
+    return b"%d" % start if count == 1 else b"%d,%d" % (start, count)
+
+
+def split_lines(data: bytes) -> List[bytes]:
+    """Lines of a file with their endings; like git, only "\n" ends a line (a bare "\r" does not)"""
+    return io.BytesIO(data).readlines()
+
+
+def diff_lines(old_lines: List[bytes], new_lines: List[bytes], context: int = DIFF_CONTEXT_LINES, ignore_space_at_eol: bool = False) -> bytes:
+    """Unified diff hunks between two files given as lists of lines (with their line endings)"""
+    xdf1, xdf2 = _prepare(old_lines, new_lines, ignore_space_at_eol)
+    _compare(xdf1, xdf2)
+    _compact(xdf1, xdf2)
+    _compact(xdf2, xdf1)
+    changes = _changes(xdf1, xdf2)
     
-    # Include relevant file contents for context
-    # Extract explicitly mentioned files from task description
-    explicit_files = []
-    task_lower = task_description.lower()
-    for file_path, content in relevant_files:
-        # Check if file path is explicitly mentioned in task
-        file_name = file_path.split('/')[-1]
-        if file_path in task_description or file_name in task_description:
-            explicit_files.append((file_path, content))
+    def emit(out: List[bytes], prefix: bytes, line: bytes) -> None:
+        out.append(prefix + line)
+        if not line.endswith(b"\n"):
+            out.append(NO_NEWLINE_MARKER)
     
-    if relevant_files:
-        if explicit_files:
-            user_prompt += f"\n\nFiles to MODIFY (explicitly mentioned in task - generate modified content for these):\n"
-            for file_path, content in explicit_files:
-                lines = content.split('\n')
-                line_count = len(lines)
-                user_prompt += f"\n--- File: {file_path} ({line_count} lines total) ---\n"
-                if "... (truncated" in content:
-                    first_lines = '\n'.join(lines[:100])
-                    last_lines = '\n'.join(lines[-50:]) if len(lines) > 150 else ""
-                    if last_lines:
-                        user_prompt += f"{first_lines}\n... (middle section truncated) ...\n{last_lines}\n"
-                    else:
-                        user_prompt += f"{content}\n"
-                else:
-                    numbered_lines = [f"{i+1:4d}| {line}" for i, line in enumerate(lines)]
-                    user_prompt += '\n'.join(numbered_lines) + "\n"
+    out: List[bytes] = []
+    func_line = b""
+    func_search_limit = -1
+    start = 0
+    while start < len(changes):
+        # Group changes separated by at most twice the context into one hunk
+        last = start
+        while last + 1 < len(changes):
+            prev, nxt = changes[last], changes[last + 1]
+            if nxt[0] - (prev[0] + prev[2]) > 2 * context:
+                break
+            last += 1
+        first, final = changes[start], changes[last]
+        s1 = max(first[0] - context, 0)
+        s2 = max(first[1] - context, 0)
+        lctx = min(context, xdf1.nrec - (final[0] + final[2]), xdf2.nrec - (final[1] + final[3]))
+        e1 = final[0] + final[2] + lctx
+        e2 = final[1] + final[3] + lctx
         
-        # Show other relevant files for context only
-        context_files = [(fp, c) for fp, c in relevant_files if (fp, c) not in explicit_files]
-        if context_files:
-            user_prompt += f"\n\nContext Files (for reference only - DO NOT modify these):\n"
-            for file_path, content in context_files[:5]:  # Limit to 5 context files
-                lines = content.split('\n')
-                line_count = len(lines)
-                user_prompt += f"\n--- File: {file_path} ({line_count} lines total) - CONTEXT ONLY ---\n"
-                # Show only first 50 lines for context
-                if len(lines) > 50:
-                    user_prompt += '\n'.join(lines[:50]) + "\n... (truncated for context) ...\n"
-                else:
-                    user_prompt += '\n'.join(lines) + "\n"
+        for l in range(s1 - 1, func_search_limit, -1):
+            found = _func_line(old_lines[l])
+            if found is not None:
+                func_line = found
+                break
+        func_search_limit = s1 - 1
         
-        # Legacy format for backward compatibility if no explicit files found
-        if not explicit_files and not context_files:
-            user_prompt += "\n\nRelevant Files (check task description to see which ones to modify):\n"
-            for file_path, content in relevant_files:
-                lines = content.split('\n')
-                line_count = len(lines)
-                user_prompt += f"\n--- File: {file_path} ({line_count} lines total) ---\n"
-                if "... (truncated" in content:
-                    first_lines = '\n'.join(lines[:100])
-                    last_lines = '\n'.join(lines[-50:]) if len(lines) > 150 else ""
-                    if last_lines:
-                        user_prompt += f"{first_lines}\n... (middle section truncated) ...\n{last_lines}\n"
-                    else:
-                        user_prompt += f"{content}\n"
-                else:
-                    numbered_lines = [f"{i+1:4d}| {line}" for i, line in enumerate(lines)]
-                    user_prompt += '\n'.join(numbered_lines) + "\n"
-    
-    if coderabbit_analysis:
-        user_prompt += f"\n\nCodeRabbit Analysis:\n{coderabbit_analysis}\n"
-    
-    user_prompt += """
+        out.append(b"@@ -" + _range(s1 + 1, e1 - s1) + b" +" + _range(s2 + 1, e2 - s2) + b" @@" + (b" " + func_line if func_line else b"") + b"\n")
+        i2 = s2
+        for i1, c2, chg1, chg2 in changes[start:last + 1]:
+            for line in new_lines[i2:c2]:
+                emit(out, b" ", line)
+            for line in old_lines[i1:i1 + chg1]:
+                emit(out, b"-", line)
+            for line in new_lines[c2:c2 + chg2]:
+                emit(out, b"+", line)
+            i2 = c2 + chg2
+        for line in new_lines[i2:e2]:
+            emit(out, b" ", line)
+        start = last + 1
+    return b"".join(out)
 
-Generate the COMPLETE modified file content that implements the task.
 
-**CRITICAL INSTRUCTIONS:**
-1. **Output the COMPLETE file content** - not a diff, not a patch, but the full modified file
-2. **For each file shown above**, output the complete modified version
-3. **Preserve all existing content** that should not change - copy it exactly
-4. **Make only the necessary changes** to implement the task
-5. **Maintain exact formatting** - preserve whitespace, indentation, line endings
-6. **If a file is shown above, it EXISTS** - you are modifying it, not creating it
-7. **Check if content already exists** - if it does, modify existing content instead of adding duplicates
+def _blob_id(data: bytes) -> str:
+    return hashlib.sha1(b"blob %d\0" % len(data) + data).hexdigest()
 
-**Output Format:**
-For each file to modify, output:
-```
-FILE: <file_path>
-<complete file content here>
----
-```
 
-Example:
-```
-FILE: README.md
-# Project Name
+def _quote_path(path: str) -> str:
+    """Quote a header path the way git does (core.quotePath): C-style, non-ASCII as octal"""
+    raw = path.encode("utf-8", "surrogateescape")
+    escapes = {0x07: "\\a", 0x08: "\\b", 0x09: "\\t", 0x0a: "\\n", 0x0b: "\\v", 0x0c: "\\f", 0x0d: "\\r", 0x22: '\\"', 0x5c: "\\\\"}
+    if not any(b in escapes or b < 0x20 or b >= 0x7f for b in raw):
+        return path
+    quoted = "".join(escapes.get(b) or (f"\\{b:03o}" if b < 0x20 or b >= 0x7f else chr(b)) for b in raw)
+    return f'"{quoted}"'
 
-## Description
-...
 
-## New Section Added Here
-...
----
-```
+def unified_diff(path: str, old: Optional[bytes], new: Optional[bytes], mode: str = "100644", ignore_space_at_eol: bool = False) -> str:
+    """
+    git-style diff of one file: `old` is None for a new file and `new` None
+    for a deleted one. Returns an empty string when nothing changed.
+    """
+    if old == new:
+        return ""
+    a_path, b_path = _quote_path("a/" + path), _quote_path("b/" + path)
+    tab = "\t" if " " in path else ""
+    old_id = _blob_id(old)[:DIFF_ABBREV] if old is not None else "0" * DIFF_ABBREV
+    new_id = _blob_id(new)[:DIFF_ABBREV] if new is not None else "0" * DIFF_ABBREV
+    
+    header = f"diff --git {a_path} {b_path}\n"
+    if old is None:
+        header += f"new file mode {mode}\nindex {old_id}..{new_id}\n"
+    elif new is None:
+        header += f"deleted file mode {mode}\nindex {old_id}..{new_id}\n"
+    else:
+        header += f"index {old_id}..{new_id} {mode}\n"
+    
+    hunks = diff_lines(split_lines(old or b""), split_lines(new or b""), ignore_space_at_eol=ignore_space_at_eol)
+    if not hunks:
+        # Empty new/deleted files, or only ignored whitespace changes
+        return header if old is None or new is None else ""
+    header += f"--- {a_path + tab if old is not None else '/dev/null'}\n+++ {b_path + tab if new is not None else '/dev/null'}\n"
+    return header + hunks.decode("utf-8", "replace")
 
-Output ONLY the file content(s), with no explanations, no markdown formatting around the content itself.
 
-**CRITICAL REMINDER:**
-- You are modifying an EXISTING file - output the COMPLETE file from line 1 to the end
-- DO NOT output just a snippet or excerpt from the file
-- DO NOT output shell commands or instructions
-- You MUST include ALL existing content, then add the new section
-- The file shown above is the COMPLETE file - you need to output it ALL with your changes added"""
+def diff_modified_file(repo_path: Path, file_path: str, modified_content: str) -> str:
+    """
+    Generate the unified diff of one file's modified content against the
+    repository. Returns an empty string if nothing changed.
+    """
+    original_file = repo_path / file_path
+    
+    # Verify the file path is correct
+    if not original_file.exists():
+        # Try to find the file with case-insensitive search
+        matches = get_file_index(repo_path).find_name(original_file.name)
+        if matches:
+            original_file = repo_path / matches[0].path
+            print(f"[pj] Found file with different case: {original_file}", file=sys.stderr)
+    
+    # Normalize line endings to ensure consistency
+    # Convert all line endings to \n (Unix style)
+    modified_content = modified_content.replace('\r\n', '\n').replace('\r', '\n')
+    new = modified_content.encode('utf-8')
+    
+    if not original_file.exists():
+        # New file
+        return unified_diff(file_path, None, new)
     
     try:
-        with timeout(180):  # 3 minute timeout
-            finish_reason = None
-            max_tokens = get_max_tokens_for_model(provider, model)
-            print(f"[pj] Using max_tokens={max_tokens} for model {model} (provider: {provider})", file=sys.stderr)
-            
-            if provider == "openai" or provider == "openrouter":
-                # Both OpenAI and OpenRouter use OpenAI-compatible API
-                response = client.chat.completions.create(
-                    model=model,
-                    messages=[
-                        {"role": "system", "content": system_prompt},
-                        {"role": "user", "content": user_prompt},
-                    ],
-                    temperature=0.0,
-                    max_tokens=max_tokens,  # Model-specific limit
-                )
-                # Safely extract content and metadata
-                if not response.choices or len(response.choices) == 0:
-                    raise RuntimeError("No choices in API response")
-                
-                choice = response.choices[0]
-                if not hasattr(choice, 'message') or not choice.message:
-                    raise RuntimeError("No message in API response choice")
-                
-                if not hasattr(choice.message, 'content') or not choice.message.content:
-                    raise RuntimeError("No content in API response message")
-                
-                content = choice.message.content.strip()
-                finish_reason = getattr(choice, 'finish_reason', None)  # finish_reason is on the choice, not the message
-                usage = getattr(response, 'usage', None)
-                
-                # Debug: Log BEFORE any processing
-                print(f"[pj] DEBUG: Raw LLM response length: {len(content)} chars", file=sys.stderr)
-                print(f"[pj] DEBUG: Raw LLM response (first 1000 chars): {content[:1000]}", file=sys.stderr)
-                print(f"[pj] DEBUG: System prompt length: {len(system_prompt)} chars", file=sys.stderr)
-                print(f"[pj] DEBUG: User prompt length: {len(user_prompt)} chars", file=sys.stderr)
-                print(f"[pj] DEBUG: Finish reason: {finish_reason}", file=sys.stderr)
-                
-                if usage:
-                    print(f"[pj] Token usage: {usage.total_tokens} (prompt: {usage.prompt_tokens}, completion: {usage.completion_tokens})", file=sys.stderr)
-                
-                if finish_reason == "length":
-                    print(f"[pj] WARNING: LLM response was truncated (finish_reason: length). Content may be incomplete.", file=sys.stderr)
-            else:  # anthropic
-                message = client.messages.create(
-                    model=model,
-                    max_tokens=max_tokens,  # Model-specific limit
-                    temperature=0.0,
-                    system=system_prompt,
-                    messages=[
-                        {"role": "user", "content": user_prompt},
-                    ],
-                )
-                # Safely extract content from Anthropic response
-                if not hasattr(message, 'content') or not message.content or len(message.content) == 0:
-                    raise RuntimeError("No content in Anthropic API response")
-                
-                if not hasattr(message.content[0], 'text') or not message.content[0].text:
-                    raise RuntimeError("No text in Anthropic API response content")
-                
-                content = message.content[0].text.strip()
-                finish_reason = getattr(message, 'stop_reason', None)
-                usage = getattr(message, 'usage', None)
-                
-                if usage:
-                    print(f"[pj] Token usage: {usage.input_tokens} input, {usage.output_tokens} output", file=sys.stderr)
-                
-                if finish_reason == "max_tokens":
-                    print(f"[pj] WARNING: LLM response was truncated (stop_reason: max_tokens). Content may be incomplete.", file=sys.stderr)
-            
-            # Parse the response to extract file contents
-            modified_files = {}
-            current_file = None
-            current_content = []
-            
-            # CRITICAL VALIDATION: Reject responses that don't start with "FILE:"
-            # This catches cases where the LLM returns shell commands, documentation, or other wrong content
-            content_stripped = content.strip()
-            if not content_stripped.startswith("FILE:"):
-                print(f"[pj] ERROR: LLM response does not start with 'FILE:' - this indicates wrong content type", file=sys.stderr)
-                print(f"[pj] Response starts with: {content_stripped[:200]}", file=sys.stderr)
-                print(f"[pj] This likely means the LLM returned shell commands, documentation, or instructions instead of file content", file=sys.stderr)
-                raise RuntimeError(
-                    f"LLM response does not start with 'FILE:' format. "
-                    f"Response preview: {content_stripped[:200]}. "
-                    f"The LLM may have returned shell commands, documentation, or instructions instead of the modified file content. "
-                    f"Expected format: 'FILE: <path>\\n<content>\\n---'"
-                )
-            
-            # Clean content - remove any markdown code blocks that might have been added
-            # BUT: Only extract if the content doesn't already start with "FILE:"
-            # The LLM should output FILE: format directly, not wrapped in code blocks
-            if "```" in content and not content.strip().startswith("FILE:"):
-                # Try to extract content from code blocks
-                import re
-                code_block_pattern = r"```(?:[a-z]+)?\n?(.*?)```"
-                matches = re.findall(code_block_pattern, content, re.DOTALL)
-                if matches:
-                    # Use content from code blocks
-                    extracted = matches[-1].strip()  # Use last match (most likely the actual content)
-                    print(f"[pj] DEBUG: Extracted content from markdown code block (length: {len(extracted)} chars)", file=sys.stderr)
-                    print(f"[pj] DEBUG: Extracted content preview: {extracted[:200]}", file=sys.stderr)
-                    # CRITICAL: Only use extracted content if it starts with "FILE:" - this is the required format
-                    # Do NOT extract shell commands, documentation snippets, or other non-file content
-                    if extracted.startswith("FILE:"):
-                        content = extracted
-                        print(f"[pj] Using extracted content from code block (starts with FILE:)", file=sys.stderr)
-                    else:
-                        print(f"[pj] WARNING: Extracted content does not start with FILE:, ignoring code block extraction", file=sys.stderr)
-                        print(f"[pj] WARNING: This likely means the LLM returned wrong content (shell commands, docs, etc.)", file=sys.stderr)
-                        # Don't extract - the code block contains wrong content, use original content
-                        # The original content might have the correct FILE: format elsewhere
-            
-            for line in content.split('\n'):
-                # Stop parsing if we hit debug/error messages
-                if any(artifact in line.lower() for artifact in ['patch preview', 'error:', 'traceback', 'debug:', 'warning:']):
-                    print(f"[pj] WARNING: Stopping file parsing at line containing: {line[:50]}", file=sys.stderr)
-                    break
-                    
-                if line.startswith('FILE: '):
-                    # Save previous file if any
-                    if current_file and current_content:
-                        file_content = '\n'.join(current_content).rstrip() + '\n'
-                        # Validate content is not empty and doesn't look corrupted
-                        if file_content.strip() and not file_content.startswith('\\n'):
-                            modified_files[current_file] = file_content
-                        else:
-                            print(f"[pj] WARNING: Skipping corrupted file content for {current_file}", file=sys.stderr)
-                    # Start new file
-                    current_file = line[6:].strip()  # Remove 'FILE: ' prefix
-                    current_content = []
-                elif line == '---' and current_file:
-                    # End of file
-                    if current_content:
-                        file_content = '\n'.join(current_content).rstrip() + '\n'
-                        # Validate content is not empty and doesn't look corrupted
-                        if file_content.strip() and not file_content.startswith('\\n'):
-                            modified_files[current_file] = file_content
-                        else:
-                            print(f"[pj] WARNING: Skipping corrupted file content for {current_file}", file=sys.stderr)
-                    current_file = None
-                    current_content = []
-                elif current_file:
-                    # Skip lines that look like debug output
-                    if not any(artifact in line.lower() for artifact in ['patch preview', 'error:', 'traceback']):
-                        current_content.append(line)
-            
-            # Save last file if any
-            if current_file and current_content:
-                file_content = '\n'.join(current_content).rstrip() + '\n'
-                # Validate content is not empty and doesn't look corrupted
-                if file_content.strip() and not file_content.startswith('\\n'):
-                    modified_files[current_file] = file_content
-                else:
-                    print(f"[pj] WARNING: Skipping corrupted file content for {current_file}", file=sys.stderr)
-            
-            # Validate we got at least one file
-            if not modified_files:
-                print(f"[pj] ERROR: No valid file content extracted from LLM response", file=sys.stderr)
-                print(f"[pj] Response preview (first 1000 chars): {content[:1000]}", file=sys.stderr)
-                print(f"[pj] Response length: {len(content)} characters", file=sys.stderr)
-                
-                # Check if response looks like documentation/instructions instead of file content
-                if any(indicator in content[:200].lower() for indicator in [
-                    '##', '###', '**', '* ', '- ', '1.', '2.', 
-                    'use ', 'to create', 'to edit', 'instructions',
-                    'guide', 'tutorial', 'documentation'
-                ]) and 'FILE:' not in content:
-                    error_msg = (
-                        "LLM returned documentation/instructions instead of file content format. "
-                        "Expected format: 'FILE: <path>\\n<content>\\n---'. "
-                        "The LLM may have misunderstood the task or the system prompt was not used correctly."
-                    )
-                    print(f"[pj] {error_msg}", file=sys.stderr)
-                    raise RuntimeError(error_msg)
-                
-                raise RuntimeError("Failed to extract file content from LLM response. Response may be truncated or malformed. Expected format: 'FILE: <path>\\n<content>\\n---'")
-            
-            # Validate file contents don't contain obvious corruption
-            for file_path, file_content in modified_files.items():
-                # Check for literal \n sequences (should be actual newlines)
-                if '\\n' in file_content and file_content.count('\\n') > file_content.count('\n'):
-                    print(f"[pj] WARNING: File {file_path} contains literal \\n sequences - may be corrupted", file=sys.stderr)
-                # Check for incomplete content (ends mid-sentence or has placeholder text)
-                if file_content.strip().endswith(('...', '...\n', 'TODO', 'FIXME')):
-                    print(f"[pj] WARNING: File {file_path} may be incomplete (ends with placeholder)", file=sys.stderr)
-            
-            return modified_files
-            
-    except TimeoutError:
-        raise TimeoutError(f"{provider} API call timed out after 180 seconds")
+        old = original_file.read_bytes()
     except Exception as e:
-        raise RuntimeError(f"{provider} API error: {str(e)}")
+        raise RuntimeError(f"Failed to read original file {file_path}: {e}")
+    mode = "100755" if os.access(original_file, os.X_OK) else "100644"
+    
+    # Ignore whitespace at end of line to handle minor whitespace differences
+    patch_content = unified_diff(file_path, old, new, mode=mode, ignore_space_at_eol=True)
+    if not patch_content:
+        print(f"[pj] Warning: No differences found for {file_path}", file=sys.stderr)
+    return patch_content
+
+
+class StreamingDiffs:
+    """
+    Diffs files in the background as the streaming parser completes them, so
+    the diff stage overlaps with the rest of the response.
+    """
+    
+    def __init__(self, repo_path: Path, max_workers: int = 2):
+        self.repo_path = repo_path
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._pending: Dict[str, Tuple[str, Future]] = {}
+    
+    def add(self, file_path: str, content: str) -> None:
+        print(f"[pj] Received complete content for {file_path}, diffing while the response continues", file=sys.stderr)
+        self._pending[file_path] = (content, self._executor.submit(contextvars.copy_context().run, diff_modified_file, self.repo_path, file_path, content))
+    
+    def get(self, file_path: str, content: str) -> Optional[str]:
+        """The diff for this exact content, or None if it was not computed"""
+        pending = self._pending.get(file_path)
+        if pending is None or pending[0] != content:
+            return None
+        return pending[1].result()
+    
+    def close(self) -> None:
+        self._executor.shutdown(wait=True)
 
 
 def generate_patch_from_modified_files(
     repo_path: Path,
     modified_files: Dict[str, str],
     output_patch: Path,
+    diffs: Optional["StreamingDiffs"] = None,
 ) -> str:
     """
-    Generate unified diff patch from modified file contents using git diff.
+    Generate unified diff patch from modified file contents, diffing files
+    concurrently in-process. Files already diffed while the response was streaming are taken from
+    `diffs`.
     """
-    import tempfile
-    import subprocess
+    pending = []
     
-    patches = []
-    
-    for file_path, modified_content in modified_files.items():
-        original_file = repo_path / file_path
-        
-        # Verify the file path is correct
-        if not original_file.exists():
-            # Try to find the file with case-insensitive search
-            found = False
-            for path in repo_path.rglob("*"):
-                if path.is_file() and path.name.lower() == original_file.name.lower():
-                    original_file = path
-                    found = True
-                    print(f"[pj] Found file with different case: {original_file}", file=sys.stderr)
-                    break
-            
-            if not found:
-                # New file
-                with tempfile.NamedTemporaryFile(mode='w', delete=False, suffix='.tmp') as f:
-                    f.write(modified_content)
-                    temp_file = f.name
-                
-                try:
-                    # Use git diff --no-index to create patch for new file
-                    result = subprocess.run(
-                        ['git', 'diff', '--no-index', '--', '/dev/null', temp_file],
-                        capture_output=True,
-                        text=True,
-                        cwd=repo_path,
-                    )
-                    
-                    if result.returncode != 1:
-                        # git diff returns 1 when files differ (which is what we want for new files)
-                        # 0 means no differences (shouldn't happen for new file)
-                        # >1 means error
-                        if result.returncode == 0:
-                            print(f"[pj] Warning: No differences found for new file {file_path}", file=sys.stderr)
-                        else:
-                            raise RuntimeError(f"git diff failed with exit code {result.returncode}: {result.stderr}")
-                    
-                    # Replace temp file paths with actual file paths
-                    # git diff outputs: --- /dev/null, +++ b/tmp/... 
-                    # For new files, we keep /dev/null in --- line, only replace +++ line
-                    # Format should be: --- /dev/null, +++ b/file_path
-                    patch_content = result.stdout
-                    import re
-                    # Replace the temp file path in +++ line
-                    # git diff outputs: +++ b/tmp/... or +++ b/var/folders/...
-                    # We need: +++ b/file_path
-                    # Match +++ b/ followed by any path (including temp file path)
-                    patch_content = re.sub(
-                        r'\+\+\+ b/[^\s]+',
-                        f'+++ b/{file_path}',
-                        patch_content
-                    )
-                    # Fix the diff --git line
-                    # Format: diff --git /dev/null b/tmp/...
-                    # We need: diff --git a/file_path b/file_path
-                    # For new files, git diff uses /dev/null, but unified diff format uses a/file_path
-                    patch_content = re.sub(
-                        r'diff --git /dev/null b/[^\s]+',
-                        f'diff --git a/{file_path} b/{file_path}',
-                        patch_content
-                    )
-                    # Also handle case where diff --git might have different format
-                    patch_content = re.sub(
-                        r'diff --git [^\s]+ [^\s]+',
-                        f'diff --git a/{file_path} b/{file_path}',
-                        patch_content,
-                        count=1  # Only replace first occurrence per patch
-                    )
-                    patches.append(patch_content)
-                finally:
-                    os.unlink(temp_file)
-        else:
-            # Modified file
-            # Read original content - use the same encoding and method as find_relevant_files
-            try:
-                with open(original_file, 'r', encoding='utf-8', errors='ignore') as f:
-                    original_content = f.read()
-            except Exception as e:
-                raise RuntimeError(f"Failed to read original file {file_path}: {e}")
-            
-            # Normalize line endings to ensure consistency
-            # Convert all line endings to \n (Unix style)
-            original_content = original_content.replace('\r\n', '\n').replace('\r', '\n')
-            modified_content = modified_content.replace('\r\n', '\n').replace('\r', '\n')
-            
-            # Write modified content to temp file
-            with tempfile.NamedTemporaryFile(mode='w', delete=False, suffix='.tmp', encoding='utf-8') as f:
-                f.write(modified_content)
-                temp_file = f.name
-            
-            try:
-                # Use git diff --no-index to create patch
-                # Use --ignore-space-at-eol to handle minor whitespace differences
-                result = subprocess.run(
-                    ['git', 'diff', '--no-index', '--ignore-space-at-eol', '--', str(original_file), temp_file],
-                    capture_output=True,
-                    text=True,
-                    cwd=repo_path,
-                )
-                
-                if result.returncode == 0:
-                    # No differences - empty patch
-                    print(f"[pj] Warning: No differences found for {file_path}", file=sys.stderr)
-                elif result.returncode == 1:
-                    # Has differences - this is what we want
-                    patch_content = result.stdout
-                    # Replace temp file paths with actual file paths
-                    import re
-                    # Replace the original file path (absolute) with relative path
-                    # Handle both absolute paths and relative paths in the patch
-                    patch_content = re.sub(r'--- a/[^\s]+', f'--- a/{file_path}', patch_content)
-                    patch_content = re.sub(r'\+\+\+ b/[^\s]+', f'+++ b/{file_path}', patch_content)
-                    # Also fix the diff --git line if it has absolute paths
-                    patch_content = re.sub(
-                        r'diff --git [^\s]+ [^\s]+',
-                        f'diff --git a/{file_path} b/{file_path}',
-                        patch_content,
-                        count=1  # Only replace first occurrence per patch
-                    )
-                    patches.append(patch_content)
-                else:
-                    raise RuntimeError(f"git diff failed with exit code {result.returncode}: {result.stderr}")
-            finally:
-                os.unlink(temp_file)
+    with ThreadPoolExecutor(max_workers=DIFF_WORKERS) as executor:
+        for file_path, modified_content in modified_files.items():
+            patch_content = diffs.get(file_path, modified_content) if diffs else None
+            if patch_content is None:
+                # Run in a copy of this context so log output reaches the same task (see _TaskOutput)
+                patch_content = executor.submit(contextvars.copy_context().run, diff_modified_file, repo_path, file_path, modified_content)
+            pending.append(patch_content)
+    patches = [p.result() if isinstance(p, Future) else p for p in pending]
     
     # Combine all patches
     combined_patch = ''.join(patches)
@@ -1106,31 +3550,180 @@ def generate_patch_from_modified_files(
     return combined_patch
 
 
-def main():
-    parser = argparse.ArgumentParser(description="Generate code patch using AI agent")
-    parser.add_argument("--prompt-file", type=Path, required=True, help="Path to system prompt file")
-    parser.add_argument("--task", type=str, required=True, help="Task description")
-    parser.add_argument("--repo-path", type=Path, default=Path.cwd(), help="Path to repository (default: current directory)")
-    parser.add_argument("--out", type=Path, required=True, help="Output file for patch")
-    parser.add_argument("--provider", type=str, choices=["openai", "anthropic", "openrouter"], default=None, help="LLM provider (default: from MODEL_PROVIDER env var)")
-    parser.add_argument("--model", type=str, default=None, help="Model name (default: from MODEL_NAME env var)")
-    parser.add_argument("--coderabbit-analysis", type=Path, help="Path to CodeRabbit analysis file (optional)")
-    parser.add_argument("--use-two-step", action="store_true", default=True, help="Use two-step approach (generate file, then diff) - default: true")
+# Daemon mode: one long-lived process serves tasks over a unix socket, with
+# the provider SDKs imported, their clients' connections open, and system
+# prompts and repository indexes in memory; the CLI becomes a thin client
+DAEMON_SOCKET = os.getenv("AGENT_DAEMON_SOCKET", "")
+DAEMON_TASK_ENV = ("MODEL_PROVIDER", "MODEL_NAME", "OPENAI_API_KEY", "ANTHROPIC_API_KEY", "OPENROUTER_API_KEY")
+DAEMON_PATH_ARGS = ("prompt_file", "repo_path", "out", "coderabbit_analysis")
+
+_task_output: contextvars.ContextVar[Optional[Any]] = contextvars.ContextVar("task_output", default=None)
+
+
+class _TaskOutput:
+    """
+    Replaces sys.stderr in the daemon. Writes go to the client of the task
+    they come from, found through a context variable (which asyncio's
+    worker threads inherit, and the diff executors are given), and to the
+    daemon's own stderr otherwise.
+    """
     
-    args = parser.parse_args()
+    def __init__(self, stream):
+        self._stream = stream
+    
+    def write(self, text: str) -> int:
+        send = _task_output.get()
+        if send is None:
+            return self._stream.write(text)
+        send(text)
+        return len(text)
+    
+    def flush(self) -> None:
+        if _task_output.get() is None:
+            self._stream.flush()
+    
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+
+class _TaskHandler(socketserver.StreamRequestHandler):
+    """
+    Runs one task per connection. The client sends a JSON line with its
+    arguments and environment; the daemon answers with JSON lines carrying
+    the task's log ({"stderr": ...}) and finally its exit code ({"exit": ...}).
+    """
+    
+    def handle(self) -> None:
+        lock = threading.Lock()
+        
+        def send(message: Dict[str, Any]) -> None:
+            with lock:
+                try:
+                    self.wfile.write(json.dumps(message).encode() + b"\n")
+                except OSError:
+                    pass  # The client is gone; _watch cancels the task
+        
+        try:
+            request = json.loads(self.rfile.readline())
+            args = argparse.Namespace(**request["args"])
+            for name in DAEMON_PATH_ARGS:
+                if getattr(args, name, None) is not None:
+                    setattr(args, name, Path(getattr(args, name)))
+            env = {name: value for name, value in os.environ.items() if name not in DAEMON_TASK_ENV}
+            env.update(request.get("env") or {})
+        except (ValueError, KeyError, TypeError) as e:
+            send({"stderr": f"[pj] Error: invalid daemon request: {e}\n"})
+            send({"exit": 2})
+            return
+        
+        # The task's own budget (started by run_task) nests in this one, so a
+        # client that disconnects stops the task's requests
+        connection = start_task_budget(None)
+        threading.Thread(target=self._watch, args=(connection,), daemon=True).start()
+        _task_output.set(lambda text: send({"stderr": text}))
+        try:
+            refresh_indexes(args.repo_path)
+            exit_code = run_task(args, env)
+        except Exception as e:
+            print(f"[pj] Error running task: {e}", file=sys.stderr)
+            exit_code = 1
+        send({"exit": exit_code})
+    
+    def _watch(self, connection: Deadline) -> None:
+        # The client sends nothing after its request, so this only returns once it disconnects
+        try:
+            self.connection.recv(1)
+        except OSError:
+            pass
+        connection.cancel("client disconnected")
+
+
+def serve(socket_path: str) -> None:
+    """Serve tasks on a unix socket until interrupted, each in its own thread"""
+    load_provider_sdk("openai")
+    load_provider_sdk("anthropic")
+    path = Path(socket_path)
+    if path.exists():
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(socket_path)
+        except OSError:
+            path.unlink()  # Left behind by a daemon that did not shut down cleanly
+        else:
+            print(f"[pj] Error: an agent daemon is already listening on {socket_path}", file=sys.stderr)
+            sys.exit(1)
+        finally:
+            probe.close()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    
+    # Requests carry API keys, so only this user may connect
+    umask = os.umask(0o177)
+    try:
+        server = socketserver.ThreadingUnixStreamServer(socket_path, _TaskHandler)
+    finally:
+        os.umask(umask)
+    server.daemon_threads = True
+    sys.stderr = _TaskOutput(sys.stderr)
+    print(f"[pj] Agent daemon listening on {socket_path}", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        path.unlink(missing_ok=True)
+
+
+def run_in_daemon(args: argparse.Namespace, socket_path: str) -> Optional[int]:
+    """
+    Run the task in the daemon listening on socket_path, relaying its log
+    to stderr. Returns the task's exit code, or None when no daemon is
+    listening and the task should run in this process instead.
+    """
+    request = {
+        "args": {name: str(value.resolve()) if isinstance(value, Path) else value for name, value in vars(args).items()},
+        "env": {name: os.environ[name] for name in DAEMON_TASK_ENV if name in os.environ},
+    }
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(socket_path)
+    except OSError as e:
+        client.close()
+        print(f"[pj] No agent daemon at {socket_path} ({e}), running the task in-process", file=sys.stderr)
+        return None
+    
+    with client, client.makefile("rb") as replies:
+        client.sendall(json.dumps(request).encode() + b"\n")
+        for line in replies:
+            reply = json.loads(line)
+            if "exit" in reply:
+                return reply["exit"]
+            sys.stderr.write(reply.get("stderr", ""))
+    print(f"[pj] Error: agent daemon closed the connection before the task finished", file=sys.stderr)
+    return 1
+
+
+def run_task(args: argparse.Namespace, env=None) -> int:
+    """
+    Generate the patch for one task and return the process exit code.
+    Provider, model and API keys are read from `env` (default: os.environ),
+    which the daemon takes from the client's environment.
+    """
+    if env is None:
+        env = os.environ
     
     # Determine provider and model
-    provider = args.provider or os.getenv("MODEL_PROVIDER", "openai")
+    provider = args.provider or env.get("MODEL_PROVIDER", "openai")
     if not args.model:
         # Set default model based on provider
         if provider == "openai":
-            model = os.getenv("MODEL_NAME", "gpt-4o")
+            model = env.get("MODEL_NAME", "gpt-4o")
         elif provider == "anthropic":
-            model = os.getenv("MODEL_NAME", "claude-3-5-sonnet-20241022")
+            model = env.get("MODEL_NAME", "claude-3-5-sonnet-20241022")
         elif provider == "openrouter":
-            model = os.getenv("MODEL_NAME", "moonshotai/kimi-k2-0905")  # Default to Kimi K2
+            model = env.get("MODEL_NAME", "moonshotai/kimi-k2-0905")  # Default to Kimi K2
         else:
-            model = os.getenv("MODEL_NAME", "gpt-4o")
+            model = env.get("MODEL_NAME", "gpt-4o")
     else:
         model = args.model
     
@@ -1150,6 +3743,13 @@ def main():
             system_prompt = load_system_prompt(prompt_file)
             print(f"[pj] DEBUG: System prompt loaded successfully, length: {len(system_prompt)} chars", file=sys.stderr)
             print(f"[pj] DEBUG: System prompt first 200 chars: {system_prompt[:200]}", file=sys.stderr)
+            # Edit-block mode has its own prompt; the file generation prompt stays as the fallback
+            edit_prompt_file = args.prompt_file.parent / "system-prompt-edit-blocks.md"
+            if EDIT_FORMAT == "edits" and edit_prompt_file.exists():
+                edit_system_prompt = load_system_prompt(edit_prompt_file)
+                print(f"[pj] Using edit-block output format ({edit_prompt_file})", file=sys.stderr)
+            else:
+                edit_system_prompt = None
         else:
             system_prompt = load_system_prompt(args.prompt_file)
             print(f"[pj] DEBUG: System prompt loaded (non-two-step), length: {len(system_prompt)} chars", file=sys.stderr)
@@ -1157,7 +3757,7 @@ def main():
         print(f"[pj] Error loading system prompt: {e}", file=sys.stderr)
         import traceback
         print(f"[pj] Traceback: {traceback.format_exc()}", file=sys.stderr)
-        sys.exit(1)
+        return 1
     
     # Analyze codebase
     try:
@@ -1186,46 +3786,58 @@ def main():
         except Exception as e:
             print(f"[pj] Warning: Could not load CodeRabbit analysis: {e}", file=sys.stderr)
     
-    # Generate patch
+    # Generate patch, with every provider call inside the overall task budget
+    start_task_budget()
+    reprompt_rejects = None
+    
+    # Determine API key
+    api_key = None
+    if provider == "openai":
+        api_key = env.get("OPENAI_API_KEY")
+    elif provider == "anthropic":
+        api_key = env.get("ANTHROPIC_API_KEY")
+    elif provider == "openrouter":
+        api_key = env.get("OPENROUTER_API_KEY")
+    
     try:
         if args.use_two_step:
             # Two-step approach: generate modified file, then use git diff
             print(f"[pj] Using two-step approach: generate modified file, then create diff", file=sys.stderr)
             
-            # Determine API key
-            api_key = None
-            if provider == "openai":
-                api_key = os.getenv("OPENAI_API_KEY")
-            elif provider == "anthropic":
-                api_key = os.getenv("ANTHROPIC_API_KEY")
-            elif provider == "openrouter":
-                api_key = os.getenv("OPENROUTER_API_KEY")
-            
             # Generate modified file content
-            modified_files = generate_modified_file_content(
-                system_prompt,
-                args.task,
-                codebase_analysis,
-                coderabbit_analysis,
-                relevant_files,
-                model=model,
-                provider=provider,
-                api_key=api_key,
-            )
-            
-            if not modified_files:
-                raise RuntimeError("No modified files generated")
-            
-            print(f"[pj] Generated modified content for {len(modified_files)} file(s):", file=sys.stderr)
-            for file_path in modified_files:
-                print(f"[pj]   - {file_path}", file=sys.stderr)
-            
-            # Generate patch using git diff
-            patch = generate_patch_from_modified_files(
-                args.repo_path,
-                modified_files,
-                args.out,
-            )
+            # Diff each file as soon as the streamed response completes it
+            streaming_diffs = StreamingDiffs(args.repo_path) if STREAM_RESPONSES else None
+            try:
+                modified_files = generate_modified_file_content(
+                    system_prompt,
+                    args.task,
+                    codebase_analysis,
+                    coderabbit_analysis,
+                    relevant_files,
+                    model=model,
+                    provider=provider,
+                    api_key=api_key,
+                    on_file=streaming_diffs.add if streaming_diffs else None,
+                    edit_system_prompt=edit_system_prompt,
+                )
+                
+                if not modified_files:
+                    raise RuntimeError("No modified files generated")
+                
+                print(f"[pj] Generated modified content for {len(modified_files)} file(s):", file=sys.stderr)
+                for file_path in modified_files:
+                    print(f"[pj]   - {file_path}", file=sys.stderr)
+                
+                # Generate patch using git diff
+                patch = generate_patch_from_modified_files(
+                    args.repo_path,
+                    modified_files,
+                    args.out,
+                    diffs=streaming_diffs,
+                )
+            finally:
+                if streaming_diffs:
+                    streaming_diffs.close()
             
             # Validate the generated patch
             if not patch or not patch.strip():
@@ -1247,6 +3859,21 @@ def main():
             # Original approach: generate diff directly
             print(f"[pj] Using direct diff generation approach", file=sys.stderr)
             
+            def reprompt_rejects(rejects: str, contents: Dict[str, str]) -> str:
+                # Ask only for the hunks that could not be placed, against the partly patched files
+                generate = generate_patch_openai if provider == "openai" else generate_patch_anthropic
+                followup_task = f"{args.task}\n\n{REJECTS_PROMPT}\n\n{rejects}"
+                return extract_diff_from_response(generate(
+                    system_prompt,
+                    followup_task,
+                    codebase_analysis,
+                    coderabbit_analysis,
+                    list(contents.items()),
+                    model=model,
+                    api_key=api_key,
+                    provider=provider,
+                ))
+            
             if provider == "openai":
                 patch = generate_patch_openai(
                     system_prompt,
@@ -1255,6 +3882,8 @@ def main():
                     coderabbit_analysis,
                     relevant_files,
                     model=model,
+                    api_key=api_key,
+                    provider=provider,
                 )
             elif provider == "anthropic":
                 patch = generate_patch_anthropic(
@@ -1264,6 +3893,8 @@ def main():
                     coderabbit_analysis,
                     relevant_files,
                     model=model,
+                    api_key=api_key,
+                    provider=provider,
                 )
             else:
                 raise ValueError(f"Unknown provider: {provider}")
@@ -1302,18 +3933,52 @@ def main():
             if patch and not patch.endswith('\n'):
                 patch += '\n'
         
-        # Write patch to output file
-        with open(args.out, "w") as f:
-            f.write(patch)
+        # Write patch to output file, checking it against the repository on the way
+        # (and rebuilding it from the hunks that can be placed if it does not apply)
+        write_patch(args.out, patch, args.repo_path, reprompt=reprompt_rejects)
         
         print(f"[pj] Patch generated successfully: {args.out}", file=sys.stderr)
         
     except TimeoutError as e:
         print(f"[pj] Error: {e}", file=sys.stderr)
-        sys.exit(124)  # Standard timeout exit code
+        return 124  # Standard timeout exit code
     except Exception as e:
         print(f"[pj] Error generating patch: {e}", file=sys.stderr)
-        sys.exit(1)
+        return 1
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate code patch using AI agent")
+    parser.add_argument("--prompt-file", type=Path, help="Path to system prompt file (required unless --serve)")
+    parser.add_argument("--task", type=str, help="Task description (required unless --serve)")
+    parser.add_argument("--repo-path", type=Path, default=Path.cwd(), help="Path to repository (default: current directory)")
+    parser.add_argument("--out", type=Path, help="Output file for patch (required unless --serve)")
+    parser.add_argument("--provider", type=str, choices=["openai", "anthropic", "openrouter"], default=None, help="LLM provider (default: from MODEL_PROVIDER env var)")
+    parser.add_argument("--model", type=str, default=None, help="Model name (default: from MODEL_NAME env var)")
+    parser.add_argument("--coderabbit-analysis", type=Path, help="Path to CodeRabbit analysis file (optional)")
+    parser.add_argument(
+        "--use-two-step", action=argparse.BooleanOptionalAction, default=True,
+        help="Use two-step approach (generate file, then diff) - default: true; --no-use-two-step has the model write the diff, re-prompting for hunks that cannot be placed"
+    )
+    parser.add_argument("--serve", action="store_true", help="Run as a daemon serving tasks on the AGENT_DAEMON_SOCKET unix socket")
+    
+    args = parser.parse_args()
+    
+    if args.serve:
+        if not DAEMON_SOCKET:
+            parser.error("--serve needs AGENT_DAEMON_SOCKET to be set")
+        serve(DAEMON_SOCKET)
+        return
+    missing = [flag for flag in ("--prompt-file", "--task", "--out") if getattr(args, flag[2:].replace("-", "_")) is None]
+    if missing:
+        parser.error(f"the following arguments are required: {', '.join(missing)}")
+    
+    # Hand the task to a running daemon if there is one, otherwise run it here
+    exit_code = run_in_daemon(args, DAEMON_SOCKET) if DAEMON_SOCKET else None
+    if exit_code is None:
+        exit_code = run_task(args)
+    sys.exit(exit_code)
 
 
 if __name__ == "__main__":
@@ -13,7 +13,8 @@ set -euo pipefail
 SCRIPT_REPO="${SCRIPT_REPO:-jakebutler/pithy-jaunt}"
 SCRIPT_BRANCH="${SCRIPT_BRANCH:-main}"  # Can be set to a specific commit SHA or tag
 SCRIPT_DISABLE_DOWNLOAD="${SCRIPT_DISABLE_DOWNLOAD:-false}"
-SCRIPT_BASE_URL="https://raw.githubusercontent.com/${SCRIPT_REPO}/${SCRIPT_BRANCH}/daytona"
+SCRIPT_REPO_URL="https://raw.githubusercontent.com/${SCRIPT_REPO}/${SCRIPT_BRANCH}"
+SCRIPT_BASE_URL="${SCRIPT_REPO_URL}/daytona"
 SCRIPT_DIR="/app"
 
 echo "[pj] ========================================"
@@ -32,7 +33,11 @@ else
     download_script() {
         local script_name=$1
         local target_path="${SCRIPT_DIR}/${script_name}"
+        # Optional second argument: the file's path in the repository, if it is not under daytona/
         local url="${SCRIPT_BASE_URL}/${script_name}"
+        if [ -n "${2:-}" ]; then
+            url="${SCRIPT_REPO_URL}/$2"
+        fi
         
         echo "[pj] Downloading ${script_name}..."
         if curl -fsSL --max-time 10 -o "${target_path}" "${url}" 2>/dev/null; then
@@ -54,8 +59,10 @@ else
     # Download execution scripts (with fallback to image versions)
     download_script "execution.sh" || true
     download_script "agent-runner.py" || true
+    download_script "pathfilter.py" "apps/gitingest/pathfilter.py" || true  # Shared with the GitIngest service
     download_script "system-prompt.md" || true
     download_script "system-prompt-file-generation.md" || true
+    download_script "system-prompt-edit-blocks.md" || true
     
     echo "[pj] ========================================"
     echo "[pj] Bootstrap complete"
@@ -293,7 +293,7 @@ send_webhook "task.progress" "running" "" "" "Running AI agent to generate code
 AGENT_RUNNER="${AGENT_RUNNER_PATH:-/app/agent-runner.py}"
 SYSTEM_PROMPT="${SYSTEM_PROMPT_PATH:-/app/system-prompt.md}"
 
-# CRITICAL: Use two-step approach (read file, generate modified content, then use git diff)
+# CRITICAL: Use two-step approach (read file, generate modified content, then diff it in-process)
 # This ensures the patch is generated from the actual file contents in the repository
 echo "[pj] Using two-step patch generation approach (reads files first, then generates patch)"
 echo "[pj] Repository state verification:"
@@ -309,7 +309,14 @@ if [ -n "$(git status --porcelain | grep -v '.coderabbit.yaml')" ]; then
 fi
 
 # Capture stderr from agent-runner for better error reporting
+# agent-runner writes /tmp/patch.diff.checked when the patch checked clean against the repository
+rm -f /tmp/patch.diff.checked /tmp/patch.diff.rej
 AGENT_RUNNER_STDERR=$(mktemp)
+# AGENT_TWO_STEP=false has the model write the diff itself (hunks that cannot be placed are re-prompted)
+TWO_STEP_FLAG="--use-two-step"
+if [ "${AGENT_TWO_STEP:-true}" = "false" ]; then
+  TWO_STEP_FLAG="--no-use-two-step"
+fi
 if ! python3 "$AGENT_RUNNER" \
   --prompt-file "$SYSTEM_PROMPT" \
   --task "$AGENT_PROMPT" \
@@ -317,7 +324,7 @@ if ! python3 "$AGENT_RUNNER" \
   --out /tmp/patch.diff \
   --provider "${MODEL_PROVIDER:-openai}" \
   --model "${MODEL:-gpt-4o}" \
-  --use-two-step 2>"$AGENT_RUNNER_STDERR"; then
+  "$TWO_STEP_FLAG" 2>"$AGENT_RUNNER_STDERR"; then
   # Read stderr for detailed error information
   AGENT_ERROR=$(cat "$AGENT_RUNNER_STDERR" 2>/dev/null || echo "Could not read agent-runner stderr")
   rm -f "$AGENT_RUNNER_STDERR"
@@ -344,6 +351,12 @@ if [ ! -f /tmp/patch.diff ] || [ ! -s /tmp/patch.diff ]; then
 fi
 
 echo "[pj] Patch generated successfully"
+
+# agent-runner rebuilds a patch that does not apply from the hunks it can place; the rest are listed here
+if [ -s /tmp/patch.diff.rej ]; then
+  echo "[pj] Warning: Some hunks could not be placed and are left out of the patch:"
+  cat /tmp/patch.diff.rej || true
+fi
 echo "[pj] Patch size: $(wc -l < /tmp/patch.diff) lines"
 
 # Show patch details for debugging
@@ -361,8 +374,15 @@ echo "[pj] Validating patch format..."
 # Disable ERR trap temporarily to handle errors manually
 trap - ERR
 set +e
-GIT_APPLY_CHECK_OUTPUT=$(git apply --check --verbose /tmp/patch.diff 2>&1)
-GIT_APPLY_CHECK_EXIT_CODE=$?
+if [ -f /tmp/patch.diff.checked ] && [ "$(cat /tmp/patch.diff.checked)" = "$(sha256sum /tmp/patch.diff | cut -d' ' -f1)" ]; then
+  # Already checked hunk by hunk by agent-runner, no need to fork git for it
+  echo "[pj] Patch was checked against the repository by agent-runner, skipping git apply --check"
+  GIT_APPLY_CHECK_OUTPUT=""
+  GIT_APPLY_CHECK_EXIT_CODE=0
+else
+  GIT_APPLY_CHECK_OUTPUT=$(git apply --check --verbose /tmp/patch.diff 2>&1)
+  GIT_APPLY_CHECK_EXIT_CODE=$?
+fi
 set -e
 # Re-enable ERR trap
 trap '{
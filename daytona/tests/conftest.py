@@ -0,0 +1,27 @@
+import importlib.util
+import subprocess
+from pathlib import Path
+
+import pytest
+
+AGENT_RUNNER = Path(__file__).resolve().parent.parent / "agent-runner.py"
+
+
+@pytest.fixture(scope="session")
+def agent_runner():
+    """agent-runner.py loaded as a module (its file name is not importable)"""
+    spec = importlib.util.spec_from_file_location("agent_runner", AGENT_RUNNER)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def git(cwd: Path, *args: str, check: bool = True) -> subprocess.CompletedProcess:
+    return subprocess.run(
+        [
+            "git", "-c", "core.autocrlf=false", "-c", "diff.algorithm=myers", "-c", "diff.indentHeuristic=true",
+            "-c", "diff.context=3", "-c", "diff.interHunkContext=0", "-c", "diff.suppressBlankEmpty=false",
+            "-c", "user.name=test", "-c", "user.email=test@example.com", *args
+        ],
+        cwd=cwd, capture_output=True, check=check
+    )
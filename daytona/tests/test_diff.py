@@ -0,0 +1,125 @@
+import io
+import os
+import random
+from pathlib import Path
+
+import pytest
+
+from conftest import git
+
+LONG = b"".join(b"line %d\n" % i for i in range(40))
+
+FIXTURES = {
+    "bare_cr": (b"one\rtwo\nthree\nfour\n", b"one\rTWO\nthree\nfour\n"),
+    "cr_line_change": (b"a\nb\rc\nd\n", b"a\nb\rC\nd\n"),
+    "form_feed": (b"x = 1\n\fsection\ny = 2\n", b"x = 1\n\fsection\ny = 3\n"),
+    "vertical_tab": (b"a\x0bb\nc\n", b"a\x0bb\nd\n"),
+    "no_eol": (b"first\nsecond", b"first\nchanged"),
+    "add_eol": (b"first\nsecond", b"first\nsecond\n"),
+    "crlf": (b"a\r\nb\r\nc\r\n", b"a\r\nB\r\nc\r\n"),
+    "mixed_endings": (b"a\r\nb\nc\rd\n", b"a\nb\r\nc\rd\n"),
+    "hunks": (LONG, LONG.replace(b"line 3\n", b"line three\n").replace(b"line 30\n", b"")),
+    "function_context": (
+        b"def f():\n" + LONG.replace(b"line", b"    x"),
+        b"def f():\n" + LONG.replace(b"line", b"    x").replace(b"x 20\n", b"y 20\n"),
+    ),
+}
+
+
+def git_hunks(tmp_path, old: bytes, new: bytes) -> bytes:
+    """The hunks `git diff --no-index` prints for two files"""
+    (tmp_path / "old").write_bytes(old)
+    (tmp_path / "new").write_bytes(new)
+    out = git(tmp_path, "diff", "--no-index", "--no-color", "old", "new", check=False).stdout
+    return out[out.index(b"\n@@") + 1:]
+
+
+@pytest.mark.parametrize("name", sorted(FIXTURES))
+def test_diff_lines_matches_git(agent_runner, tmp_path, name):
+    old, new = FIXTURES[name]
+    hunks = agent_runner.diff_lines(agent_runner.split_lines(old), agent_runner.split_lines(new))
+    assert hunks == git_hunks(tmp_path, old, new)
+
+
+@pytest.mark.parametrize("name", sorted(FIXTURES))
+def test_unified_diff_applies(agent_runner, tmp_path, name):
+    old, new = FIXTURES[name]
+    git(tmp_path, "init", "-q")
+    (tmp_path / "file.txt").write_bytes(old)
+    git(tmp_path, "add", "file.txt")
+    git(tmp_path, "commit", "-qm", "base")
+    (tmp_path / "fix.patch").write_text(agent_runner.unified_diff("file.txt", old, new))
+    git(tmp_path, "apply", "fix.patch")
+    assert (tmp_path / "file.txt").read_bytes() == new
+
+
+def test_split_lines_only_breaks_on_newline(agent_runner):
+    assert agent_runner.split_lines(b"a\rb\r\nc\fd\ne") == [b"a\rb\r\n", b"c\fd\n", b"e"]
+    assert agent_runner.split_lines(b"") == []
+
+
+def repository_root():
+    result = git(Path(__file__).parent, "rev-parse", "--show-toplevel", check=False)
+    if result.returncode != 0:
+        pytest.skip("not a git checkout")
+    return Path(result.stdout.decode().strip())
+
+
+def mutate(data: bytes, rng: random.Random) -> bytes:
+    """A few deletions, copied blocks, edited and added lines, as an edit by hand or by a model would make"""
+    lines = io.BytesIO(data).readlines()
+    for _ in range(rng.randint(1, 6)):
+        n = len(lines)
+        op = rng.randrange(4)
+        i = rng.randint(0, n)
+        if op == 0 and n:
+            del lines[i:i + rng.randint(1, 8)]
+        elif op == 1:
+            j = rng.randint(0, n)
+            lines[i:i] = lines[j:j + rng.randint(1, 8)] or [b"inserted\n"]
+        elif op == 2 and n:
+            i = min(i, n - 1)
+            lines[i] = b"changed " + lines[i]
+        else:
+            lines[i:i] = [b"\n", b"added %d\n" % rng.randrange(100)]
+    return b"".join(lines)
+
+
+def test_diff_lines_matches_git_on_repository_files(agent_runner, tmp_path):
+    root = repository_root()
+    mismatches, compared = [], 0
+    for path in git(root, "ls-files", "-z").stdout.split(b"\0"):
+        target = root / os.fsdecode(path)
+        if not path or not target.is_file():
+            continue
+        old = target.read_bytes()
+        if b"\0" in old[:8000]:
+            continue
+        new = mutate(old, random.Random(path))
+        compared += 1
+        if agent_runner.diff_lines(agent_runner.split_lines(old), agent_runner.split_lines(new)) != git_hunks(tmp_path, old, new):
+            mismatches.append(os.fsdecode(path))
+    assert compared
+    assert mismatches == []
+
+
+def test_diff_lines_matches_git_on_repository_history(agent_runner):
+    root = repository_root()
+    mismatches, compared = [], 0
+    for commit in git(root, "rev-list", "--no-merges", "--min-parents=1", "HEAD").stdout.decode().split():
+        for record in git(root, "diff-tree", "-r", "--no-renames", "--no-commit-id", commit + "^", commit).stdout.decode().splitlines():
+            meta, path = record.split("\t", 1)
+            _, _, old_id, new_id, status = meta.split()
+            if status != "M":
+                continue
+            old = git(root, "cat-file", "blob", old_id).stdout
+            new = git(root, "cat-file", "blob", new_id).stdout
+            if b"\0" in old[:8000] or b"\0" in new[:8000]:
+                continue
+            expected = git(root, "diff", "--no-color", "--no-ext-diff", old_id, new_id).stdout
+            compared += 1
+            if agent_runner.diff_lines(agent_runner.split_lines(old), agent_runner.split_lines(new)) != expected[expected.index(b"\n@@") + 1:]:
+                mismatches.append(f"{commit[:12]} {path}")
+    if not compared:
+        pytest.skip("no modified text files in the history")
+    assert mismatches == []
@@ -0,0 +1,102 @@
+import hashlib
+
+from conftest import git
+
+BASE = b"".join(b"line %d\n" % i for i in range(30))
+# Since the patches below were written, three lines were added at the top and line 11 was edited
+MOVED = b"new 1\nnew 2\nnew 3\n" + BASE.replace(b"line 11\n", b"line eleven\n")
+
+
+def make_repo(tmp_path, files):
+    repo = tmp_path / "repo"
+    repo.mkdir()
+    git(repo, "init", "-q")
+    for name, content in files.items():
+        (repo / name).write_bytes(content)
+    git(repo, "add", ".")
+    git(repo, "commit", "-qm", "base")
+    return repo
+
+
+def write(agent_runner, tmp_path, repo, patch):
+    out = tmp_path / "patch.diff"
+    written = agent_runner.write_patch(out, patch, repo)
+    marker = tmp_path / "patch.diff.checked"
+    rejects = tmp_path / "patch.diff.rej"
+    return (
+        written,
+        marker.read_text().strip() if marker.exists() else None,
+        rejects.read_text() if rejects.exists() else None,
+    )
+
+
+def git_applies(repo, tmp_path, patch) -> bool:
+    (tmp_path / "check.patch").write_text(patch)
+    return git(repo, "apply", "--check", str(tmp_path / "check.patch"), check=False).returncode == 0
+
+
+STALE = (
+    "--- a/file.txt\n+++ b/file.txt\n"
+    "@@ -8,5 +8,5 @@\n line 7\n line 8\n-line 9\n+line nine\n line 10\n line 11\n"
+)
+UNPLACEABLE = (
+    "--- a/file.txt\n+++ b/file.txt\n"
+    "@@ -20,2 +20,2 @@\n no such\n-line\n+here\n"
+)
+
+
+def test_clean_patch_is_marked(agent_runner, tmp_path):
+    repo = make_repo(tmp_path, {"file.txt": BASE})
+    patch = "--- a/file.txt\n+++ b/file.txt\n@@ -9,3 +9,3 @@\n line 8\n-line 9\n+line nine\n line 10\n"
+    written, marker, rejects = write(agent_runner, tmp_path, repo, patch)
+    assert written == patch
+    assert marker == hashlib.sha256(patch.encode()).hexdigest()
+    assert rejects is None
+
+
+def test_relocated_patch_is_rebuilt_and_marked(agent_runner, tmp_path):
+    repo = make_repo(tmp_path, {"file.txt": MOVED})
+    assert not git_applies(repo, tmp_path, STALE)
+    written, marker, rejects = write(agent_runner, tmp_path, repo, STALE)
+    assert "+line nine\n" in written
+    assert git_applies(repo, tmp_path, written)
+    assert marker == hashlib.sha256(written.encode()).hexdigest()
+    assert rejects is None
+
+
+def test_unplaceable_hunk_goes_to_rej(agent_runner, tmp_path):
+    repo = make_repo(tmp_path, {"file.txt": MOVED})
+    written, marker, rejects = write(agent_runner, tmp_path, repo, STALE + UNPLACEABLE.replace("--- a/file.txt\n+++ b/file.txt\n", ""))
+    assert "+line nine\n" in written and "here" not in written
+    assert git_applies(repo, tmp_path, written)
+    # The rebuilt patch still checks clean; what was left out is in the .rej file
+    assert marker == hashlib.sha256(written.encode()).hexdigest()
+    assert rejects == "diff a/file.txt b/file.txt\t(rejected hunks)\n@@ -20,2 +20,2 @@\n no such\n-line\n+here\n"
+
+
+def test_dropped_rename_is_not_marked(agent_runner, tmp_path):
+    repo = make_repo(tmp_path, {"file.txt": MOVED, "old.txt": b"moved\n"})
+    rename = "diff --git a/old.txt b/new.txt\nsimilarity index 100%\nrename from old.txt\nrename to new.txt\n"
+    written, marker, _ = write(agent_runner, tmp_path, repo, "diff --git a/file.txt b/file.txt\n" + STALE + rename)
+    assert "+line nine\n" in written and "new.txt" not in written
+    assert marker is None
+
+
+def test_non_utf8_rebuild_is_not_marked(agent_runner, tmp_path):
+    repo = make_repo(tmp_path, {"file.txt": MOVED.replace(b"line 7\n", b"caf\xe9 7\n")})
+    patch = STALE.replace("@@ -8,5 +8,5 @@\n line 7\n", "@@ -9,4 +9,4 @@\n")
+    written, marker, _ = write(agent_runner, tmp_path, repo, patch)
+    assert "+line nine\n" in written
+    # The rebuilt diff cannot carry the latin-1 byte in its context, so nothing vouches for it
+    assert not git_applies(repo, tmp_path, written)
+    assert marker is None
+
+
+def test_form_feed_file_is_healed(agent_runner, tmp_path):
+    repo = make_repo(tmp_path, {"file.txt": MOVED.replace(b"line 8\n", b"line\f8\n")})
+    patch = STALE.replace(" line 8\n-line 9\n+line nine\n", "-line\f8\n+line eight\n line 9\n")
+    written, marker, rejects = write(agent_runner, tmp_path, repo, patch)
+    assert "-line\f8\n+line eight\n" in written
+    assert git_applies(repo, tmp_path, written)
+    assert marker == hashlib.sha256(written.encode()).hexdigest()
+    assert rejects is None
@@ -0,0 +1,95 @@
+import pytest
+
+from conftest import git
+
+BASE = b"".join(b"line %d\n" % i for i in range(20))
+
+# (file content in the repository, content the patch is made from, content the patch turns it into)
+CASES = {
+    "clean": (BASE, BASE, BASE.replace(b"line 5\n", b"line five\n")),
+    "form_feed": (
+        BASE.replace(b"line 4\n", b"page\fbreak\n"),
+        BASE.replace(b"line 4\n", b"page\fbreak\n"),
+        BASE.replace(b"line 4\n", b"page\fbreak\n").replace(b"line 6\n", b"line six\n"),
+    ),
+    "bare_cr": (
+        BASE.replace(b"line 4\n", b"old\rmac\n"),
+        BASE.replace(b"line 4\n", b"old\rmac\n"),
+        BASE.replace(b"line 4\n", b"old\rmac\n").replace(b"line 5\n", b"line five\n"),
+    ),
+    "unicode_separators": (
+        BASE.replace(b"line 4\n", "a b\x1cc\n".encode()),
+        BASE.replace(b"line 4\n", "a b\x1cc\n".encode()),
+        BASE.replace(b"line 4\n", "a b\x1cc\n".encode()).replace(b"line 3\n", b"line three\n"),
+    ),
+    "crlf": (
+        BASE.replace(b"\n", b"\r\n"),
+        BASE.replace(b"\n", b"\r\n"),
+        BASE.replace(b"\n", b"\r\n").replace(b"line 9", b"line nine"),
+    ),
+    "no_eol": (BASE + b"tail", BASE + b"tail", BASE + b"tail\nmore"),
+    "stale_context": (
+        BASE.replace(b"line 6\n", b"line 6 edited\n"),
+        BASE,
+        BASE.replace(b"line 5\n", b"line five\n"),
+    ),
+    "cr_mismatch": (
+        BASE.replace(b"line 4\n", b"line 4\r\n"),
+        BASE,
+        BASE.replace(b"line 5\n", b"line five\n"),
+    ),
+}
+
+
+def make_patch(tmp_path, old: bytes, new: bytes) -> str:
+    source = tmp_path / "source"
+    source.mkdir()
+    git(source, "init", "-q")
+    (source / "file.txt").write_bytes(old)
+    git(source, "add", "file.txt")
+    (source / "file.txt").write_bytes(new)
+    return git(source, "diff", "--no-color").stdout.decode("utf-8", "surrogateescape")
+
+
+def make_repo(tmp_path, content: bytes):
+    repo = tmp_path / "repo"
+    repo.mkdir()
+    git(repo, "init", "-q")
+    (repo / "file.txt").write_bytes(content)
+    git(repo, "add", "file.txt")
+    git(repo, "commit", "-qm", "base")
+    return repo
+
+
+@pytest.mark.parametrize("name", sorted(CASES))
+def test_check_patch_agrees_with_git(agent_runner, tmp_path, name):
+    content, old, new = CASES[name]
+    patch = make_patch(tmp_path, old, new)
+    repo = make_repo(tmp_path, content)
+    (tmp_path / "fix.patch").write_text(patch, errors="surrogateescape")
+    git_ok = git(repo, "apply", "--check", str(tmp_path / "fix.patch"), check=False).returncode == 0
+    
+    files, parse_errors = agent_runner.parse_patch(patch)
+    assert parse_errors == []
+    errors, complete = agent_runner.check_patch(files, repo)
+    assert complete
+    assert (errors == []) == git_ok, errors
+
+
+def test_validate_diff_format_wants_context_around_changes(agent_runner):
+    patch = (
+        "--- a/file.txt\n+++ b/file.txt\n"
+        "@@ -5,2 +5,2 @@\n-line 4\n+line four\n line 5\n"
+        "@@ -10,2 +10,2 @@\n line 9\n-line 10\n+line ten\n"
+    )
+    is_valid, errors = agent_runner.validate_diff_format(patch)
+    assert not is_valid
+    assert errors == [
+        "Hunk 1: Missing context lines before changes (should have at least 3 lines of context before first - or +)",
+        "Hunk 2: Missing context lines after changes (should have at least 3 lines of context after last - or +)",
+    ]
+
+
+def test_validate_diff_format_allows_changes_at_end_of_file(agent_runner):
+    patch = "--- a/file.txt\n+++ b/file.txt\n@@ -9,2 +9,2 @@\n line 9\n-tail\n\\ No newline at end of file\n+end\n\\ No newline at end of file\n"
+    assert agent_runner.validate_diff_format(patch) == (True, [])
@@ -22,9 +22,25 @@ export interface GitIngestWebhookPayload {
   branch: string;
   status: "completed" | "failed";
   report?: GitIngestReport;
+  /** Sent instead of `report` when the service runs with WEBHOOK_DELTA=true */
+  reportDelta?: GitIngestReportDelta;
   error?: string;
 }
 
+export interface GitIngestReportDelta {
+  /** Identifies the previously delivered report the delta applies to */
+  base: {
+    commitSha?: string | null;
+    generatedAt: number;
+  };
+  /** Changed values by dotted path, e.g. "structure.fileCount" */
+  set?: Record<string, unknown>;
+  /** Dotted paths of removed keys */
+  remove?: string[];
+  /** Edits to string lists: removed items and [index, item] insertions */
+  lists?: Record<string, { removed: string[]; added: [number, string][] }>;
+}
+
 export interface GitIngestReport {
   summary: string;
   structure: {
@@ -45,6 +61,7 @@ export interface GitIngestReport {
     packageManager: string;
   };
   llmContext: string;
+  commitSha?: string;
   generatedAt: number;
 }
 
@@ -0,0 +1,87 @@
+/**
+ * GitIngest Report Deltas
+ *
+ * Rebuilds a report from a delta callback payload and the report stored from
+ * the previous callback (see `report_delta` in apps/gitingest/main.py)
+ */
+
+import { GitIngestReport, GitIngestReportDelta } from './client';
+
+type JsonObject = Record<string, unknown>;
+
+function isObject(value: unknown): value is JsonObject {
+  return typeof value === 'object' && value !== null && !Array.isArray(value);
+}
+
+/**
+ * Find the object holding the last key of a dotted path, creating missing
+ * parents when `create` is set
+ */
+function parentOf(
+  root: JsonObject,
+  path: string,
+  create: boolean
+): [JsonObject, string] | null {
+  const keys = path.split('.');
+  const last = keys.pop() as string;
+  let node = root;
+  for (const key of keys) {
+    if (!isObject(node[key])) {
+      if (!create) {
+        return null;
+      }
+      node[key] = {};
+    }
+    node = node[key] as JsonObject;
+  }
+  return [node, last];
+}
+
+/**
+ * Apply a report delta to the stored base report.
+ * Returns null when the base is missing or is not the report the delta was
+ * computed against; the caller should then ask for the full report.
+ */
+export function applyReportDelta(
+  base: GitIngestReport | null | undefined,
+  delta: GitIngestReportDelta
+): GitIngestReport | null {
+  if (
+    !base ||
+    base.generatedAt !== delta.base.generatedAt ||
+    (base.commitSha ?? null) !== (delta.base.commitSha ?? null)
+  ) {
+    return null;
+  }
+
+  const report = structuredClone(base) as unknown as JsonObject;
+
+  for (const path of delta.remove ?? []) {
+    const parent = parentOf(report, path, false);
+    if (parent) {
+      delete parent[0][parent[1]];
+    }
+  }
+
+  for (const [path, value] of Object.entries(delta.set ?? {})) {
+    const [parent, key] = parentOf(report, path, true) as [JsonObject, string];
+    parent[key] = value;
+  }
+
+  for (const [path, edits] of Object.entries(delta.lists ?? {})) {
+    const parent = parentOf(report, path, false);
+    const current = parent?.[0][parent[1]];
+    if (!parent || !Array.isArray(current)) {
+      return null;
+    }
+    const removed = new Set(edits.removed);
+    const items = (current as string[]).filter((item) => !removed.has(item));
+    // Insertions are indexes into the new list, in ascending order
+    for (const [index, item] of edits.added) {
+      items.splice(index, 0, item);
+    }
+    parent[0][parent[1]] = items;
+  }
+
+  return report as unknown as GitIngestReport;
+}
@@ -0,0 +1,69 @@
+import { describe, it, expect } from 'vitest';
+import { applyReportDelta } from '@/lib/gitingest/delta';
+import { GitIngestReport } from '@/lib/gitingest/client';
+
+const base: GitIngestReport = {
+  summary: 'Repository: owner/repo',
+  structure: {
+    directories: ['app', 'lib', 'lib/old', 'tests'],
+    fileCount: 10,
+    languages: ['TypeScript'],
+    entryPoints: ['index.ts'],
+  },
+  patterns: {
+    framework: 'Next.js',
+    architecture: 'standard',
+    testing: ['Vitest'],
+    buildTools: ['npm'],
+  },
+  dependencies: {
+    runtime: ['next'],
+    dev: ['vitest'],
+    packageManager: 'npm',
+  },
+  llmContext: '# Repository Context',
+  commitSha: 'abc123',
+  generatedAt: 1000,
+};
+
+describe('applyReportDelta', () => {
+  it('should apply set, remove and list edits', () => {
+    const report = applyReportDelta(base, {
+      base: { commitSha: 'abc123', generatedAt: 1000 },
+      set: { 'structure.fileCount': 12, commitSha: 'def456', generatedAt: 2000 },
+      remove: ['llmContext'],
+      lists: {
+        'structure.directories': {
+          removed: ['lib/old'],
+          added: [[0, 'api'], [3, 'lib/new']],
+        },
+      },
+    });
+
+    expect(report).not.toBeNull();
+    expect(report?.structure.directories).toEqual(['api', 'app', 'lib', 'lib/new', 'tests']);
+    expect(report?.structure.fileCount).toBe(12);
+    expect(report?.commitSha).toBe('def456');
+    expect(report?.generatedAt).toBe(2000);
+    expect(report).not.toHaveProperty('llmContext');
+  });
+
+  it('should not modify the base report', () => {
+    applyReportDelta(base, {
+      base: { commitSha: 'abc123', generatedAt: 1000 },
+      set: { summary: 'changed' },
+    });
+
+    expect(base.summary).toBe('Repository: owner/repo');
+  });
+
+  it('should return null when the base does not match', () => {
+    const delta = {
+      base: { commitSha: 'abc123', generatedAt: 999 },
+      set: { summary: 'changed' },
+    };
+
+    expect(applyReportDelta(base, delta)).toBeNull();
+    expect(applyReportDelta(undefined, delta)).toBeNull();
+  });
+});